@@ -1,14 +1,166 @@
 """Test REST API."""
 
+import asyncio
+import io
+
 import httpx
+import pytest
 from fastapi.testclient import TestClient
+from PIL import Image
+from pytest_mock import MockerFixture
 
+from mnist_sagemaker_ci_cd.lib.raw_format import RAW_CONTENT_TYPE, RAW_IMAGE_BYTES
+from mnist_sagemaker_ci_cd.lib.stage_metrics import REQUEST_ID_PATTERN, request_id
+from serverless import api
 from serverless.api import app
+from serverless.backends import custom_attributes
+from serverless.cache import MemoryStore, PredictionCache
+from serverless.preprocess import Preprocessor
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def cache(monkeypatch: pytest.MonkeyPatch) -> PredictionCache:
+    """Give every test an empty prediction cache, so it never sees another test's predictions."""
+    cache = PredictionCache(MemoryStore(), model_version="test")
+    monkeypatch.setattr(api, "cache", cache)
+    return cache
+
+
+def _png(size: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.linear_gradient("L").resize((size, size)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
 def test_read_root() -> None:
     """Test that reading the root is successful."""
     response = client.get("/")
     assert httpx.codes.is_success(response.status_code)
+
+
+def test_predict_file(mocker: MockerFixture) -> None:
+    """Test that an upload is forwarded to the backend and its prediction returned."""
+    predict = mocker.patch.object(api.backend, "predict", mocker.AsyncMock(return_value=4))
+    response = client.post("/predict", files={"file": ("4.png", b"image bytes")})
+    assert response.json() == {"filename": "4.png", "prediction": 4}
+    predict.assert_awaited_once_with(b"image bytes")
+
+
+def test_request_id_and_metrics(mocker: MockerFixture) -> None:
+    """Test that request IDs are echoed and the /predict stages are served on /metrics."""
+    mocker.patch.object(api.backend, "predict", mocker.AsyncMock(return_value=4))
+    response = client.post(
+        "/predict", files={"file": ("4.png", b"other bytes")}, headers={"X-Request-ID": "abc"}
+    )
+    assert response.headers["X-Request-ID"] == "abc"
+    assert client.get("/").headers["X-Request-ID"] != "abc"
+    assert 'mnist_api_stage_latency_ms_count{stage="api.read"}' in client.get("/metrics").text
+
+
+def _record_attributes(mocker: MockerFixture) -> list[str]:
+    """Stub the backend's invocations, and record the custom attributes each would send."""
+    sent = []
+
+    async def invoke(body, *args, **kwargs):
+        sent.append(custom_attributes())
+        return b'{"prediction": [4, 4]}', "application/json"
+
+    mocker.patch.object(api.backend, "invoke", side_effect=invoke)
+    return sent
+
+
+def test_malformed_request_ids_are_replaced(mocker: MockerFixture) -> None:
+    """Test that a request ID that would inject a custom attribute is replaced by a new one."""
+    sent = _record_attributes(mocker)
+    response = client.post(
+        "/predict",
+        files={"file": ("4.png", b"injected bytes")},
+        headers={"X-Request-ID": "x,top-k=evil"},
+    )
+    replaced = response.headers["X-Request-ID"]
+    assert replaced != "x,top-k=evil"
+    assert REQUEST_ID_PATTERN.fullmatch(replaced)
+    assert sent == [f"request-id={replaced}"]
+
+
+def test_batched_invocations_carry_their_own_request_id(mocker: MockerFixture) -> None:
+    """Test that a batch is not sent with the request ID of the request it runs on behalf of."""
+    sent = _record_attributes(mocker)
+
+    async def main():
+        request_id.set("submitter")
+        predictions = await api.backend.predict_batch([b"0", b"1"])
+        return predictions, request_id.get()
+
+    assert asyncio.run(main()) == ([4, 4], "submitter")
+    (attributes,) = sent
+    assert attributes.startswith("request-id=")
+    assert attributes != "request-id=submitter"
+
+
+def test_predict_file_passes_binary_responses_through(mocker: MockerFixture) -> None:
+    """Test that a binary Accept and a top-k skip the cache and return the endpoint's body as is."""
+    invoke = mocker.patch.object(
+        api.backend, "invoke", mocker.AsyncMock(return_value=(b"\x93NUMPY", "application/x-npy"))
+    )
+    response = client.post(
+        "/predict?top_k=3",
+        files={"file": ("4.png", b"image bytes")},
+        headers={"Accept": "application/x-npy"},
+    )
+    assert response.headers["Content-Type"] == "application/x-npy"
+    assert response.content == b"\x93NUMPY"
+    invoke.assert_awaited_once_with(
+        b"image bytes", accept="application/x-npy", attributes={"top-k": 3}
+    )
+
+
+def test_predict_file_top_k_as_json(mocker: MockerFixture) -> None:
+    """Test that top-k JSON responses are unwrapped like single predictions."""
+    body = b'{"prediction": [4], "labels": [[4, 9]], "scores": [[0.75, 0.25]]}'
+    mocker.patch.object(
+        api.backend, "invoke", mocker.AsyncMock(return_value=(body, "application/json"))
+    )
+    response = client.post("/predict?top_k=2", files={"file": ("4.png", b"image bytes")})
+    assert response.json() == {
+        "filename": "4.png",
+        "prediction": 4,
+        "labels": [4, 9],
+        "scores": [0.75, 0.25],
+    }
+
+
+def test_predict_file_preprocesses_uploads(mocker: MockerFixture) -> None:
+    """Test that preprocessing sends the endpoint raw pixels, and reports the bytes it saved."""
+    predict = mocker.patch.object(api.backend, "predict", mocker.AsyncMock(return_value=4))
+    mocker.patch.object(api, "preprocessor", Preprocessor())
+    mocker.patch.object(api, "UPLOAD_KWARGS", {"content_type": RAW_CONTENT_TYPE})
+    upload = _png(280)
+    response = client.post("/predict", files={"file": ("4.png", upload)})
+    assert response.json() == {"filename": "4.png", "prediction": 4}
+    (pixels,), kwargs = predict.await_args
+    assert len(pixels) == RAW_IMAGE_BYTES
+    assert kwargs == {"content_type": RAW_CONTENT_TYPE}
+    assert client.get("/preprocess").json()["bytes_saved"] == len(upload) - RAW_IMAGE_BYTES
+
+    response = client.post("/predict", files={"file": ("4.png", b"not an image")})
+    assert response.status_code == httpx.codes.BAD_REQUEST
+
+
+def test_predict_file_rejects_large_uploads(mocker: MockerFixture) -> None:
+    """Test that uploads over the byte or pixel limits are rejected before they are scored."""
+    predict = mocker.patch.object(api.backend, "predict", mocker.AsyncMock(return_value=4))
+    mocker.patch.object(api, "MAX_UPLOAD_BYTES", 1000)
+    response = client.post(
+        "/predict", files={"file": ("4.png", bytes(2000))}, headers={"X-Request-ID": "big"}
+    )
+    assert response.status_code == httpx.codes.REQUEST_ENTITY_TOO_LARGE
+    assert response.headers["X-Request-ID"] == "big"
+
+    mocker.patch.object(api, "MAX_UPLOAD_BYTES", 10_000)
+    mocker.patch.object(api, "preprocessor", Preprocessor(max_image_pixels=28 * 28))
+    response = client.post("/predict", files={"file": ("4.png", _png(29))})
+    assert response.status_code == httpx.codes.REQUEST_ENTITY_TOO_LARGE
+    predict.assert_not_awaited()
@@ -0,0 +1,78 @@
+"""Test the inference backends of the REST API."""
+
+import asyncio
+import io
+from http import HTTPStatus
+from pathlib import Path
+
+import pytest
+import torch
+from fastapi import HTTPException
+from PIL import Image
+
+from mnist_sagemaker_ci_cd.benchmarks.runtime import StubEndpoint
+from mnist_sagemaker_ci_cd.lib.net import Net
+from serverless.backends import LocalBackend, SageMakerBackend
+
+
+@pytest.fixture
+def endpoint(monkeypatch: pytest.MonkeyPatch):
+    """Serve a local stub of the SageMaker runtime API."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "stub")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "stub")
+    stub = StubEndpoint(delay_ms=50)
+    yield stub
+    stub.close()
+
+
+def test_sagemaker_backend_runs_invocations_concurrently(endpoint: StubEndpoint) -> None:
+    """Test that in-flight invocations overlap instead of blocking the event loop."""
+    backend = SageMakerBackend("stub", max_concurrency=8, endpoint_url=endpoint.url)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        predictions = await asyncio.gather(*(backend.predict(b"image") for _ in range(8)))
+        return predictions, loop.time() - start
+
+    predictions, elapsed = asyncio.run(main())
+    backend.close()
+    assert predictions == [0] * 8
+    assert elapsed < 8 * endpoint.delay_ms / 1000
+
+
+def test_local_backend_scores_uploads_in_process(tmp_path: Path) -> None:
+    """Test that the local backend serves a saved model through the inference handlers."""
+    torch.save(Net().state_dict(), tmp_path / "model.pth")
+    backend = LocalBackend(str(tmp_path), workers=2)
+    image = io.BytesIO()
+    Image.new("L", (28, 28)).save(image, format="PNG")
+
+    async def main():
+        return await asyncio.gather(
+            backend.predict(image.getvalue()), backend.predict_batch([image.getvalue()] * 3)
+        )
+
+    prediction, predictions = asyncio.run(main())
+    backend.close()
+    assert prediction in range(10)
+    assert predictions == [prediction] * 3
+
+
+def test_local_backend_raises_client_errors(tmp_path: Path) -> None:
+    """Test that uploads and attributes the handlers reject are client errors, not server errors."""
+    torch.save(Net().state_dict(), tmp_path / "model.pth")
+    backend = LocalBackend(str(tmp_path), workers=2)
+    image = io.BytesIO()
+    Image.new("L", (28, 28)).save(image, format="PNG")
+
+    async def main(body, attributes=None):
+        with pytest.raises(HTTPException) as excinfo:
+            await backend.invoke(body, attributes=attributes)
+        return excinfo.value.status_code
+
+    try:
+        assert asyncio.run(main(b"garbage")) == HTTPStatus.BAD_REQUEST
+        assert asyncio.run(main(image.getvalue(), {"top-k": -1})) == HTTPStatus.BAD_REQUEST
+    finally:
+        backend.close()
@@ -0,0 +1,83 @@
+"""Test the local SageMaker endpoint emulator and its load generator."""
+
+import asyncio
+import io
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from botocore.exceptions import ClientError
+
+from mnist_sagemaker_ci_cd.benchmarks.endpoint import LocalEndpoint, closed_loop, open_loop
+from mnist_sagemaker_ci_cd.lib.net import Net
+from serverless.backends import SageMakerBackend
+
+TOP_K = 3
+WORKERS = 2
+
+
+@pytest.fixture(scope="module")
+def endpoint(tmp_path_factory: pytest.TempPathFactory):
+    """Serve an untrained model with two worker processes."""
+    model_dir = tmp_path_factory.mktemp("model")
+    torch.save(Net().state_dict(), Path(model_dir) / "model.pth")
+    with LocalEndpoint(str(model_dir), workers=WORKERS) as endpoint:
+        yield endpoint
+
+
+@pytest.fixture
+def backend(endpoint: LocalEndpoint, monkeypatch: pytest.MonkeyPatch):
+    """The API's SageMaker backend, pointed at the emulator."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "local")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "local")
+    backend = SageMakerBackend(
+        "local", max_concurrency=8, endpoint_url=endpoint.url, max_attempts=1
+    )
+    yield backend
+    backend.close()
+
+
+def test_endpoint_serves_the_sagemaker_contracts(
+    endpoint: LocalEndpoint, backend: SageMakerBackend
+) -> None:
+    """Test the container's /ping, and invocations and errors through the runtime API."""
+    with urllib.request.urlopen(f"{endpoint.url}/ping") as response:
+        assert response.status == 200  # noqa: PLR2004
+    assert endpoint.kind == "eager"
+
+    async def main():
+        return await asyncio.gather(
+            backend.predict(bytes(784)),
+            backend.invoke(
+                bytes(784 * 2), "application/x-mnist-uint8", "application/x-npy", {"top-k": TOP_K}
+            ),
+        )
+
+    prediction, (body, content_type) = asyncio.run(main())
+    assert prediction in range(10)
+    assert content_type == "application/x-npy"
+    records = np.load(io.BytesIO(body))
+    assert records["label"].shape == (2, TOP_K)
+    assert records["label"][0, 0] == prediction
+
+    with pytest.raises(ClientError) as excinfo:
+        asyncio.run(backend.invoke(bytes(784), accept="text/csv"))
+    assert excinfo.value.response["Error"]["Code"] == "ModelError"
+    assert excinfo.value.response["OriginalStatusCode"] == 406  # noqa: PLR2004
+
+
+def test_load_generator_reports_both_loops(backend: SageMakerBackend) -> None:
+    """Test that closed-loop and open-loop runs report their throughput and percentiles."""
+
+    async def invoke():
+        return await backend.invoke(bytes(784), "application/x-mnist-uint8")
+
+    async def main():
+        return await closed_loop(invoke, WORKERS, 0.5), await open_loop(invoke, 50, 0.5)
+
+    for result in asyncio.run(main()):
+        assert result["requests"] > 0
+        assert result["errors"] == 0
+        assert 0 < result["p50_ms"] <= result["p99_ms"]
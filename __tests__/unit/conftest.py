@@ -0,0 +1,143 @@
+"""Stubs of the training dependencies that are not installed where the unit tests run."""
+
+import copy
+import functools
+import importlib
+import sys
+import types
+from collections.abc import Callable, Iterator
+
+import pytest
+import torch
+
+TRAIN_MODULE = "mnist_sagemaker_ci_cd.lib.train"
+
+
+class HorovodInternalError(RuntimeError):
+    """Raised by a collective when a worker was lost, like Horovod's."""
+
+
+class FakeTorchState:
+    """`hvd.elastic.TorchState` on one worker: the model, optimizer and attributes last committed.
+
+    Attributes:
+        commits (int): The commits so far.
+        restores (int): The restores so far.
+    """
+
+    def __init__(self, model: torch.nn.Module, optimizer: torch.optim.Optimizer, **kwargs) -> None:
+        """Commit the initial state."""
+        self.model, self.optimizer = model, optimizer
+        self.__dict__.update(kwargs)
+        self._names = list(kwargs)
+        self.commits = self.restores = 0
+        self._save()
+
+    def commit(self) -> None:
+        """Save the state in memory."""
+        self._save()
+        self.commits += 1
+
+    def restore(self) -> None:
+        """Go back to the last commit."""
+        model, optimizer, attributes = self._saved
+        self.model.load_state_dict(model)
+        self.optimizer.load_state_dict(optimizer)
+        self.__dict__.update(attributes)
+        self.restores += 1
+
+    def sync(self) -> None:
+        """Broadcast the state of rank 0, which every worker has here."""
+
+    def _save(self) -> None:
+        self._saved = (
+            copy.deepcopy(self.model.state_dict()),
+            copy.deepcopy(self.optimizer.state_dict()),
+            {name: getattr(self, name) for name in self._names},
+        )
+
+
+class FakeHorovod(types.ModuleType):
+    """The parts of `horovod.torch` that train.py uses, for one worker of a simulated job.
+
+    Collectives return this worker's own values, as if every other worker had the same ones. The
+    elastic job restores the last commit and calls the training function again whenever it raises
+    `HorovodInternalError`, like Horovod Elastic does when a worker is lost.
+
+    Attributes:
+        world_rank (int): The rank of this worker.
+        world_size (int): The number of workers.
+        world_after_reset (tuple[int, int]): The rank and number of workers after a reset.
+        resets (int): The resets of the elastic job so far.
+    """
+
+    Sum, Average = "sum", "average"
+    HorovodInternalError = HorovodInternalError
+
+    def __init__(self) -> None:
+        """Start as the only worker."""
+        super().__init__("horovod.torch")
+        self.world_rank, self.world_size = 0, 1
+        self.world_after_reset = (0, 1)
+        self.resets = 0
+        self.Compression = types.SimpleNamespace(none="none", fp16="fp16")
+        self.elastic = types.SimpleNamespace(run=self._run, TorchState=FakeTorchState)
+
+    def rank(self) -> int:
+        """The rank of this worker."""
+        return self.world_rank
+
+    def size(self) -> int:
+        """The number of workers."""
+        return self.world_size
+
+    def local_rank(self) -> int:
+        """The rank of this worker on its host, where it is alone."""
+        return 0
+
+    def broadcast_object(self, obj: object, root_rank: int = 0, name: str = "") -> object:
+        """Return the object of the root rank, this worker's."""
+        return obj
+
+    def allreduce(self, tensor: object, op: str = Average, name: str = "") -> object:
+        """Return the reduced tensor, this worker's."""
+        return tensor
+
+    def _run(self, func: Callable) -> Callable:
+        """Run `func` from the last commit until it returns, like `hvd.elastic.run`."""
+
+        @functools.wraps(func)
+        def wrapper(state: FakeTorchState, *args, **kwargs) -> object:
+            while True:
+                state.sync()
+                try:
+                    return func(state, *args, **kwargs)
+                except HorovodInternalError:
+                    state.restore()
+                self.resets += 1
+                self.world_rank, self.world_size = self.world_after_reset
+
+        return wrapper
+
+
+@pytest.fixture
+def hvd(monkeypatch: pytest.MonkeyPatch) -> FakeHorovod:
+    """Stub Horovod, and W&B, which train.py imports."""
+    hvd = FakeHorovod()
+    horovod = types.ModuleType("horovod")
+    horovod.torch = hvd  # type: ignore[attr-defined]
+    monkeypatch.setitem(sys.modules, "horovod", horovod)
+    monkeypatch.setitem(sys.modules, "horovod.torch", hvd)
+    monkeypatch.setitem(sys.modules, "wandb", types.ModuleType("wandb"))
+    return hvd
+
+
+@pytest.fixture
+def train(hvd: FakeHorovod) -> Iterator[types.ModuleType]:
+    """train.py, imported against the stubs, and forgotten afterwards."""
+    sys.modules.pop(TRAIN_MODULE, None)
+    module = importlib.import_module(TRAIN_MODULE)
+    yield module
+    sys.modules.pop(TRAIN_MODULE, None)
+    # Every import adds a handler to the module's logger.
+    module.logger.handlers.clear()
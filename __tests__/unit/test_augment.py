@@ -0,0 +1,61 @@
+"""Test the batch augmentation of the training images."""
+
+import torch
+
+from mnist_sagemaker_ci_cd.lib.augment import BACKGROUND, BatchAugment
+
+CPU = torch.device("cpu")
+ELASTIC_ALPHA = 3.0
+
+
+def _images() -> torch.Tensor:
+    """A batch of normalized images: a bright square on the background."""
+    torch.manual_seed(0)
+    images = torch.full((16, 1, 28, 28), BACKGROUND)
+    images[:, :, 8:20, 8:20] = torch.rand(16, 1, 12, 12) + 1
+    return images
+
+
+def test_disabled_transforms_leave_the_batch_unchanged() -> None:
+    """Test that the identity transforms resample every pixel to itself."""
+    images = _images()
+    augment = BatchAugment(CPU, degrees=0, translate=0, scale=0)
+    assert torch.allclose(augment(images), images, atol=1e-5)
+
+
+def test_augmentation_is_seeded_per_rank_and_epoch() -> None:
+    """Test that the same seed, rank and epoch draw the same transforms, and others differ."""
+    images = _images()
+
+    def augmented(rank: int, epoch: int) -> torch.Tensor:
+        augment = BatchAugment(CPU, seed=1, rank=rank, elastic_alpha=2.0, erasing=0.5)
+        augment.set_epoch(epoch)
+        return augment(images)
+
+    assert torch.equal(augmented(0, 1), augmented(0, 1))
+    assert not torch.equal(augmented(0, 1), augmented(1, 1))
+    assert not torch.equal(augmented(0, 1), augmented(0, 2))
+
+
+def test_transforms_move_pixels_within_their_bounds() -> None:
+    """Test that the background comes in from outside, and elastic moves stay within alpha."""
+    images = _images()
+    shifted = BatchAugment(CPU, degrees=0, translate=0.25, scale=0)(images)
+    assert torch.allclose(shifted[:, :, 0], torch.full_like(shifted[:, :, 0], BACKGROUND))
+    assert not torch.allclose(shifted, images)
+
+    augment = BatchAugment(CPU, degrees=0, translate=0, scale=0, elastic_alpha=ELASTIC_ALPHA)
+    displacement = augment._displacement(images) * 28 / 2
+    assert 0 < displacement.abs().max() <= ELASTIC_ALPHA + 1e-5
+
+
+def test_erasing_blanks_one_rectangle_per_image() -> None:
+    """Test that every image gets one erased rectangle of zeros, when erasing always."""
+    images = _images() + 10
+    erased = BatchAugment(CPU, degrees=0, translate=0, scale=0, erasing=1.0)(images) == 0
+    for mask in erased[:, 0]:
+        rows, columns = mask.any(1).nonzero(), mask.any(0).nonzero()
+        assert len(rows)
+        assert len(columns)
+        assert mask.sum() == len(rows) * len(columns)
+        assert len(rows) == rows.max() - rows.min() + 1
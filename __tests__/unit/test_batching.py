@@ -0,0 +1,106 @@
+"""Test the micro-batching layer of the REST API."""
+
+import asyncio
+from http import HTTPStatus
+
+import pytest
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+
+from serverless.batching import MicroBatcher, rejected_body
+
+
+def test_concurrent_requests_share_one_backend_call() -> None:
+    """Test that concurrent payloads are scored together and fanned back out in order."""
+    batches = []
+
+    async def predict_batch(payloads):
+        batches.append(list(payloads))
+        return [payload.decode() for payload in payloads]
+
+    async def main():
+        batcher = MicroBatcher(predict_batch, max_batch_size=8, window_ms=50)
+        return await asyncio.gather(*(batcher.submit(str(i).encode()) for i in range(5)))
+
+    assert asyncio.run(main()) == ["0", "1", "2", "3", "4"]
+    assert len(batches) == 1
+
+
+def test_full_batches_flush_before_the_window_closes() -> None:
+    """Test that a batch is dispatched as soon as it reaches the maximum size."""
+    batches = []
+
+    async def predict_batch(payloads):
+        batches.append(len(payloads))
+        return list(payloads)
+
+    async def main():
+        batcher = MicroBatcher(predict_batch, max_batch_size=2, window_ms=60_000)
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(b"x") for _ in range(4))), 5)
+
+    assert asyncio.run(main()) == [b"x"] * 4
+    assert batches == [2, 2]
+
+
+def test_backend_errors_reach_every_caller() -> None:
+    """Test that a backend that fails every call fails every request of the batch."""
+    batches = []
+
+    async def predict_batch(payloads):
+        batches.append(len(payloads))
+        raise RuntimeError("endpoint unavailable")
+
+    async def main():
+        batcher = MicroBatcher(predict_batch, max_batch_size=8, window_ms=50)
+        return await asyncio.gather(
+            *(batcher.submit(b"x") for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # Not retried one payload at a time, which would only load an unavailable endpoint more.
+    assert batches == [3]
+
+
+def test_bad_payloads_only_fail_their_own_callers() -> None:
+    """Test that a failed batch is retried one payload at a time, failing only the bad ones."""
+    batches = []
+
+    async def predict_batch(payloads):
+        batches.append(len(payloads))
+        if b"bad" in payloads:
+            raise HTTPException(HTTPStatus.BAD_REQUEST, "Could not decode the upload as an image")
+        return [payload.decode() for payload in payloads]
+
+    async def main():
+        batcher = MicroBatcher(predict_batch, max_batch_size=8, window_ms=50)
+        return await asyncio.gather(
+            *(batcher.submit(payload) for payload in (b"0", b"bad", b"2")), return_exceptions=True
+        )
+
+    first, bad, last = asyncio.run(main())
+    assert (first, last) == ("0", "2")
+    assert isinstance(bad, HTTPException)
+    assert batches == [3, 1, 1, 1]
+
+
+def _client_error(code: str, status: int) -> ClientError:
+    response = {"Error": {"Code": code}, "ResponseMetadata": {"HTTPStatusCode": status}}
+    return ClientError(response, "InvokeEndpoint")  # type: ignore[arg-type]
+
+
+@pytest.mark.parametrize(
+    ("error", "rejected"),
+    [
+        (HTTPException(HTTPStatus.BAD_REQUEST), True),
+        (HTTPException(HTTPStatus.SERVICE_UNAVAILABLE), False),
+        (_client_error("ModelError", HTTPStatus.FAILED_DEPENDENCY), True),
+        (_client_error("ValidationError", HTTPStatus.BAD_REQUEST), True),
+        (_client_error("ThrottlingException", HTTPStatus.TOO_MANY_REQUESTS), False),
+        (_client_error("ServiceUnavailable", HTTPStatus.SERVICE_UNAVAILABLE), False),
+        (TimeoutError(), False),
+    ],
+)
+def test_rejected_body(error: Exception, rejected: bool) -> None:
+    """Test that only the endpoint's rejections of a body are told apart from its failures."""
+    assert rejected_body(error) is rejected
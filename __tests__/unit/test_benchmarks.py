@@ -0,0 +1,25 @@
+"""Test the regression gate of the benchmark suite."""
+
+from mnist_sagemaker_ci_cd.benchmarks.suite import compare
+
+BASELINE = {"predict_fn/batch-1": {"p50_ms": 1.0, "p99_ms": 2.0, "throughput": 1000.0}}
+
+
+def test_compare_accepts_changes_within_tolerance() -> None:
+    """Test that noise within the tolerances, and new cases, are not regressions."""
+    results = {
+        "predict_fn/batch-1": {"p50_ms": 1.1, "p99_ms": 2.8, "throughput": 900.0},
+        "predict_fn/batch-8": {"p50_ms": 9.0, "p99_ms": 9.0, "throughput": 1.0},
+    }
+    assert compare(results, BASELINE, tolerance=0.2, tail_tolerance=0.5) == []
+
+
+def test_compare_reports_regressions() -> None:
+    """Test that slower latencies and lower throughput beyond the tolerances are regressions."""
+    results = {"predict_fn/batch-1": {"p50_ms": 1.5, "p99_ms": 3.2, "throughput": 700.0}}
+    regressions = compare(results, BASELINE, tolerance=0.2, tail_tolerance=0.5)
+    assert [regression.split(":")[0] for regression in regressions] == [
+        "predict_fn/batch-1 p50_ms",
+        "predict_fn/batch-1 p99_ms",
+        "predict_fn/batch-1 throughput",
+    ]
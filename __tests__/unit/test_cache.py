@@ -0,0 +1,79 @@
+"""Test the prediction cache of the REST API."""
+
+import asyncio
+
+from serverless.cache import MemoryStore, PredictionCache
+
+
+def test_identical_uploads_are_computed_once() -> None:
+    """Test that concurrent and repeated identical uploads share one backend call."""
+    calls = []
+
+    async def compute(payload):
+        calls.append(payload)
+        await asyncio.sleep(0.01)
+        return len(payload)
+
+    async def main():
+        cache = PredictionCache(MemoryStore(), model_version="abc1234")
+        first = await asyncio.gather(*(cache.get_or_compute(b"digit", compute) for _ in range(3)))
+        second = await cache.get_or_compute(b"digit", compute)
+        return cache, [*first, second]
+
+    cache, results = asyncio.run(main())
+    assert results == [5, 5, 5, 5]
+    assert calls == [b"digit"]
+    assert cache.stats() == {"hits": 1, "misses": 1, "coalesced": 2, "evictions": 0}
+
+
+def test_followers_finish_when_the_leader_is_cancelled() -> None:
+    """Test that an upload waiting on a cancelled one computes the prediction itself."""
+    calls = []
+
+    async def compute(payload):
+        calls.append(payload)
+        await asyncio.sleep(0.05)
+        return len(payload)
+
+    async def main():
+        cache = PredictionCache(MemoryStore(), model_version="abc1234")
+        leader = asyncio.create_task(cache.get_or_compute(b"digit", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_compute(b"digit", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        result = await asyncio.wait_for(follower, timeout=1)
+        return cache, leader, result
+
+    cache, leader, result = asyncio.run(main())
+    assert leader.cancelled()
+    assert result == len(b"digit")
+    assert calls == [b"digit", b"digit"]
+    assert not cache._in_flight
+
+
+def test_keys_depend_on_the_model_version() -> None:
+    """Test that a new deployment does not serve the previous model's predictions."""
+    old, new = PredictionCache(MemoryStore(), "old"), PredictionCache(MemoryStore(), "new")
+    assert old.key(b"digit") != new.key(b"digit")
+
+
+def test_memory_store_evicts_least_recently_used_and_expired_entries() -> None:
+    """Test that the in-memory store stays bounded and honours its time-to-live."""
+
+    async def main():
+        store = MemoryStore(max_entries=2)
+        await store.set("a", 1)
+        await store.set("b", 2)
+        await store.get("a")
+        await store.set("c", 3)
+        lru = [await store.get(key) for key in "abc"]
+        expired = MemoryStore(ttl=-1)
+        await expired.set("a", 1)
+        return store, lru, expired, await expired.get("a")
+
+    store, lru, expired, value = asyncio.run(main())
+    assert lru == [1, None, 3]
+    assert store.evictions == 1
+    assert value is None
+    assert expired.evictions == 1
@@ -0,0 +1,133 @@
+"""Test the asynchronous checkpoints of the training loop."""
+
+import threading
+import types
+from pathlib import Path
+
+import pytest
+import torch
+import torch.nn.functional as F  # noqa: N812
+from torch import optim
+
+from mnist_sagemaker_ci_cd.lib.checkpoint import AsyncCheckpointer, load_latest, set_rng_state
+from mnist_sagemaker_ci_cd.lib.net import Net
+
+
+def _step(model: Net, optimizer: optim.Optimizer) -> None:
+    optimizer.zero_grad()
+    F.nll_loss(model(torch.randn(8, 1, 28, 28)), torch.randint(0, 10, (8,))).backward()
+    optimizer.step()
+
+
+def test_resume_from_the_newest_valid_checkpoint(tmp_path: Path) -> None:
+    """Test that a resumed run continues exactly like the run it was checkpointed from."""
+    torch.manual_seed(0)
+    model = Net()
+    optimizer = optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+    checkpointer = AsyncCheckpointer(str(tmp_path), keep=2)
+    for step in range(1, 4):
+        _step(model, optimizer)
+        checkpointer.save(model, optimizer, epoch=1, step=step)
+        checkpointer.wait()
+    checkpointer.close()
+    _step(model, optimizer)
+    expected = model.state_dict()
+
+    checkpoints = sorted(path.name for path in tmp_path.glob("checkpoint-*.pt"))
+    assert checkpoints == ["checkpoint-0001-00000002.pt", "checkpoint-0001-00000003.pt"]
+    # A newer checkpoint, truncated by a preemption, is skipped.
+    (tmp_path / "checkpoint-0002-00000000.pt").write_bytes(b"truncated")
+
+    state = load_latest(str(tmp_path))
+    assert state is not None
+    assert (state["epoch"], state["step"]) == (1, 3)
+    resumed = Net()
+    resumed_optimizer = optim.SGD(resumed.parameters(), lr=0.01, momentum=0.5)
+    resumed.load_state_dict(state["model"])
+    resumed_optimizer.load_state_dict(state["optimizer"])
+    set_rng_state(state["rng"])
+    _step(resumed, resumed_optimizer)
+    for name, tensor in resumed.state_dict().items():
+        torch.testing.assert_close(tensor, expected[name])
+
+
+def test_load_latest_without_checkpoints(tmp_path: Path) -> None:
+    """Test that a first run starts from scratch."""
+    assert load_latest(str(tmp_path)) is None
+
+
+def test_checkpointer_replaces_the_pending_checkpoint(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that a checkpoint saved while the writer is busy replaces the one still waiting."""
+    writing, release = threading.Event(), threading.Event()
+    write = AsyncCheckpointer._write
+
+    def slow_write(self: AsyncCheckpointer, state: dict) -> None:
+        writing.set()
+        release.wait()
+        write(self, state)
+
+    monkeypatch.setattr(AsyncCheckpointer, "_write", slow_write)
+    model = Net()
+    optimizer = optim.SGD(model.parameters(), lr=0.01)
+    checkpointer = AsyncCheckpointer(str(tmp_path), keep=3)
+    checkpointer.save(model, optimizer, epoch=1, step=1)
+    writing.wait()
+    checkpointer.save(model, optimizer, epoch=1, step=2)
+    checkpointer.save(model, optimizer, epoch=1, step=3)
+    release.set()
+    checkpointer.close()
+    checkpoints = sorted(path.name for path in tmp_path.glob("checkpoint-*.pt"))
+    assert checkpoints == ["checkpoint-0001-00000001.pt", "checkpoint-0001-00000003.pt"]
+
+
+def test_checkpointer_raises_write_errors(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that a failed write is raised in the training thread, once."""
+
+    def failing_write(self: AsyncCheckpointer, state: dict) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(AsyncCheckpointer, "_write", failing_write)
+    model = Net()
+    checkpointer = AsyncCheckpointer(str(tmp_path))
+    checkpointer.save(model, optim.SGD(model.parameters(), lr=0.01), epoch=1, step=1)
+    with pytest.raises(RuntimeError, match="Writing a checkpoint failed") as excinfo:
+        checkpointer.wait()
+    assert isinstance(excinfo.value.__cause__, OSError)
+    checkpointer.close()
+
+
+def test_load_latest_skips_incomplete_checkpoints(tmp_path: Path) -> None:
+    """Test that a checkpoint missing part of the training state is skipped for an older one."""
+    model = Net()
+    checkpointer = AsyncCheckpointer(str(tmp_path))
+    checkpointer.save(model, optim.SGD(model.parameters(), lr=0.01), epoch=1, step=4)
+    checkpointer.close()
+    torch.save({"model": model.state_dict()}, tmp_path / "checkpoint-0002-00000000.pt")
+    state = load_latest(str(tmp_path))
+    assert state is not None
+    assert (state["epoch"], state["step"]) == (1, 4)
+
+
+def test_resume_restores_the_position_and_rng(tmp_path: Path, train: types.ModuleType) -> None:
+    """Test that training resumes at the checkpointed batch, with its weights and random draws."""
+    torch.manual_seed(0)
+    model = Net()
+    optimizer = optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+    _step(model, optimizer)
+    checkpointer = AsyncCheckpointer(str(tmp_path))
+    checkpointer.save(model, optimizer, epoch=2, step=5)
+    checkpointer.close()
+    expected = torch.rand(3)
+
+    torch.manual_seed(1)
+    resumed = Net()
+    resumed_optimizer = optim.SGD(resumed.parameters(), lr=0.01, momentum=0.5)
+    assert train._resume(resumed, resumed_optimizer, str(tmp_path)) == (2, 5)
+    torch.testing.assert_close(torch.rand(3), expected)
+    for name, tensor in resumed.state_dict().items():
+        torch.testing.assert_close(tensor, model.state_dict()[name])
+    assert resumed_optimizer.state_dict()["state"].keys() == optimizer.state_dict()["state"].keys()
+
+    assert train._resume(resumed, resumed_optimizer, str(tmp_path / "empty")) == (1, 0)
@@ -0,0 +1,89 @@
+"""Test the gradient compression of the Horovod optimizer and its benchmark's allreduce."""
+
+from pathlib import Path
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.nn.functional as F  # noqa: N812
+
+from mnist_sagemaker_ci_cd.benchmarks.communication import _COMPRESSORS, HorovodAllreduce
+from mnist_sagemaker_ci_cd.lib.compression import fusion_environment
+from mnist_sagemaker_ci_cd.lib.net import Net
+
+# Net's gradients, as float32 and float16.
+GRADIENT_BYTES = 21840 * 4
+PASSES = 2
+
+
+@pytest.fixture
+def process_group(tmp_path: Path):
+    """A gloo process group of this process alone."""
+    dist.init_process_group("gloo", init_method=f"file://{tmp_path}/store", rank=0, world_size=1)
+    yield
+    dist.destroy_process_group()
+
+
+def test_compressors_restore_the_gradient_type() -> None:
+    """Test that fp16 halves floating point gradients only, and both restore their type."""
+    for name, compressor in _COMPRESSORS.items():
+        for tensor in (torch.linspace(-1, 1, 5), torch.arange(5)):
+            compressed, ctx = compressor.compress(tensor)
+            if name == "fp16" and tensor.is_floating_point():
+                assert compressed.dtype == torch.float16
+            restored = compressor.decompress(compressed, ctx)
+            assert restored.dtype == tensor.dtype
+            assert torch.allclose(restored, tensor, atol=1e-3)
+
+
+def test_compressors_match_horovod() -> None:
+    """Test that the benchmark compresses the gradients as `hvd.Compression` does in training."""
+    hvd = pytest.importorskip("horovod.torch")
+    compressions = {"none": hvd.Compression.none, "fp16": hvd.Compression.fp16}
+    assert set(_COMPRESSORS) == set(compressions)
+    for name, compressor in _COMPRESSORS.items():
+        for tensor in (torch.linspace(-1, 1, 5), torch.arange(5)):
+            compressed, _ = compressor.compress(tensor)
+            expected, _ = compressions[name].compress(tensor)
+            assert compressed.dtype == expected.dtype
+            assert torch.equal(compressed, expected)
+
+
+def test_fusion_environment_keeps_horovod_defaults() -> None:
+    """Test that only the settings given are passed to Horovod, in its units."""
+    assert fusion_environment() == {}
+    assert fusion_environment(0.5, 2.5) == {
+        "HOROVOD_FUSION_THRESHOLD": str(512 * 1024),
+        "HOROVOD_CYCLE_TIME": "2.5",
+    }
+
+
+@pytest.mark.usefixtures("process_group")
+@pytest.mark.parametrize(
+    ("compression", "fusion_threshold_mb", "calls", "step_bytes"),
+    [("none", 0, 1, GRADIENT_BYTES), ("fp16", 0.01, 4, GRADIENT_BYTES // 2)],
+)
+def test_allreduce_fuses_accumulated_gradients(
+    compression: str, fusion_threshold_mb: float, calls: int, step_bytes: int
+) -> None:
+    """Test that the accumulated gradients are reduced once per step, in buffers of the threshold."""
+    torch.manual_seed(0)
+    model = Net().eval()
+    data, target = torch.rand(PASSES, 4, 1, 28, 28), torch.randint(0, 10, (PASSES, 4))
+    for images, labels in zip(data, target, strict=True):
+        (F.nll_loss(model(images), labels) / PASSES).backward()
+    expected = [parameter.grad.clone() for parameter in model.parameters()]
+    model.zero_grad()
+
+    allreduce = HorovodAllreduce(
+        model,
+        compression=compression,
+        backward_passes_per_step=PASSES,
+        fusion_threshold_mb=fusion_threshold_mb,
+    )
+    for images, labels in zip(data, target, strict=True):
+        allreduce.backward(F.nll_loss(model(images), labels) / PASSES)
+    allreduce.synchronize()
+    assert (allreduce.calls, allreduce.bytes) == (calls, step_bytes)
+    for parameter, gradient in zip(model.parameters(), expected, strict=True):
+        assert torch.allclose(parameter.grad, gradient, atol=1e-3)
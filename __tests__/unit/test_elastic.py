@@ -0,0 +1,46 @@
+"""Test the resharding of an epoch's samples when the workers of an elastic job change."""
+
+import pytest
+from torch.utils.data.distributed import DistributedSampler
+
+from mnist_sagemaker_ci_cd.lib.elastic import ElasticDistributedSampler
+
+DATASET = list(range(50))
+BATCH_SIZE = 4
+
+
+def _shards(num_replicas: int, processed: int = 0) -> list[list[int]]:
+    """The shard of every rank, resharded after `processed` samples of epoch 3."""
+    shards = []
+    for rank in range(num_replicas):
+        sampler = ElasticDistributedSampler(DATASET, seed=7)
+        sampler.set_epoch(3)
+        sampler.reshard(num_replicas, rank, processed)
+        shards.append(list(sampler))
+        assert len(sampler) == len(shards[-1])
+    return shards
+
+
+@pytest.mark.parametrize("num_replicas", [1, 3, 4])
+def test_shards_match_distributed_sampler(num_replicas: int) -> None:
+    """Test that the shards are those of `DistributedSampler` before any resharding."""
+    for rank, shard in enumerate(_shards(num_replicas)):
+        sampler = DistributedSampler(DATASET, num_replicas=num_replicas, rank=rank, seed=7)
+        sampler.set_epoch(3)
+        assert shard == list(sampler)
+
+
+@pytest.mark.parametrize(("before", "after"), [(2, 3), (3, 1)])
+def test_reshard_carries_on_with_the_samples_left(before: int, after: int) -> None:
+    """Test that after some batches on some workers, other workers train on the rest of the epoch."""
+    (order,) = _shards(1)
+    batches = 2
+    trained = [sample for shard in _shards(before) for sample in shard[: batches * BATCH_SIZE]]
+    processed = batches * BATCH_SIZE * before
+    assert sorted(trained) == sorted(order[:processed])
+
+    shards = _shards(after, processed)
+    assert len({len(shard) for shard in shards}) == 1
+    left = {sample for shard in shards for sample in shard}
+    assert left == set(order[processed:])
+    assert not left & set(trained)
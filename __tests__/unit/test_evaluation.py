@@ -0,0 +1,34 @@
+"""Test the evaluation loop."""
+
+import pytest
+import torch
+import torch.nn.functional as F  # noqa: N812
+
+from mnist_sagemaker_ci_cd.lib.evaluation import evaluate, unpack_totals
+from mnist_sagemaker_ci_cd.lib.net import Net
+
+
+def test_evaluate_matches_a_per_sample_evaluation() -> None:
+    """Test the totals, the confusion matrix and the sampled examples against a naive loop."""
+    generator = torch.Generator().manual_seed(0)
+    data = torch.randn(250, 1, 28, 28, generator=generator)
+    target = torch.randint(0, 10, (250,), generator=generator)
+    loader = list(zip(data.split(64), target.split(64), strict=True))
+    model = Net().eval()
+
+    totals, examples, predictions = evaluate(
+        model, loader, torch.device("cpu"), num_classes=10, sample_every=30, max_samples=5
+    )
+    loss, accuracy, confusion = unpack_totals(totals, num_classes=10)
+
+    with torch.no_grad():
+        output = model(data)
+    pred = output.argmax(1)
+    assert loss == pytest.approx(F.nll_loss(output, target).item(), rel=1e-5)
+    assert accuracy == pytest.approx(pred.eq(target).float().mean().item())
+    expected = [[0] * 10 for _ in range(10)]
+    for actual, predicted in zip(target.tolist(), pred.tolist(), strict=True):
+        expected[actual][predicted] += 1
+    assert confusion == expected
+    assert torch.equal(examples, data[0:150:30])
+    assert torch.equal(predictions, pred[0:150:30])
@@ -0,0 +1,216 @@
+"""Test the SageMaker inference handlers."""
+
+import io
+import json
+import tarfile
+import zipfile
+from http import HTTPStatus
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from PIL import Image
+from sagemaker_inference import errors, transformer
+
+from mnist_sagemaker_ci_cd.lib import export, inference
+from mnist_sagemaker_ci_cd.lib.net import Net
+from serverless.backends import tar_payloads
+
+
+def _png(value: int) -> bytes:
+    """Encode a constant 28x28 grayscale image as PNG."""
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((28, 28), value, dtype=np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _npy(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def _tar(images: list[bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for index, image in enumerate(images):
+            info = tarfile.TarInfo(f"{index}.png")
+            info.size = len(image)
+            archive.addfile(info, io.BytesIO(image))
+    return buffer.getvalue()
+
+
+def _zip(images: list[bytes]) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for index, image in enumerate(images):
+            archive.writestr(f"{index}.png", image)
+    return buffer.getvalue()
+
+
+def _multipart(images: list[bytes]) -> tuple[bytes, str]:
+    boundary = "mnist-boundary"
+    body = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{index}.png"\r\n'
+        f"Content-Type: image/png\r\n\r\n".encode()
+        + image
+        + b"\r\n"
+        for index, image in enumerate(images)
+    )
+    return body + f"--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+IMAGES = [_png(value) for value in (0, 128, 255)]
+RAW = bytes(np.repeat(np.array([0, 128, 255], dtype=np.uint8), 784))
+TOP_K = 3
+
+
+@pytest.mark.parametrize(
+    ("body", "content_type"),
+    [
+        (
+            _npy(np.stack([np.full((28, 28), value) for value in (0, 128, 255)])),
+            "application/x-npy",
+        ),
+        (RAW, "application/x-mnist-uint8"),
+        (_tar(IMAGES), "application/x-tar"),
+        (_zip(IMAGES), "application/zip"),
+        _multipart(IMAGES),
+    ],
+)
+def test_input_fn_decodes_batches_in_order(body: bytes, content_type: str) -> None:
+    """Test that every batched content type decodes into one `(N, 1, 28, 28)` tensor."""
+    batch = inference.input_fn(body, content_type)
+    assert batch.shape == (3, 1, 28, 28)
+    assert batch.dtype == torch.float32
+    assert batch.flatten(1)[:, 0].tolist() == [0.0, 128.0, 255.0]
+
+
+def test_input_fn_decodes_single_image() -> None:
+    """Test that a single encoded image still decodes into a batch of one."""
+    assert inference.input_fn(IMAGES[1], "application/octet-stream").shape == (1, 1, 28, 28)
+
+
+def test_input_fn_views_raw_payloads_in_place() -> None:
+    """Test that float32 `.npy` bodies are served without a copy, and raw 784-byte bodies too."""
+    body = bytearray(_npy(np.arange(2 * 784, dtype=np.float32).reshape(2, 28, 28)))
+    batch = inference.input_fn(body, "application/x-npy")
+    assert batch.shape == (2, 1, 28, 28)
+    assert np.shares_memory(batch.numpy(), np.frombuffer(body, dtype=np.uint8))
+    single = inference.input_fn(RAW[784:1568], "application/octet-stream")
+    assert single.shape == (1, 1, 28, 28)
+    assert single.unique().tolist() == [128.0]
+
+
+def test_input_fn_decodes_raw_tar_members_without_sniffing() -> None:
+    """Test that batched raw images that start like a bitmap or a JPEG are still raw pixels."""
+    images = [b"BM" + bytes(782), b"\xff\xd8" + bytes(782)]
+    batch = inference.input_fn(
+        tar_payloads(images, inference.RAW_CONTENT_TYPE), "application/x-tar"
+    )
+    assert batch.shape == (2, 1, 28, 28)
+    assert batch[:, 0, 0, :2].tolist() == [[66.0, 77.0], [255.0, 216.0]]
+
+
+@pytest.mark.parametrize(
+    ("body", "content_type", "status_code"),
+    [
+        (RAW[:100], "application/x-mnist-uint8", 400),
+        (b"\x93NUMPY garbage", "application/x-npy", 400),
+        (IMAGES[0][:50], "image/png", 400),
+        (_npy(np.zeros((2, 3))), "application/x-npy", 400),
+        (b"7", "text/plain", 415),
+    ],
+)
+def test_input_fn_rejects_malformed_requests(
+    body: bytes, content_type: str, status_code: int
+) -> None:
+    """Test that bodies that cannot be decoded are client errors, not server errors."""
+    with pytest.raises(errors.GenericInferenceToolkitError) as excinfo:
+        inference.input_fn(body, content_type)
+    assert excinfo.value.status_code == status_code
+
+
+def test_predict_and_output_keep_request_order() -> None:
+    """Test that a batch goes through one forward pass and comes back with one label per image."""
+    batch = inference.input_fn(_tar(IMAGES), "application/x-tar")
+    prediction = inference.predict_fn(
+        batch, inference.prepare_model(Net(), torch.device("cpu")), None
+    )
+    assert prediction.labels.shape == (3,)
+    body, content_type = inference.output_fn(prediction, "application/json", None)
+    assert content_type == "application/json"
+    assert json.loads(body) == {"prediction": prediction.labels.tolist()}
+
+
+def _context() -> inference.InvocationContext:
+    """A model server context whose request asks for the `TOP_K` best labels."""
+    return inference.InvocationContext(f"request-id=abc,top-k={TOP_K}")
+
+
+def test_output_fn_negotiates_top_k_formats() -> None:
+    """Test that the top-k labels and scores agree between JSON and the binary formats."""
+    model = inference.prepare_model(Net(), torch.device("cpu"), warmup_batch_sizes=())
+    batch = inference.input_fn(RAW, "application/x-mnist-uint8")
+    prediction = inference.predict_fn(batch, model, _context())
+    assert prediction.top_labels.shape == prediction.top_scores.shape == (len(batch), TOP_K)
+    assert torch.equal(prediction.labels, model(batch).argmax(1))
+
+    body, content_type = inference.output_fn(
+        prediction, "application/json;q=0.5, application/x-npy", None
+    )
+    assert content_type == "application/x-npy"
+    records = np.load(io.BytesIO(body))
+    body, _ = inference.output_fn(prediction, "*/*", None)
+    response = json.loads(body)
+    assert response["prediction"] == prediction.labels.tolist()
+    assert records["label"].tolist() == response["labels"]
+    np.testing.assert_allclose(records["score"], response["scores"])
+
+
+def test_output_fn_rejects_unsupported_accept() -> None:
+    """Test that a response format no handler encodes is a 406."""
+    with pytest.raises(errors.GenericInferenceToolkitError) as excinfo:
+        inference.output_fn(inference.Prediction(torch.zeros(1)), "text/csv", None)
+    assert excinfo.value.status_code == HTTPStatus.NOT_ACCEPTABLE
+
+
+def test_model_fn_serves_the_compiled_artifacts(tmp_path: Path) -> None:
+    """Test that training's compiled exports are served first and agree with the eager model."""
+    model = Net().eval()
+    torch.save(model.state_dict(), tmp_path / "model.pth")
+    export.export_compiled(model, str(tmp_path))
+    batch = export.parity_batch()
+    with torch.no_grad():
+        expected = model(batch)
+    for kind, artifact in (("onnx", export.ONNX_FILE), ("torchscript", export.TORCHSCRIPT_FILE)):
+        serving_model = inference.model_fn(str(tmp_path))
+        assert serving_model.kind == kind
+        export.check_parity(expected, serving_model(batch), kind)
+        (tmp_path / artifact).unlink()
+    assert inference.model_fn(str(tmp_path)).kind == "eager"
+
+
+def test_handlers_run_through_the_inference_toolkit(tmp_path: Path) -> None:
+    """Test that the toolkit can call every handler, with the context or not, as on the endpoint."""
+    torch.save(Net().state_dict(), tmp_path / "model.pth")
+    toolkit = transformer.Transformer()
+    toolkit._context = _context()
+    model = toolkit._run_handler_function(inference.model_fn, str(tmp_path))
+    batch = toolkit._run_handler_function(inference.input_fn, RAW, "application/x-mnist-uint8")
+    prediction = toolkit._run_handler_function(inference.predict_fn, batch, model)
+    body, content_type = toolkit._run_handler_function(
+        inference.output_fn, prediction, "application/json"
+    )
+    assert content_type == "application/json"
+    assert len(json.loads(body)["labels"]) == len(batch)
+
+
+def test_model_fn_prepares_the_model_once() -> None:
+    """Test that the served model is immutable, in evaluation mode and without gradients."""
+    serving_model = inference.prepare_model(Net(), torch.device("cpu"), warmup_batch_sizes=(1,))
+    assert not serving_model.model.training
+    assert not any(parameter.requires_grad for parameter in serving_model.model.parameters())
+    with pytest.raises(AttributeError):
+        serving_model.model = Net()
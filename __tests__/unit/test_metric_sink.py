@@ -0,0 +1,122 @@
+"""Test the metric sink of the training loop."""
+
+import threading
+
+import pytest
+import torch
+
+from mnist_sagemaker_ci_cd.lib.metric_sink import ImageTable, MemoryBackend, MetricSink
+
+LOG_INTERVAL = 4
+STEPS = 16
+
+
+def test_sink_reports_interval_averages_in_batches() -> None:
+    """Test that each snapshot is the mean of its interval, written in batches with the logs."""
+    backend = MemoryBackend()
+    sink = MetricSink([backend], batch_size=LOG_INTERVAL)
+    for step in range(1, STEPS + 1):
+        sink.add(loss=torch.tensor(float(step)))
+        if step % LOG_INTERVAL == 0:
+            sink.snapshot(step=step)
+    sink.log({"table": ImageTable(torch.zeros(2, 1, 28, 28), torch.tensor([3, 4]))})
+    sink.close()
+
+    averages = [sum(range(step - LOG_INTERVAL + 1, step + 1)) / LOG_INTERVAL for step in (4, 8)]
+    assert backend.records[:2] == [
+        {"step": 4, "loss": averages[0]},
+        {"step": 8, "loss": averages[1]},
+    ]
+    assert len(backend.records) == STEPS // LOG_INTERVAL + 1
+    assert backend.writes == 2  # noqa: PLR2004
+    assert backend.records[-1]["table"].predictions.tolist() == [3, 4]
+    assert sink.steps == STEPS
+    assert sink.overhead > 0
+
+
+def test_sink_reduces_across_ranks_one_interval_late() -> None:
+    """Test that the allreduce of a snapshot is only waited for at the next one, on every rank."""
+    started, finished = [], []
+
+    def allreduce_async(tensor: torch.Tensor, name: str) -> torch.Tensor:
+        started.append(name)
+        return tensor
+
+    def synchronize(handle: torch.Tensor) -> torch.Tensor:
+        finished.append(len(started))
+        return handle * 2
+
+    backends = [MemoryBackend(), MemoryBackend()]
+    sinks = [
+        MetricSink([backend], rank=rank, allreduce_async=allreduce_async, synchronize=synchronize)
+        for rank, backend in enumerate(backends)
+    ]
+    for sink in sinks:
+        sink.add(loss=torch.tensor(1.0))
+        sink.snapshot()
+        sink.add(loss=torch.tensor(3.0))
+        sink.snapshot()
+        assert len(finished) % 2 == 1  # The second allreduce is still in flight.
+        sink.close()
+    assert finished == [2, 2, 4, 4]
+    assert backends[0].records == [{"loss": 2.0}, {"loss": 6.0}]
+    assert backends[1].records == []
+
+
+def test_sink_drops_snapshots_instead_of_blocking() -> None:
+    """Test that a stalled backend costs dropped records, never a blocked training loop."""
+    release = threading.Event()
+
+    class _SlowBackend(MemoryBackend):
+        def write(self, records: list[dict]) -> None:
+            release.wait()
+            super().write(records)
+
+    backend = _SlowBackend()
+    sink = MetricSink([backend], batch_size=1, max_pending=2)
+    for step in range(STEPS):
+        sink.add(loss=torch.tensor(float(step)))
+        sink.snapshot(step=step)
+    assert sink.dropped > 0
+    release.set()
+    sink.close()
+    assert len(backend.records) == STEPS - sink.dropped
+
+
+def test_sink_raises_backend_errors() -> None:
+    """Test that a failing backend is reported to the training thread."""
+
+    class _FailingBackend:
+        def write(self, records: list[dict]) -> None:
+            raise OSError("no network")
+
+    sink = MetricSink([_FailingBackend()])
+    sink.log({"loss": 1.0})
+    with pytest.raises(RuntimeError):
+        sink.flush()
+
+
+def test_sink_reset_drops_reductions_of_lost_workers() -> None:
+    """Test that a reset never waits for allreduces started before it, and restarts their names."""
+    started, finished = [], []
+
+    def allreduce_async(tensor: torch.Tensor, name: str) -> torch.Tensor:
+        started.append(name)
+        return tensor
+
+    def synchronize(handle: torch.Tensor) -> torch.Tensor:
+        finished.append(handle.item())
+        return handle
+
+    backend = MemoryBackend()
+    sink = MetricSink([backend], rank=1, allreduce_async=allreduce_async, synchronize=synchronize)
+    sink.add(loss=torch.tensor(1.0))
+    sink.snapshot()
+    sink.add(loss=torch.tensor(2.0))
+    sink.reset(rank=0)
+    sink.add(loss=torch.tensor(3.0))
+    sink.snapshot()
+    sink.close()
+    assert started == ["metric_sink.1", "metric_sink.1"]
+    assert finished == [3.0]
+    assert backend.records == [{"loss": 3.0}]
@@ -0,0 +1,36 @@
+"""Test the stage latency histograms."""
+
+import json
+
+import pytest
+
+from mnist_sagemaker_ci_cd.lib.stage_metrics import BUCKETS_MS, StageMetrics
+
+
+def test_prometheus_histograms_are_cumulative() -> None:
+    """Test that the Prometheus buckets count every latency up to their bound."""
+    metrics = StageMetrics("test")
+    for value in (0.05, 3.0, 3.0, 20000.0):
+        metrics.observe("predict", value)
+    lines = metrics.prometheus().splitlines()
+    assert 'test_stage_latency_ms_bucket{stage="predict",le="0.1"} 1' in lines
+    assert 'test_stage_latency_ms_bucket{stage="predict",le="2.5"} 1' in lines
+    assert 'test_stage_latency_ms_bucket{stage="predict",le="5"} 3' in lines
+    assert f'test_stage_latency_ms_bucket{{stage="predict",le="{BUCKETS_MS[-1]}"}} 3' in lines
+    assert 'test_stage_latency_ms_bucket{stage="predict",le="+Inf"} 4' in lines
+    assert 'test_stage_latency_ms_count{stage="predict"} 4' in lines
+
+
+def test_emf_documents_report_deltas(capsys: pytest.CaptureFixture) -> None:
+    """Test that every flush prints the latencies observed since the previous one."""
+    metrics = StageMetrics("test")
+    with metrics.time("output_fn"):
+        pass
+    metrics.observe("input_fn", 3.0)
+    metrics.observe("input_fn", 20000.0)
+    metrics.flush_emf(interval=1e-9)
+    documents = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [document["Stage"] for document in documents] == ["input_fn", "output_fn"]
+    assert documents[0]["Latency"] == {"Values": [5, 20000.0], "Counts": [1, 1]}
+    assert documents[0]["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["Stage"]]
+    assert metrics.emf() == []
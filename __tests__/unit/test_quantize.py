@@ -0,0 +1,42 @@
+"""Test the int8 quantization of the trained model."""
+
+import json
+from pathlib import Path
+
+import pytest
+import torch
+
+from mnist_sagemaker_ci_cd.lib import export, inference, quantize
+from mnist_sagemaker_ci_cd.lib.net import Net
+
+
+@pytest.fixture
+def model_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """A model directory holding an exported model, with MNIST replaced by random images."""
+
+    def serving_loader(data_dir, train, batch_size, samples=None):
+        images = export.parity_batch(256 if train else 128)
+        labels = torch.randint(0, 10, (len(images),), generator=torch.Generator().manual_seed(1))
+        dataset = torch.utils.data.TensorDataset(images, labels)
+        return torch.utils.data.DataLoader(dataset, batch_size=batch_size)
+
+    monkeypatch.setattr(quantize, "_serving_loader", serving_loader)
+    export.export_torchscript(Net().eval(), str(tmp_path))
+    return tmp_path
+
+
+def test_quantize_and_publish(model_dir: Path) -> None:
+    """Test that an int8 model within the accuracy gate is published and served on CPU."""
+    report = quantize.quantize_and_publish(Net().eval(), str(model_dir), "", max_accuracy_drop=100)
+    assert report["published"]
+    assert report["int8"]["size_bytes"] < report["fp32"]["size_bytes"]
+    assert json.loads((model_dir / quantize.REPORT_FILE).read_text()) == report
+    model = inference.model_fn(str(model_dir))
+    assert model(export.parity_batch()).shape == (64, 10)
+
+
+def test_quantize_and_publish_rejects_accuracy_loss(model_dir: Path) -> None:
+    """Test that an int8 model failing the accuracy gate is not published."""
+    report = quantize.quantize_and_publish(Net().eval(), str(model_dir), "", max_accuracy_drop=-1)
+    assert not report["published"]
+    assert not (model_dir / export.QUANTIZED_FILE).exists()
@@ -0,0 +1,101 @@
+"""Test the bulk scoring of JSONL files, image directories and tar shards."""
+
+import base64
+import io
+import json
+import tarfile
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+from mnist_sagemaker_ci_cd.lib import inference
+from mnist_sagemaker_ci_cd.lib.net import Net
+from mnist_sagemaker_ci_cd.score import score
+
+BATCH_SIZE = 2
+
+
+def _png(value: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((28, 28), value, dtype=np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _inputs(tmp_path: Path) -> list[str]:
+    """A directory of two images, a tar shard of two images and a JSONL file of three records."""
+    (tmp_path / "images").mkdir()
+    (tmp_path / "images" / "a.png").write_bytes(_png(0))
+    (tmp_path / "images" / "b.png").write_bytes(_png(64))
+    with tarfile.open(tmp_path / "shard.tar", "w") as archive:
+        for name, payload in (("c.png", _png(128)), ("d.raw", bytes(range(112)) * 7)):
+            info = tarfile.TarInfo(name)
+            info.size = len(payload)
+            archive.addfile(info, io.BytesIO(payload))
+    records = [
+        {"id": "e", "image": base64.b64encode(_png(255)).decode()},
+        {"id": "f", "image": base64.b64encode(b"not an image").decode()},
+        {"path": "images/a.png"},
+    ]
+    (tmp_path / "requests.jsonl").write_text("".join(json.dumps(r) + "\n" for r in records))
+    return [str(tmp_path / name) for name in ("images", "shard.tar", "requests.jsonl")]
+
+
+def _without_errors(text: str) -> list[dict]:
+    """The lines of an output, with the error messages, which name the decoder's objects, masked."""
+    return [{**json.loads(line), "error": None} for line in text.splitlines()]
+
+
+def test_score_streams_every_input_in_order(tmp_path: Path) -> None:
+    """Test that every image is scored once, in input order, and bad images are reported."""
+    model = inference.prepare_model(Net(), torch.device("cpu"), warmup_batch_sizes=())
+    inputs, output = _inputs(tmp_path), str(tmp_path / "predictions.jsonl")
+    result = score(model, inputs, output, batch_size=BATCH_SIZE, workers=2, top_k=3)
+    lines = [json.loads(line) for line in Path(output).read_text().splitlines()]
+    assert [line["id"] for line in lines] == [
+        inputs[0] + "/a.png",
+        inputs[0] + "/b.png",
+        inputs[1] + "/c.png",
+        inputs[1] + "/d.raw",
+        "e",
+        "f",
+        f"{inputs[2]}:3",
+    ]
+    assert (result["images"], result["failed"]) == (len(lines), 1)
+    assert "error" in lines[5]
+    assert lines[6]["prediction"] == lines[0]["prediction"] == lines[0]["labels"][0]
+
+
+def test_score_resumes_from_its_progress(tmp_path: Path) -> None:
+    """Test that a run interrupted after a batch rewrites nothing before it and nothing twice."""
+    model = inference.prepare_model(Net(), torch.device("cpu"), warmup_batch_sizes=())
+    inputs, output = _inputs(tmp_path), tmp_path / "predictions.jsonl"
+    score(model, inputs, str(output), batch_size=BATCH_SIZE)
+    expected = output.read_text()
+
+    # Interrupted after the first batch was checkpointed, while writing the second one.
+    first_batch = "".join(expected.splitlines(keepends=True)[:BATCH_SIZE])
+    output.write_text(first_batch + '{"id": "trunc')
+    Path(f"{output}.progress").write_text(
+        json.dumps({"inputs": inputs, "records": BATCH_SIZE, "offset": len(first_batch)})
+    )
+    result = score(model, inputs, str(output), batch_size=BATCH_SIZE)
+    assert _without_errors(output.read_text()) == _without_errors(expected)
+    assert result["images"] == len(expected.splitlines()) - BATCH_SIZE
+
+
+def test_score_reports_records_that_are_not_base64(tmp_path: Path) -> None:
+    """Test that a malformed base64 record is reported, and the records around it scored."""
+    model = inference.prepare_model(Net(), torch.device("cpu"), warmup_batch_sizes=())
+    records = [
+        {"id": "a", "image": base64.b64encode(_png(0)).decode()},
+        {"id": "b", "image": "not base64"},
+        {"id": "c", "image": base64.b64encode(_png(255)).decode()},
+    ]
+    (tmp_path / "requests.jsonl").write_text("".join(json.dumps(r) + "\n" for r in records))
+    output = tmp_path / "predictions.jsonl"
+    result = score(model, [str(tmp_path / "requests.jsonl")], str(output), batch_size=BATCH_SIZE)
+    first, bad, last = (json.loads(line) for line in output.read_text().splitlines())
+    assert (result["images"], result["failed"]) == (len(records), 1)
+    assert ("prediction" in first, "error" in bad, "prediction" in last) == (True, True, True)
@@ -0,0 +1,42 @@
+"""Test the hash-addressed staging of the DVC-tracked data."""
+
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from mnist_sagemaker_ci_cd.lib.staging import dvc_dir_md5, stage_data
+
+
+@pytest.mark.skipif(shutil.which("dvc") is None, reason="requires the DVC command line")
+def test_stage_data_pulls_once_and_hardlinks(tmp_path: Path) -> None:
+    """Test that a warm cache is staged without the remote, by hardlinking the cached files."""
+    repo, remote, cache = tmp_path / "repo", tmp_path / "remote", tmp_path / "cache"
+    raw = repo / "data" / "MNIST" / "raw"
+    raw.mkdir(parents=True)
+    (raw / "train-images-idx3-ubyte").write_bytes(b"images")
+    (raw / "train-labels-idx1-ubyte").write_bytes(b"labels")
+    for command in (
+        ["dvc", "init", "--no-scm"],
+        ["dvc", "remote", "add", "--default", "local", str(remote)],
+        ["dvc", "add", "data"],
+        ["dvc", "push"],
+    ):
+        subprocess.run(command, cwd=repo, check=True, capture_output=True)
+    shutil.rmtree(repo / "data")
+    shutil.rmtree(repo / ".dvc" / "cache")
+    md5, _ = dvc_dir_md5(repo / "data.dvc")
+
+    first, second = tmp_path / "first", tmp_path / "second"
+    assert not stage_data(str(first), str(repo / "data.dvc"), str(cache))
+    shutil.rmtree(remote)  # The second job must not need the remote.
+    assert stage_data(str(second), str(repo / "data.dvc"), str(cache))
+
+    cached = cache / md5 / "MNIST" / "raw" / "train-images-idx3-ubyte"
+    for data_dir in (first, second):
+        staged = data_dir / "MNIST" / "raw" / "train-images-idx3-ubyte"
+        assert staged.read_bytes() == b"images"
+        assert os.path.samefile(staged, cached)
+    assert not (repo / "data").exists()
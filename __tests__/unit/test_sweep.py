@@ -0,0 +1,94 @@
+"""Test the hyperparameter sweep and its early stopping."""
+
+import random
+import types
+
+from mnist_sagemaker_ci_cd.sweep import (
+    SEARCH_SPACE,
+    Asha,
+    _arguments,
+    best_result,
+    run_sweep,
+    sample,
+)
+
+EPOCHS = 9
+
+
+class _Trial:
+    """A trial that completes one epoch per poll, at an accuracy set by its learning rate."""
+
+    def __init__(self, config: dict, epochs: int) -> None:
+        self.quality = config["lr"]
+        self.epochs, self.completed, self.stopped = epochs, 0, False
+
+    def running(self) -> bool:
+        if self.stopped or self.completed >= self.epochs:
+            return False
+        self.completed += 1
+        return True
+
+    def metrics(self) -> list[dict]:
+        return [
+            {"epoch": epoch, "test/Accuracy": 90 + epoch + self.quality}
+            for epoch in range(1, self.completed + 1)
+        ]
+
+    def stop(self) -> None:
+        self.stopped = True
+
+
+def test_asha_stops_trials_below_the_rung_quantile() -> None:
+    """Test that a trial continues only if it is in the top third of its rung so far."""
+    scheduler = Asha(min_epochs=1, max_epochs=9, reduction_factor=3)
+    assert scheduler.rungs == [1, 3]
+    assert scheduler.report(1, 95.0)
+    assert not scheduler.report(1, 94.0)
+    assert scheduler.report(1, 96.0)
+    assert scheduler.report(2, 0.0)
+
+
+def test_run_sweep_stops_weak_trials_and_picks_the_best() -> None:
+    """Test that most trials stop at the first rung, and the best one trains to the end."""
+    configs = [{"lr": lr} for lr in (0.05, 0.01, 0.2, 0.02, 0.1, 0.005)]
+    trials = {}
+
+    def start_trial(name: str, config: dict) -> _Trial:
+        trials[name] = _Trial(config, epochs=EPOCHS)
+        return trials[name]
+
+    results = run_sweep(start_trial, Asha(1, EPOCHS), configs, parallel=2, poll=0)
+    best = best_result(results)
+    assert best["config"] == {"lr": 0.2}
+    assert best["epochs"] == EPOCHS
+    assert not best["stopped"]
+    assert sum(result["stopped"] for result in results) >= len(configs) / 2
+    assert sum(trial.completed for trial in trials.values()) < EPOCHS * len(configs) / 2
+
+
+def test_sample_stays_in_the_search_space() -> None:
+    """Test that sampled configurations respect their bounds and choices."""
+    rng = random.Random(0)
+    for config in (sample(SEARCH_SPACE, rng) for _ in range(100)):
+        for name, (kind, *bounds) in SEARCH_SPACE.items():
+            if kind == "choice":
+                assert config[name] in bounds[0]
+            else:
+                assert bounds[0] <= config[name] <= bounds[1]
+
+
+def test_best_result_is_none_without_a_successful_trial() -> None:
+    """Test that trials that failed before their first epoch leave no best result."""
+    configs = [{"lr": 0.1}, {"lr": 0.2}]
+    results = run_sweep(
+        lambda name, config: _Trial(config, epochs=0), Asha(1, EPOCHS), configs, parallel=2, poll=0
+    )
+    assert [result["accuracy"] for result in results] == [None, None]
+    assert best_result(results) is None
+
+
+def test_local_trials_read_the_tensor_cache() -> None:
+    """Test that local trials use the data loader whose cache the sweep builds before them."""
+    arguments = _arguments(types.SimpleNamespace(max_epochs=EPOCHS), {"lr": 0.1}, "data")
+    assert "--data-loader=tensor" in arguments
+    assert "--data-dir=data" in arguments
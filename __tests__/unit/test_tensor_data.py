@@ -0,0 +1,60 @@
+"""Test the memory-mapped tensor dataset."""
+
+import struct
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+from torchvision import datasets, transforms
+
+from mnist_sagemaker_ci_cd.lib import tensor_data
+
+
+@pytest.fixture
+def data_dir(tmp_path: Path) -> Path:
+    """A directory holding small random MNIST splits in the IDX format."""
+    raw = tmp_path / "MNIST" / "raw"
+    raw.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for split, count in (("train", 100), ("t10k", 20)):
+        images = rng.integers(0, 256, (count, 28, 28), dtype=np.uint8)
+        labels = rng.integers(0, 10, count, dtype=np.uint8)
+        (raw / f"{split}-images-idx3-ubyte").write_bytes(
+            struct.pack(">IIII", 2051, count, 28, 28) + images.tobytes()
+        )
+        (raw / f"{split}-labels-idx1-ubyte").write_bytes(
+            struct.pack(">II", 2049, count) + labels.tobytes()
+        )
+    return tmp_path
+
+
+def test_batch_loader_matches_torchvision(data_dir: Path) -> None:
+    """Test that every rank gets the same batches as from the torchvision pipeline."""
+    dataset = datasets.MNIST(
+        str(data_dir),
+        transform=transforms.Compose(
+            [transforms.ToTensor(), transforms.Normalize((0.1307,), (0.3081,))]
+        ),
+    )
+    for rank in range(3):
+        sampler = torch.utils.data.distributed.DistributedSampler(
+            dataset, num_replicas=3, rank=rank, shuffle=False
+        )
+        expected = list(torch.utils.data.DataLoader(dataset, batch_size=16, sampler=sampler))
+        loader = tensor_data.BatchLoader(
+            tensor_data.MemmapMNIST(str(data_dir)), 16, num_replicas=3, rank=rank, shuffle=False
+        )
+        batches = list(loader)
+        assert len(loader) == len(batches) == len(expected)
+        for (data, target), (expected_data, expected_target) in zip(batches, expected, strict=True):
+            torch.testing.assert_close(data, expected_data)
+            assert torch.equal(target, expected_target)
+
+
+def test_batch_loader_shuffles_a_permutation(data_dir: Path) -> None:
+    """Test that a shuffled epoch visits every example once."""
+    loader = tensor_data.BatchLoader(tensor_data.MemmapMNIST(str(data_dir)), 32)
+    labels = torch.cat([target for _, target in loader])
+    dataset = tensor_data.MemmapMNIST(str(data_dir))
+    assert sorted(labels.tolist()) == sorted(dataset.labels.tolist())
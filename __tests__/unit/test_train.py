@@ -0,0 +1,203 @@
+"""Test the training loop of train.py, against stubs of Horovod and W&B."""
+
+import types
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn.functional as F  # noqa: N812
+from pytest_mock import MockerFixture
+from torch import nn, optim
+
+from mnist_sagemaker_ci_cd.lib.elastic import ElasticDistributedSampler
+from mnist_sagemaker_ci_cd.lib.metric_sink import MemoryBackend, MetricSink
+from mnist_sagemaker_ci_cd.lib.tensor_data import BatchLoader
+
+BATCH_SIZE = 4
+
+
+class _Digits:
+    """Random MNIST-shaped examples, served to `BatchLoader`, which records the samples it serves.
+
+    Serving the `fail_at`-th batch raises `error`, e.g. when a collective finds a worker lost.
+    """
+
+    def __init__(self, size: int, fail_at: int = 0, error: type[Exception] = RuntimeError) -> None:
+        generator = torch.Generator().manual_seed(size)
+        self.images = torch.randn(size, 1, 28, 28, generator=generator).numpy()
+        self.labels = torch.randint(0, 10, (size,), generator=generator).numpy()
+        self.served: list[int] = []
+        self.batches, self.fail_at, self.error = 0, fail_at, error
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def batch(self, indices: np.ndarray) -> tuple[torch.Tensor, torch.Tensor]:
+        self.batches += 1
+        if self.batches == self.fail_at:
+            raise self.error
+        self.served.extend(indices.tolist())
+        return torch.from_numpy(self.images[indices]), torch.from_numpy(self.labels[indices])
+
+
+class _Augment:
+    """Count the batches augmented, and the epochs they were augmented for."""
+
+    def __init__(self) -> None:
+        self.epochs: list[int] = []
+        self.batches = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epochs.append(epoch)
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        self.batches += 1
+        return images
+
+
+class _Checkpointer:
+    """Record the position of every checkpoint saved."""
+
+    def __init__(self) -> None:
+        self.saved: list[tuple[int, int]] = []
+
+    def save(self, model: nn.Module, optimizer: optim.Optimizer, epoch: int, step: int) -> None:
+        self.saved.append((epoch, step))
+
+
+class _RecordingSGD(optim.SGD):
+    """SGD that records the gradients of every step."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.gradients: list[list[torch.Tensor]] = []
+
+    def step(self, closure=None):
+        self.gradients.append(
+            [parameter.grad.clone() for group in self.param_groups for parameter in group["params"]]
+        )
+        return super().step(closure)
+
+
+def _loader(dataset: _Digits, num_replicas: int = 1, rank: int = 0) -> BatchLoader:
+    sampler = ElasticDistributedSampler(dataset, num_replicas=num_replicas, rank=rank)
+    return BatchLoader(dataset, BATCH_SIZE, sampler=sampler)
+
+
+def _linear() -> nn.Module:
+    """A model without dropout, whose gradients only depend on its batches."""
+    torch.manual_seed(0)
+    return nn.Sequential(nn.Flatten(), nn.Linear(28 * 28, 10), nn.LogSoftmax(dim=1))
+
+
+def _sink(rank: int = 0) -> MetricSink:
+    """A sink whose averages over the workers are this worker's own."""
+    return MetricSink(
+        [MemoryBackend()],
+        rank=rank,
+        allreduce_async=lambda tensor, name: tensor,
+        synchronize=lambda handle: handle,
+    )
+
+
+def test_train_epoch_averages_every_step_over_its_batches(train: types.ModuleType) -> None:
+    """Test that accumulated steps, the last one of fewer batches too, average their batch losses."""
+    passes, batches = 3, 10
+    loader = _loader(_Digits(batches * BATCH_SIZE))
+    model = _linear()
+    optimizer = _RecordingSGD(model.parameters(), lr=0.0)
+    train._train_epoch(
+        model, optimizer, loader, torch.device("cpu"), 1, backward_passes_per_step=passes
+    )
+
+    expected = []
+    for first in range(0, batches, passes):
+        model.zero_grad()
+        group = [
+            F.nll_loss(model(data), target) for data, target in list(loader)[first : first + passes]
+        ]
+        (sum(group) / len(group)).backward()
+        expected.append([parameter.grad.clone() for parameter in model.parameters()])
+    assert len(optimizer.gradients) == len(expected)
+    for gradients, expected_gradients in zip(optimizer.gradients, expected, strict=True):
+        for gradient, expected_gradient in zip(gradients, expected_gradients, strict=True):
+            torch.testing.assert_close(gradient, expected_gradient)
+
+
+def test_train_epoch_resumes_reports_and_checkpoints(train: types.ModuleType) -> None:
+    """Test that a resumed epoch skips its trained batches, and reports and checkpoints the rest."""
+    batches, start_step = 10, 2
+    model = _linear()
+    augment, checkpointer, sink = _Augment(), _Checkpointer(), _sink()
+    train._train_epoch(
+        model,
+        optim.SGD(model.parameters(), lr=0.01),
+        _loader(_Digits(batches * BATCH_SIZE)),
+        torch.device("cpu"),
+        3,
+        start_step=start_step,
+        log_interval=5,
+        augment=augment,
+        sink=sink,
+        checkpointer=checkpointer,
+        checkpoint_interval=4,
+    )
+    sink.close()
+    assert (augment.epochs, augment.batches) == ([3], batches - start_step)
+    assert checkpointer.saved == [(3, 4), (3, 8)]
+    (backend,) = sink.backends
+    assert [(record["epoch"], record["batch"]) for record in backend.records] == [
+        (3, "5/10"),
+        (3, "10/10"),
+    ]
+    assert all(np.isfinite(record["Train/Loss"]) for record in backend.records)
+
+
+def test_train_elastic_carries_on_from_the_last_commit(
+    train: types.ModuleType, hvd: types.ModuleType, tmp_path: Path, mocker: MockerFixture
+) -> None:
+    """Test that when a worker is lost mid-epoch, the other one trains on what was not committed.
+
+    Rank 1 of 2 commits every 2 batches and fails on its 6th batch: the 5th, trained but not
+    committed, is trained on again. It then becomes rank 0 of 1 and reshards the samples after the
+    commit for itself alone, and rank 0 reports the metrics and writes the checkpoint.
+    """
+    hvd.world_rank, hvd.world_size = 1, 2
+    hvd.world_after_reset = (0, 1)
+    dataset = _Digits(12 * BATCH_SIZE, fail_at=6, error=hvd.HorovodInternalError)
+    train_loader = _loader(dataset, num_replicas=2, rank=1)
+    test_loader = _loader(_Digits(2 * BATCH_SIZE), num_replicas=2, rank=1)
+    model = _linear()
+    state = hvd.elastic.TorchState(
+        model, optim.SGD(model.parameters(), lr=0.01), epoch=1, samples=0
+    )
+    args = types.SimpleNamespace(
+        epochs=1,
+        lr=0.01,
+        log_interval=3,
+        backward_passes_per_step=1,
+        commit_interval=2,
+        checkpoint_dir=str(tmp_path),
+        augment=0,
+        confusion_matrix=0,
+    )
+    sink = _sink(rank=1)
+    reset = mocker.spy(sink, "reset")
+
+    train._train_elastic(state, args, train_loader, test_loader, torch.device("cpu"), sink=sink)
+    sink.close()
+
+    order = list(ElasticDistributedSampler(dataset))
+    trained, committed = 5 * BATCH_SIZE, 4 * BATCH_SIZE * 2
+    # Every 2 batches on either side of the reset, and after the epoch.
+    assert (hvd.resets, state.restores, state.commits) == (1, 1, 5)
+    assert dataset.served[:trained] == order[1::2][:trained]
+    assert dataset.served[trained:] == order[committed:]
+    assert [call.args for call in reset.call_args_list] == [(1,), (0,)]
+    assert state.optimizer.param_groups[0]["lr"] == args.lr
+    assert (state.epoch, state.samples) == (2, 0)
+    assert (tmp_path / "checkpoint-0002-00000000.pt").exists()
+    (backend,) = sink.backends
+    # The test metrics are logged at once, the batch averages once the next ones are.
+    assert [record.get("batch") for record in backend.records] == [None, "3/4"]
+    assert "test/Accuracy" in backend.records[0]
@@ -0,0 +1,285 @@
+"""Benchmark of the gradient communication settings of the Horovod optimizer on local CPU workers.
+
+For each combination of gradient compression, backward passes per step and fusion threshold, the
+workers are spawned as separate processes that train `Net` for the same epochs over gloo, with the
+data sharded by rank and the learning rate scaled like `scaling.py`. Their gradients are averaged
+the way `hvd.DistributedOptimizer` does it: each gradient is compressed as soon as the backward
+pass of the last accumulated batch produced it, and consecutive gradients are fused into buffers of
+up to the fusion threshold, which are reduced asynchronously while the backward pass goes on.
+
+The compressors are private copies of `hvd.Compression.none` and `hvd.Compression.fp16`, with the
+same casts, as Horovod need not be installed to run the benchmark. Horovod's cycle time is not
+emulated: which gradients a cycle fuses depends on when each worker
+produced them, and Horovod's coordinator makes the workers agree on it. Here the buffers are cut
+by size alone, so they are the same on every worker, as gloo requires.
+
+Every run reports the allreduce calls and bytes each worker sends per optimizer step, the time per
+batch and the test accuracy reached. The recommended setting is the fastest one that loses at most
+`--max-accuracy-drop` percentage points of accuracy against the first, and gives the hyperparameters
+`fit.py` passes to `train.py`.
+
+Run it with `python -m mnist_sagemaker_ci_cd.benchmarks.communication --data-dir DATA_DIR`, adding
+e.g. `--fusion-threshold-mb 0 0.01` to compare more values of a setting.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn.functional as F  # noqa: N812
+from torch import optim
+
+from mnist_sagemaker_ci_cd.benchmarks.scaling import _accuracy, _free_port
+from mnist_sagemaker_ci_cd.lib import tensor_data
+from mnist_sagemaker_ci_cd.lib.net import Net
+
+# The default of Horovod, used for a fusion threshold of 0 like in `train.py`.
+HOROVOD_FUSION_THRESHOLD_MB = 128
+# The settings compared, named like the keyword arguments of `HorovodAllreduce`.
+SETTINGS = ("compression", "backward_passes_per_step", "fusion_threshold_mb")
+
+
+class _NoneCompressor:
+    """Send the gradients as they are, like `hvd.Compression.none`."""
+
+    @staticmethod
+    def compress(tensor):
+        return tensor, None
+
+    @staticmethod
+    def decompress(tensor, ctx):
+        return tensor
+
+
+class _FP16Compressor:
+    """Send the floating point gradients as half precision floats, like `hvd.Compression.fp16`."""
+
+    @staticmethod
+    def compress(tensor):
+        if tensor.dtype.is_floating_point:
+            return tensor.to(torch.float16), tensor.dtype
+        return tensor, tensor.dtype
+
+    @staticmethod
+    def decompress(tensor, ctx):
+        return tensor.to(ctx) if ctx.is_floating_point else tensor
+
+
+# The compressions of `train.py --compression`.
+_COMPRESSORS = {"none": _NoneCompressor, "fp16": _FP16Compressor}
+
+
+class HorovodAllreduce:
+    """Average the gradients over the workers with compression, tensor fusion and accumulation.
+
+    Attributes:
+        calls (int): The allreduce calls made so far.
+        bytes (int): The bytes reduced so far, by this worker.
+    """
+
+    def __init__(
+        self,
+        model,
+        *,
+        compression="none",
+        backward_passes_per_step=1,
+        fusion_threshold_mb=0.0,
+    ):
+        """Hook the gradients of `model`, named like the hyperparameters of `train.py`."""
+        self.calls = 0
+        self.bytes = 0
+        self._parameters = [p for p in model.parameters() if p.requires_grad]
+        self._compressor = _COMPRESSORS[compression]
+        self._fusion_threshold = (fusion_threshold_mb or HOROVOD_FUSION_THRESHOLD_MB) * 1024 * 1024
+        self._backward_passes_per_step = backward_passes_per_step
+        self._passes = 0
+        self._queued = set()
+        self._pending, self._pending_bytes = [], 0
+        self._reductions = []
+        for parameter in self._parameters:
+            parameter.register_post_accumulate_grad_hook(self._ready)
+
+    def backward(self, loss):
+        """Accumulate the gradients of one batch, reducing them after the last batch of a step."""
+        self._passes += 1
+        loss.backward()
+
+    def synchronize(self):
+        """Reduce the gradients not reduced yet, wait for every reduction and average them."""
+        for parameter in self._parameters:
+            if parameter.grad is not None and parameter not in self._queued:
+                self._queue(parameter)
+        self._fuse()
+        for handle, buffer, entries in self._reductions:
+            handle.wait()
+            offset = 0
+            for parameter, compressed, ctx in entries:
+                reduced = buffer[offset : offset + compressed.numel()].view_as(compressed)
+                parameter.grad.copy_(self._compressor.decompress(reduced, ctx))
+                parameter.grad.div_(dist.get_world_size())
+                offset += compressed.numel()
+        self._reductions, self._queued, self._passes = [], set(), 0
+
+    def _ready(self, parameter):
+        if self._passes >= self._backward_passes_per_step:
+            self._queue(parameter)
+
+    def _queue(self, parameter):
+        """Compress a gradient and fuse it with the pending ones, up to the fusion threshold."""
+        compressed, ctx = self._compressor.compress(parameter.grad)
+        size = compressed.numel() * compressed.element_size()
+        if self._pending and self._pending_bytes + size > self._fusion_threshold:
+            self._fuse()
+        self._queued.add(parameter)
+        self._pending.append((parameter, compressed, ctx))
+        self._pending_bytes += size
+
+    def _fuse(self):
+        """Start the allreduce of the pending gradients as one buffer."""
+        if not self._pending:
+            return
+        buffer = torch.cat([compressed.flatten() for _, compressed, _ in self._pending])
+        self._reductions.append((dist.all_reduce(buffer, async_op=True), buffer, self._pending))
+        self.calls += 1
+        self.bytes += self._pending_bytes
+        self._pending, self._pending_bytes = [], 0
+
+
+def _worker(rank, args, setting, port, results):
+    """Train on one shard with a setting, reporting the run's results from rank 0."""
+    world_size = args.workers
+    os.environ.update(MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port))
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    torch.manual_seed(args.seed)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+
+    loader = tensor_data.BatchLoader(
+        tensor_data.MemmapMNIST(args.data_dir), args.batch_size, world_size, rank, seed=args.seed
+    )
+    model = Net()
+    for parameter in model.parameters():
+        dist.broadcast(parameter.data, src=0)
+    optimizer = optim.SGD(model.parameters(), lr=args.lr * world_size, momentum=args.momentum)
+    allreduce = HorovodAllreduce(model, **setting)
+    passes = setting["backward_passes_per_step"]
+
+    batches, steps, elapsed = 0, 0, 0.0
+    for epoch in range(1, args.epochs + 1):
+        loader.sampler.set_epoch(epoch)
+        model.train()
+        dist.barrier()
+        start = time.perf_counter()
+        for batch_idx, (data, target) in enumerate(loader, 1):
+            # The last step of an epoch averages over the batches left over, like `train.py`.
+            first = batch_idx - (batch_idx - 1) % passes
+            allreduce.backward(
+                F.nll_loss(model(data), target) / min(passes, len(loader) - first + 1)
+            )
+            if batch_idx % passes == 0 or batch_idx == len(loader):
+                allreduce.synchronize()
+                optimizer.step()
+                optimizer.zero_grad()
+                steps += 1
+            batches += 1
+        dist.barrier()
+        elapsed += time.perf_counter() - start
+
+    if rank == 0:
+        model.eval()
+        results.put(
+            {
+                **setting,
+                "allreduces_per_step": allreduce.calls / steps,
+                "allreduce_kb_per_step": allreduce.bytes / steps / 1024,
+                "batch_ms": 1000 * elapsed / batches,
+                "samples_per_s": batches * args.batch_size * world_size / elapsed,
+                "accuracy": _accuracy(model, args.data_dir),
+            }
+        )
+    dist.destroy_process_group()
+
+
+def run(args):
+    """Train once per setting and recommend the fastest one that converges as well as the first."""
+    tensor_data.build_cache(args.data_dir, train=True)
+    tensor_data.build_cache(args.data_dir, train=False)
+    context = mp.get_context("spawn")
+    runs = []
+    for values in itertools.product(*(getattr(args, name) for name in SETTINGS)):
+        setting = dict(zip(SETTINGS, values, strict=True))
+        results = context.SimpleQueue()
+        mp.spawn(_worker, args=(args, setting, _free_port(), results), nprocs=args.workers)
+        result = results.get()
+        runs.append(result)
+        print(
+            f"compression={setting['compression']:<4}  "
+            f"passes={setting['backward_passes_per_step']}  "
+            f"fusion={setting['fusion_threshold_mb']:>4g}MB  "
+            f"{result['allreduces_per_step']:>4.1f} allreduces  "
+            f"{result['allreduce_kb_per_step']:>6.1f} KB/step  "
+            f"{result['batch_ms']:>6.2f} ms/batch  "
+            f"{result['samples_per_s']:>7.0f} samples/s  accuracy={result['accuracy']:>5.2f}%"
+        )
+    converged = [r for r in runs if r["accuracy"] >= runs[0]["accuracy"] - args.max_accuracy_drop]
+    recommended = min(converged, key=lambda r: r["batch_ms"])
+    hyperparameters = {name.replace("_", "-"): recommended[name] for name in SETTINGS}
+    print(f"recommended hyperparameters: {json.dumps(hyperparameters)}")
+    return {"runs": runs, "recommended": hyperparameters}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--data-dir", type=str, required=True, help="directory holding the MNIST/raw IDX files"
+    )
+    parser.add_argument("--workers", type=int, default=2, help="worker processes (default: 2)")
+    parser.add_argument(
+        "--compression",
+        type=str,
+        nargs="+",
+        default=["none", "fp16"],
+        choices=sorted(_COMPRESSORS),
+        help="gradient compressions to test, the first run is the baseline (default: none fp16)",
+    )
+    parser.add_argument(
+        "--backward-passes-per-step",
+        type=int,
+        nargs="+",
+        default=[1, 4],
+        help="batches accumulated per allreduce to test (default: 1 4)",
+    )
+    parser.add_argument(
+        "--fusion-threshold-mb",
+        type=float,
+        nargs="+",
+        default=[0],
+        help="fusion buffer sizes in MiB to test, 0 for Horovod's 128 (default: 0)",
+    )
+    parser.add_argument("--epochs", type=int, default=1, help="epochs per run (default: 1)")
+    parser.add_argument(
+        "--batch-size", type=int, default=64, help="per-worker batch size (default: 64)"
+    )
+    parser.add_argument(
+        "--lr", type=float, default=0.01, help="single-worker learning rate (default: 0.01)"
+    )
+    parser.add_argument("--momentum", type=float, default=0.5, help="SGD momentum (default: 0.5)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed (default: 42)")
+    parser.add_argument(
+        "--max-accuracy-drop",
+        type=float,
+        default=0.5,
+        help="accuracy a setting may lose against the first, in percentage points (default: 0.5)",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
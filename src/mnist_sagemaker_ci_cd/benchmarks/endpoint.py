@@ -0,0 +1,423 @@
+"""Local emulator of a SageMaker endpoint serving `inference.py`, and a load generator to drive it.
+
+The emulator answers the model container contract (`GET /ping`, `POST /invocations`) and the
+SageMaker runtime `InvokeEndpoint` API (`POST /endpoints/<name>/invocations`), so that both `curl`
+and `boto3` clients can call it. Like the SageMaker model server, an HTTP frontend queues every
+invocation for a pool of worker processes, each of which loads the model once with `model_fn` and
+runs `input_fn`, `predict_fn` and `output_fn` on one request at a time. The `Content-Type`,
+`Accept` and `X-Amzn-SageMaker-Custom-Attributes` headers reach the handlers as on SageMaker, and
+their errors are returned as the runtime API's `ModelError`.
+
+Point the API at it with `SAGEMAKER_RUNTIME_URL=http://127.0.0.1:8080` (botocore still needs
+credentials to sign with, any will do).
+
+The load generator sends invocations through `SageMakerBackend`, the API's client, either
+closed-loop (a fixed number of clients, each sending a new request when the previous one returns)
+or open-loop (Poisson arrivals at a fixed rate, whatever the latency, with every latency measured
+from the request's scheduled start so that queueing is not hidden). It reports the throughput,
+latency percentiles and errors of every run.
+
+Run `python -m mnist_sagemaker_ci_cd.benchmarks.endpoint serve --model-dir /path/to/model
+--workers 4`, or `python -m mnist_sagemaker_ci_cd.benchmarks.endpoint load --model-dir
+/path/to/model --concurrency 1 4 16 --rates 100 500` to load test a fresh emulator (or `--url` to
+load test a running one).
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import threading
+import time
+import traceback
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mnist_sagemaker_ci_cd.benchmarks.gateway import summarize
+from mnist_sagemaker_ci_cd.lib import inference
+from serverless.backends import SageMakerBackend
+
+
+def _serve(model_dir, workers, jobs, results):
+    """Load the model, then run the inference handlers on the jobs until a None job arrives."""
+    # Split the CPUs between the workers, as SageMaker does, before model_fn sets the threads.
+    os.environ["SAGEMAKER_MODEL_SERVER_WORKERS"] = str(workers)
+    try:
+        model = inference.model_fn(model_dir)
+    except Exception:
+        results.put((None, HTTPStatus.INTERNAL_SERVER_ERROR, traceback.format_exc(), None))
+        return
+    results.put((None, HTTPStatus.OK, model.kind, None))
+    while (job := jobs.get()) is not None:
+        job_id, body, content_type, accept, custom_attributes = job
+        context = inference.InvocationContext(custom_attributes)
+        try:
+            data = inference.input_fn(body, content_type)
+            prediction = inference.predict_fn(data, model, context)
+            response, response_type = inference.output_fn(prediction, accept, context)
+            if isinstance(response, str):
+                response = response.encode()
+            results.put((job_id, HTTPStatus.OK, response, response_type))
+        except inference.errors.BaseInferenceToolkitError as e:
+            results.put((job_id, e.status_code, e.message, None))
+        except Exception as e:
+            results.put((job_id, HTTPStatus.INTERNAL_SERVER_ERROR, repr(e), None))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serve `/ping` and the invocations of the server's `LocalEndpoint`."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._send(
+            HTTPStatus.OK if self.path == "/ping" else HTTPStatus.NOT_FOUND, b"", "text/plain"
+        )
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        runtime_api = self.path.startswith("/endpoints/") and self.path.endswith("/invocations")
+        if self.path != "/invocations" and not runtime_api:
+            self._send(HTTPStatus.NOT_FOUND, b"", "text/plain")
+            return
+        status, response, content_type = self.server.endpoint.invoke(  # type: ignore
+            body,
+            self.headers.get("Content-Type", "application/octet-stream"),
+            self.headers.get("Accept", "application/json"),
+            self.headers.get(inference.CUSTOM_ATTRIBUTES_HEADER, ""),
+        )
+        if status == HTTPStatus.OK:
+            self._send(status, response, content_type)
+        elif runtime_api:  # The runtime API reports the errors of the model as a ModelError.
+            error = {
+                "ErrorCode": "CLIENT_ERROR_FROM_MODEL",
+                "OriginalStatusCode": int(status),
+                "OriginalMessage": str(response),
+                "Message": f"Received client error ({int(status)}) from the model: {response}",
+            }
+            self._send(
+                HTTPStatus.FAILED_DEPENDENCY,
+                json.dumps(error).encode(),
+                "application/json",
+                {"x-amzn-ErrorType": "ModelError"},
+            )
+        else:
+            self._send(status, str(response).encode(), "text/plain")
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass
+
+
+class LocalEndpoint:
+    """A local HTTP server that serves a model like a SageMaker endpoint.
+
+    Attributes:
+        model_dir (str): The directory holding the model artifacts.
+        workers (int): The number of worker processes, each with its own copy of the model.
+        kind (str): The artifact served, as chosen by `model_fn`.
+        timeout (float): Seconds to wait for a worker to load the model or answer a request.
+        url (str): The URL to pass as `endpoint_url` to the `sagemaker-runtime` client.
+    """
+
+    def __init__(
+        self,
+        model_dir,
+        workers=1,
+        *,
+        host="127.0.0.1",
+        port=0,
+        timeout=60.0,
+    ):
+        """Start the worker processes, wait until they have loaded the model, then start serving.
+
+        Args:
+            model_dir (str): The directory holding the model artifacts.
+            workers (int): The number of worker processes.
+            host (str): The address to listen on.
+            port (int): The port to listen on, 0 for any free port.
+            timeout (float): Seconds to wait for a worker to load the model or answer a request.
+        """
+        self.model_dir = model_dir
+        self.workers = workers
+        self.timeout = timeout
+        context = multiprocessing.get_context("spawn")
+        self._jobs, self._results = context.Queue(), context.Queue()
+        self._processes = [
+            context.Process(
+                target=_serve,
+                args=(model_dir, workers, self._jobs, self._results),
+                name=f"endpoint-worker-{index}",
+                daemon=True,
+            )
+            for index in range(workers)
+        ]
+        for process in self._processes:
+            process.start()
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        for _ in range(workers):
+            _, status, detail, _ = self._results.get(timeout=timeout)
+            if status != HTTPStatus.OK:
+                self.close()
+                raise RuntimeError(f"A worker could not load the model:\n{detail}")
+            self.kind = detail
+        threading.Thread(target=self._collect, name="endpoint-results", daemon=True).start()
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.endpoint = self  # type: ignore
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, name="endpoint", daemon=True).start()
+
+    def invoke(self, body, content_type, accept, custom_attributes=""):
+        """Queue an invocation for the workers and wait for it.
+
+        Returns:
+            tuple[HTTPStatus, bytes | str, str | None]: The status, the response (or the error
+                message) and the content type of the response.
+        """
+        job_id, future = next(self._job_ids), concurrent.futures.Future()
+        with self._lock:
+            self._futures[job_id] = future
+        self._jobs.put((job_id, body, content_type, accept, custom_attributes))
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self._futures.pop(job_id, None)
+            return HTTPStatus.GATEWAY_TIMEOUT, "The model did not answer in time.", None
+
+    def _collect(self):
+        """Hand the workers' responses to the frontend threads waiting for them."""
+        while (result := self._results.get()) is not None:
+            job_id, status, response, content_type = result
+            with self._lock:
+                future = self._futures.pop(job_id, None)
+            if future is not None:
+                future.set_result((HTTPStatus(status), response, content_type))
+
+    def close(self):
+        """Stop serving, then stop the workers."""
+        if hasattr(self, "_server"):
+            self._server.shutdown()
+            self._server.server_close()
+        for _ in self._processes:
+            self._jobs.put(None)
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+
+    def __enter__(self):
+        """Serve until the end of the `with` block."""
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop the endpoint."""
+        self.close()
+
+
+def _summarize(latencies, errors, elapsed):
+    """Summarize a run as its throughput, latency percentiles (in milliseconds) and errors."""
+    if len(latencies) < 2:  # noqa: PLR2004
+        return {
+            "requests": len(latencies),
+            "throughput_rps": len(latencies) / elapsed,
+            "errors": errors,
+        }
+    percentiles = statistics.quantiles(latencies, n=1000)
+    return {
+        **summarize(latencies, elapsed),
+        "p90_ms": 1000 * percentiles[899],
+        "p999_ms": 1000 * percentiles[998],
+        "errors": errors,
+    }
+
+
+async def closed_loop(invoke, concurrency, duration):
+    """Run `concurrency` clients that each send a new request as soon as the previous one returns."""
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                await invoke()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return _summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def open_loop(invoke, rate, duration, seed=0):
+    """Start requests at Poisson arrival times of `rate` per second, whether or not others returned.
+
+    Latencies are measured from the time a request was due to start, so the time it waits for a
+    free client is counted, as a user would see it.
+    """
+    latencies, errors, tasks = [], 0, []
+    rng = random.Random(seed)
+
+    async def request(scheduled):
+        nonlocal errors
+        try:
+            await invoke()
+        except Exception:
+            errors += 1
+            return
+        latencies.append(time.perf_counter() - scheduled)
+
+    start = scheduled = time.perf_counter()
+    while scheduled < start + duration:
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        tasks.append(asyncio.create_task(request(scheduled)))
+        scheduled += rng.expovariate(rate)
+    await asyncio.gather(*tasks)
+    return _summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_load(args, url, payload):
+    """Load test the endpoint closed-loop at every concurrency, then open-loop at every rate."""
+    attributes = {"top-k": args.top_k} if args.top_k else None
+    # A connection per outstanding request, so the client side is never the bottleneck.
+    backend = SageMakerBackend(
+        "local", max_concurrency=args.max_in_flight, endpoint_url=url, max_attempts=1
+    )
+
+    async def invoke():
+        return await backend.invoke(payload, args.content_type, args.accept, attributes)
+
+    await asyncio.gather(*(invoke() for _ in range(min(args.max_in_flight, 16))))  # Warm up.
+    results = []
+    runs = [("closed", n, closed_loop(invoke, n, args.duration)) for n in args.concurrency]
+    runs += [("open", rate, open_loop(invoke, rate, args.duration)) for rate in args.rates]
+    for mode, load, coroutine in runs:
+        result = await coroutine
+        result.update(mode=mode, load=load)
+        results.append(result)
+        unit = "clients" if mode == "closed" else "req/s"
+        line = f"{mode:>6} {load:>7g} {unit:<7}  throughput={result['throughput_rps']:>8.1f} req/s"
+        if "p50_ms" in result:
+            line += (
+                f"  p50={result['p50_ms']:>7.2f}ms  p90={result['p90_ms']:>7.2f}ms"
+                f"  p99={result['p99_ms']:>7.2f}ms  p99.9={result['p999_ms']:>7.2f}ms"
+            )
+        print(f"{line}  errors={result['errors']}")
+    backend.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["serve", "load"], help="serve the model, or load test")
+    parser.add_argument(
+        "--model-dir",
+        type=str,
+        default=os.environ.get("SM_MODEL_DIR", "/opt/ml/model"),
+        help="the directory of the model artifacts (default: $SM_MODEL_DIR or /opt/ml/model)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="worker processes, each with a copy of the model (default: the number of CPUs)",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="(default: 127.0.0.1)")
+    parser.add_argument(
+        "--port", type=int, default=8080, help="the port to serve on, 0 for any (default: 8080)"
+    )
+    parser.add_argument(
+        "--url", type=str, default=None, help="load test this endpoint instead of a new emulator"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="*",
+        default=[1, 4, 16],
+        help="closed-loop clients of every run (default: 1 4 16)",
+    )
+    parser.add_argument(
+        "--rates",
+        type=float,
+        nargs="*",
+        default=[],
+        help="open-loop request rates of every run, in requests per second (default: none)",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="seconds per run (default: 10)"
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=256,
+        help="the open-loop limit of outstanding requests, and connections (default: 256)",
+    )
+    parser.add_argument(
+        "--payload", type=str, default=None, help="the request body (default: blank raw images)"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1, help="blank raw images per request (default: 1)"
+    )
+    parser.add_argument(
+        "--content-type",
+        type=str,
+        default="application/x-mnist-uint8",
+        help="the content type of the payload (default: application/x-mnist-uint8)",
+    )
+    parser.add_argument(
+        "--accept", type=str, default="application/json", help="(default: application/json)"
+    )
+    parser.add_argument("--top-k", type=int, default=0, help="the top-k custom attribute")
+    parser.add_argument(
+        "--output", type=str, default=None, help="write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    # The emulator does not check signatures, but botocore still needs credentials to sign with.
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "local")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "local")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    with contextlib.ExitStack() as stack:
+        if args.command == "serve" or args.url is None:
+            endpoint = stack.enter_context(
+                LocalEndpoint(args.model_dir, args.workers, host=args.host, port=args.port)
+            )
+            print(
+                f"Serving the {endpoint.kind} model with {args.workers} workers on {endpoint.url}"
+            )
+        if args.command == "serve":
+            with contextlib.suppress(KeyboardInterrupt):
+                threading.Event().wait()
+        else:
+            payload = bytes(784 * args.batch_size)
+            if args.payload is not None:
+                with open(args.payload, "rb") as f:
+                    payload = f.read()
+            results = asyncio.run(run_load(args, args.url or endpoint.url, payload))
+            if args.output:
+                with open(args.output, "w") as f:
+                    json.dump(results, f, indent=4)
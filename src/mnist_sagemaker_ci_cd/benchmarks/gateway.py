@@ -0,0 +1,126 @@
+"""Load test of the `/predict` micro-batching layer against a local fake backend.
+
+The fake backend models a SageMaker endpoint: every invocation pays a fixed round-trip cost plus a
+small per-image cost, and only a few invocations can be in flight at once. A closed-loop load of
+concurrent clients is run once without batching and once per batch window, and the throughput and
+latency percentiles of each run are reported.
+
+Run it with `python -m mnist_sagemaker_ci_cd.benchmarks.gateway --concurrency 64`.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from serverless.batching import MicroBatcher
+
+
+class FakeBackend:
+    """An in-process stand-in for a SageMaker endpoint.
+
+    Attributes:
+        overhead_ms (float): Fixed cost of one invocation (network hop, request parsing, ...).
+        per_item_ms (float): Additional cost of every image in an invocation.
+        calls (int): The number of invocations served so far.
+    """
+
+    def __init__(self, overhead_ms: float = 20.0, per_item_ms: float = 0.2, max_in_flight: int = 4):
+        """Initialize the fake backend."""
+        self.overhead_ms = overhead_ms
+        self.per_item_ms = per_item_ms
+        self.calls = 0
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def predict_batch(self, payloads):
+        """Score a batch of payloads, returning one fake label per payload."""
+        async with self._slots:
+            self.calls += 1
+            await asyncio.sleep((self.overhead_ms + self.per_item_ms * len(payloads)) / 1000)
+            return [len(payload) % 10 for payload in payloads]
+
+
+def summarize(latencies, elapsed):
+    """Summarize a run as its throughput and latency percentiles (in milliseconds)."""
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": 1000 * percentiles[49],
+        "p99_ms": 1000 * percentiles[98],
+    }
+
+
+async def closed_loop(predict, concurrency, duration):
+    """Run `concurrency` clients that each send a new request as soon as the previous one returns."""
+    latencies = []
+    payload = bytes(784)
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await predict(payload)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def run(args):
+    """Load test the unbatched path and every batch window."""
+    results = []
+    for window_ms in [0.0, *args.windows]:
+        backend = FakeBackend(args.overhead_ms, args.per_item_ms, args.max_in_flight)
+        if window_ms > 0:
+            batcher = MicroBatcher(backend.predict_batch, args.max_batch_size, window_ms)
+            predict = batcher.submit
+        else:
+
+            async def predict(payload, backend=backend):
+                return (await backend.predict_batch([payload]))[0]
+
+        result = await closed_loop(predict, args.concurrency, args.duration)
+        result.update(window_ms=window_ms, backend_calls=backend.calls)
+        results.append(result)
+        print(
+            f"window={window_ms:>5.1f}ms  throughput={result['throughput_rps']:>8.1f} req/s  "
+            f"p50={result['p50_ms']:>7.2f}ms  p99={result['p99_ms']:>7.2f}ms  "
+            f"backend calls={backend.calls}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--concurrency", type=int, default=64, help="concurrent clients (default: 64)"
+    )
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run (default: 5)")
+    parser.add_argument(
+        "--windows",
+        type=float,
+        nargs="+",
+        default=[1.0, 2.0, 5.0, 10.0, 20.0],
+        help="batch windows to test, in milliseconds (default: 1 2 5 10 20)",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=32, help="(default: 32)")
+    parser.add_argument(
+        "--overhead-ms", type=float, default=20.0, help="fake round-trip cost (default: 20)"
+    )
+    parser.add_argument(
+        "--per-item-ms", type=float, default=0.2, help="fake per-image cost (default: 0.2)"
+    )
+    parser.add_argument(
+        "--max-in-flight", type=int, default=4, help="fake endpoint capacity (default: 4)"
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
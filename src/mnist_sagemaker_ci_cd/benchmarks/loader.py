@@ -0,0 +1,101 @@
+"""Throughput benchmark of the training data loaders.
+
+Iterates over the MNIST training split once with the torchvision loader of
+`train.py --data-loader torchvision` (per-sample decoding and normalization in a `DataLoader`), and
+once with the memory-mapped tensor cache, and reports the samples per second of each. The one-time cost of building the tensor
+cache, which is deleted and rebuilt, is reported separately.
+
+Run it with `python -m mnist_sagemaker_ci_cd.benchmarks.loader --data-dir /opt/ml/input/data/`.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+import torch
+import torch.utils.data.distributed
+from torchvision import datasets, transforms
+
+from mnist_sagemaker_ci_cd.lib import tensor_data
+
+
+def torchvision_loader(data_dir, batch_size, num_workers):
+    """The torchvision loader, configured as in `train._get_train_data_loader`."""
+    dataset = datasets.MNIST(
+        data_dir,
+        train=True,
+        transform=transforms.Compose(
+            [transforms.ToTensor(), transforms.Normalize((0.1307,), (0.3081,))]
+        ),
+    )
+    sampler = torch.utils.data.distributed.DistributedSampler(dataset, num_replicas=1, rank=0)
+    return torch.utils.data.DataLoader(
+        dataset, batch_size=batch_size, sampler=sampler, num_workers=num_workers
+    )
+
+
+def tensor_loader(data_dir, batch_size):
+    """The loader over the memory-mapped tensor cache."""
+    return tensor_data.BatchLoader(tensor_data.MemmapMNIST(data_dir, train=True), batch_size)
+
+
+def throughput(loader, epochs):
+    """Iterate over `loader` for `epochs` epochs and return the samples per second."""
+    samples = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for data, _ in loader:
+            samples += len(data)
+    return samples / (time.perf_counter() - start)
+
+
+def run(args):
+    """Benchmark the cache build, then both loaders at every batch size."""
+    shutil.rmtree(os.path.dirname(tensor_data._cache_paths(args.data_dir, True)[0]), True)
+    start = time.perf_counter()
+    tensor_data.build_cache(args.data_dir, train=True)
+    results = {"cache_build_s": time.perf_counter() - start, "runs": []}
+    print(f"tensor cache built in {results['cache_build_s']:.2f}s")
+    for batch_size in args.batch_sizes:
+        loaders = {
+            "torchvision": torchvision_loader(args.data_dir, batch_size, args.num_workers),
+            "tensor": tensor_loader(args.data_dir, batch_size),
+        }
+        for name, loader in loaders.items():
+            rate = throughput(loader, args.epochs)
+            results["runs"].append(
+                {"loader": name, "batch_size": batch_size, "samples_per_s": rate}
+            )
+            print(f"{name:>11}  batch={batch_size:>5}  {rate:>12.0f} samples/s")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--data-dir", type=str, required=True, help="directory holding the MNIST/raw IDX files"
+    )
+    parser.add_argument(
+        "--batch-sizes",
+        type=int,
+        nargs="+",
+        default=[64, 1000],
+        help="batch sizes to test (default: 64 1000)",
+    )
+    parser.add_argument("--epochs", type=int, default=1, help="epochs per run (default: 1)")
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=1,
+        help="workers of the torchvision loader, as in train.py (default: 1)",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,137 @@
+"""Concurrency benchmark of the SageMaker runtime backend against a local stub endpoint.
+
+The stub speaks the SageMaker runtime `InvokeEndpoint` HTTP contract and answers every invocation
+after a fixed delay, like a model server with spare capacity. For each in-flight limit, the
+benchmark sends a fixed number of requests through `SageMakerBackend` and reports the throughput
+and latency percentiles. A run that calls `boto3` directly from the event loop, as `/predict` used
+to, is included as the blocking baseline.
+
+Run it with `python -m mnist_sagemaker_ci_cd.benchmarks.runtime --in-flight 1 2 4 8 16 32`.
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mnist_sagemaker_ci_cd.benchmarks.gateway import summarize
+from serverless.backends import SageMakerBackend
+
+
+class StubEndpoint:
+    """A local HTTP server that mimics the SageMaker runtime `InvokeEndpoint` API.
+
+    Attributes:
+        delay_ms (float): How long every invocation takes to answer.
+        url (str): The URL to pass as `endpoint_url` to the `sagemaker-runtime` client.
+    """
+
+    def __init__(self, delay_ms: float = 20.0, port: int = 0):
+        """Start the stub on a background thread."""
+        self.delay_ms = delay_ms
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(stub.delay_ms / 1000)
+                body = json.dumps({"prediction": [0]}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # noqa: A002
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """Stop the stub."""
+        self._server.shutdown()
+        self._server.server_close()
+
+
+async def drive(predict, requests, concurrency):
+    """Send `requests` payloads through `predict` with at most `concurrency` outstanding."""
+    latencies = []
+    slots = asyncio.Semaphore(concurrency)
+    payload = bytes(784)
+
+    async def request():
+        async with slots:
+            start = time.perf_counter()
+            await predict(payload)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(request() for _ in range(requests)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def run(args, url):
+    """Benchmark the blocking baseline, then the pooled backend at every in-flight limit."""
+    results = []
+    for mode, in_flight in [
+        ("blocking", max(args.in_flight)),
+        *(("pooled", n) for n in args.in_flight),
+    ]:
+        backend = SageMakerBackend("stub", max_concurrency=in_flight, endpoint_url=url)
+        if mode == "blocking":
+
+            async def predict(payload, backend=backend):
+                return backend._invoke(payload, "application/octet-stream", "application/json")
+
+        else:
+            predict = backend.predict
+        # Warm up the connection pool before timing.
+        await asyncio.gather(*(predict(bytes(784)) for _ in range(in_flight)))
+        result = await drive(predict, args.requests, in_flight)
+        result.update(mode=mode, in_flight=in_flight)
+        results.append(result)
+        backend.close()
+        print(
+            f"{mode:>8}  in-flight={in_flight:>3}  throughput={result['throughput_rps']:>8.1f} req/s  "
+            f"p50={result['p50_ms']:>7.2f}ms  p99={result['p99_ms']:>7.2f}ms"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--in-flight",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8, 16, 32],
+        help="in-flight limits to test (default: 1 2 4 8 16 32)",
+    )
+    parser.add_argument("--requests", type=int, default=500, help="requests per run (default: 500)")
+    parser.add_argument("--delay-ms", type=float, default=20.0, help="stub latency (default: 20)")
+    parser.add_argument(
+        "--output", type=str, default=None, help="write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    # The stub does not check signatures, but botocore still needs credentials to sign with.
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "stub")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "stub")
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+    endpoint = StubEndpoint(args.delay_ms)
+    try:
+        results = asyncio.run(run(args, endpoint.url))
+    finally:
+        endpoint.close()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,176 @@
+"""Scaling benchmark of data-parallel training on local CPU workers.
+
+For each worker count, the workers are spawned as separate processes that train `Net` with
+`torch.distributed` over gloo, the same collective backend `train.py` uses through Horovod. Like
+`train.py`, the gradients are averaged every step, the learning rate is scaled by the number of
+workers and the data is sharded by rank with the tensor cache. The host's CPUs are split evenly
+between the workers.
+
+Every run reports its training throughput, its speedup and parallel efficiency over one worker,
+and the training time until rank 0 measures the target test accuracy after an epoch. The
+recommended worker count is the largest one whose efficiency stays above `--min-efficiency`, which
+is what `instance_count` in `fit.py` should be sized from.
+
+Run it with `python -m mnist_sagemaker_ci_cd.benchmarks.scaling --data-dir /opt/ml/input/data/`.
+"""
+import argparse
+import json
+import os
+import socket
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn.functional as F  # noqa: N812
+from torch import optim
+from torch.nn.parallel import DistributedDataParallel
+
+from mnist_sagemaker_ci_cd.lib import tensor_data
+from mnist_sagemaker_ci_cd.lib.net import Net
+
+
+def _free_port():
+    """A free local TCP port for the gloo rendezvous."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _accuracy(model, data_dir):
+    """The test accuracy of the model, in percent."""
+    loader = tensor_data.BatchLoader(
+        tensor_data.MemmapMNIST(data_dir, train=False), 1000, shuffle=False
+    )
+    correct = 0
+    with torch.no_grad():
+        for data, target in loader:
+            correct += model(data).argmax(1).eq(target).sum().item()
+    return 100.0 * correct / len(loader.dataset)
+
+
+def _worker(rank, world_size, args, port, results):
+    """Train on one shard, reporting the run's results from rank 0."""
+    os.environ.update(MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port))
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    torch.manual_seed(args.seed)
+    threads = max(1, (os.cpu_count() or 1) // world_size)
+    torch.set_num_threads(threads)
+
+    loader = tensor_data.BatchLoader(
+        tensor_data.MemmapMNIST(args.data_dir), args.batch_size, world_size, rank, seed=args.seed
+    )
+    model = DistributedDataParallel(Net())
+    optimizer = optim.SGD(model.parameters(), lr=args.lr * world_size, momentum=args.momentum)
+
+    samples, elapsed, time_to_target, epochs_to_target, accuracy = 0, 0.0, None, None, 0.0
+    for epoch in range(1, args.epochs + 1):
+        loader.sampler.set_epoch(epoch)
+        model.train()
+        dist.barrier()
+        start = time.perf_counter()
+        for data, target in loader:
+            optimizer.zero_grad()
+            F.nll_loss(model(data), target).backward()
+            optimizer.step()
+            samples += len(data)
+        dist.barrier()
+        elapsed += time.perf_counter() - start
+
+        # Evaluation is not timed, and rank 0 tells every worker whether to stop.
+        done = torch.zeros(1)
+        if rank == 0:
+            model.eval()
+            accuracy = _accuracy(model.module, args.data_dir)
+            if accuracy >= args.target_accuracy and time_to_target is None:
+                time_to_target, epochs_to_target = elapsed, epoch
+                done.fill_(1)
+        dist.broadcast(done, src=0)
+        if done.item():
+            break
+
+    if rank == 0:
+        results.put(
+            {
+                "workers": world_size,
+                "threads_per_worker": threads,
+                "samples_per_s": samples * world_size / elapsed,
+                "accuracy": accuracy,
+                "epochs_to_target": epochs_to_target,
+                "time_to_target_s": time_to_target,
+            }
+        )
+    dist.destroy_process_group()
+
+
+def run(args):
+    """Train once per worker count and derive the speedup, efficiency and recommendation."""
+    tensor_data.build_cache(args.data_dir, train=True)
+    tensor_data.build_cache(args.data_dir, train=False)
+    context = mp.get_context("spawn")
+    runs = []
+    for workers in args.workers:
+        results = context.SimpleQueue()
+        mp.spawn(_worker, args=(workers, args, _free_port(), results), nprocs=workers)
+        result = results.get()
+        baseline = runs[0]["samples_per_s"] if runs else result["samples_per_s"]
+        baseline_workers = runs[0]["workers"] if runs else workers
+        result["speedup"] = result["samples_per_s"] / baseline
+        result["efficiency"] = result["speedup"] * baseline_workers / workers
+        runs.append(result)
+        time_to_target = result["time_to_target_s"]
+        print(
+            f"workers={workers:>2}  threads={result['threads_per_worker']:>2}  "
+            f"{result['samples_per_s']:>9.0f} samples/s  speedup={result['speedup']:>5.2f}  "
+            f"efficiency={result['efficiency']:>5.2f}  accuracy={result['accuracy']:>5.2f}%  "
+            "time-to-target="
+            + (f"{time_to_target:.1f}s" if time_to_target is not None else "not reached")
+        )
+    efficient = [r["workers"] for r in runs if r["efficiency"] >= args.min_efficiency]
+    recommended = max(efficient, default=runs[0]["workers"])
+    print(f"recommended workers: {recommended} (efficiency >= {args.min_efficiency})")
+    return {"runs": runs, "recommended_workers": recommended}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--data-dir", type=str, required=True, help="directory holding the MNIST/raw IDX files"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="worker counts to test, the first is the baseline (default: 1 2 4 8)",
+    )
+    parser.add_argument("--epochs", type=int, default=10, help="maximum epochs (default: 10)")
+    parser.add_argument(
+        "--batch-size", type=int, default=64, help="per-worker batch size (default: 64)"
+    )
+    parser.add_argument(
+        "--lr", type=float, default=0.01, help="single-worker learning rate (default: 0.01)"
+    )
+    parser.add_argument("--momentum", type=float, default=0.5, help="SGD momentum (default: 0.5)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed (default: 42)")
+    parser.add_argument(
+        "--target-accuracy",
+        type=float,
+        default=97.0,
+        help="test accuracy that ends a run, in percent (default: 97)",
+    )
+    parser.add_argument(
+        "--min-efficiency",
+        type=float,
+        default=0.7,
+        help="lowest parallel efficiency worth paying for (default: 0.7)",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -0,0 +1,351 @@
+"""CPU benchmark suite of the inference and training hot paths, with regression gating.
+
+Every case is timed over a fixed number of runs after a warmup, and reported as its p50 and p99
+latency in milliseconds and its throughput in items per second:
+
+- `input_fn/*`: decoding raw pixels and `.npy` arrays in place, decoding (and resizing) an
+  uploaded image, and a tar archive of a batch of them.
+- `predict_fn/batch-N`: a forward pass at batch sizes 1 to 1024.
+- `cold-start/*`: loading the model with `model_fn`, and the first request to the loaded model,
+  with `--model-dir` only.
+- `output_fn/*`: encoding 256 predictions as JSON (`output_fn/batch-256`), `.npy` and msgpack,
+  with and without their top 3 labels and scores.
+- `api/predict`: the `/predict` route end to end, against a backend that answers immediately.
+- `preprocess/*`: shrinking a 12 megapixel phone photo to raw pixels in the API, against decoding
+  it in `input_fn` as the endpoint does without preprocessing.
+- `train/step`: one SGD step of `Net` at the training batch size.
+- `augment/*`: random affine, elastic and erasing augmentation of a training batch, at once with
+  `BatchAugment` and image by image with torchvision's transforms, for comparison with the step.
+
+The results are written to a JSON file. Given a baseline produced by an earlier run, every case
+whose p50 latency grew or whose throughput dropped by more than `--tolerance`, or whose p99 latency
+grew by more than `--tail-tolerance`, is reported and the process exits with status 1. Baselines only compare runs on the same kind of machine.
+
+Run it with `python -m mnist_sagemaker_ci_cd.benchmarks.suite --output reports/benchmarks.json`,
+then gate a change with `--baseline reports/benchmarks.json`.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F  # noqa: N812
+from PIL import Image
+from torch import optim
+from torchvision import transforms
+
+from mnist_sagemaker_ci_cd.lib import inference
+from mnist_sagemaker_ci_cd.lib.augment import BACKGROUND, BatchAugment
+from mnist_sagemaker_ci_cd.lib.net import Net
+from serverless.backends import Backend, tar_payloads
+from serverless.preprocess import Preprocessor
+
+BATCH_SIZES = (1, 8, 64, 256, 1024)
+METRICS = {"p50_ms": 1, "p99_ms": 1, "throughput": -1}  # 1: lower is better, -1: higher is.
+TAIL_METRICS = {"p99_ms"}
+
+
+class _StubBackend(Backend):
+    """A backend that answers every upload immediately, so only the API's own work is timed."""
+
+    def _invoke(self, body, content_type, accept, attributes=None):
+        return b'{"prediction": [0]}', "application/json"
+
+    async def predict(self, payload, content_type="application/octet-stream"):
+        return 0
+
+
+def measure(function, runs, items=1, warmup=5):
+    """Time `runs` calls of `function`, which each process `items` items."""
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return summarize(timings, items)
+
+
+def summarize(timings, items=1):
+    """The p50 and p99 latency and the throughput of calls that took `timings` seconds each."""
+    percentiles = statistics.quantiles(timings, n=100)
+    return {
+        "p50_ms": 1000 * percentiles[49],
+        "p99_ms": 1000 * percentiles[98],
+        "throughput": items * len(timings) / sum(timings),
+    }
+
+
+def _image(size, image_format):
+    """Encode a random grayscale image."""
+    pixels = np.random.default_rng(0).integers(0, 256, size, dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def bench_input_fn(runs):
+    """Decode every input path: raw pixels, `.npy` arrays, single images and a tar archive."""
+    png, jpeg = _image((28, 28), "PNG"), _image((280, 280), "JPEG")
+    archive = tar_payloads([png] * 64)
+    pixels = np.random.default_rng(0).integers(0, 256, (64, 28, 28), dtype=np.uint8)
+    raw, npy_uint8, npy_float32 = pixels.tobytes(), io.BytesIO(), io.BytesIO()
+    np.save(npy_uint8, pixels)
+    np.save(npy_float32, pixels.astype(np.float32))
+    cases = {
+        "raw-784": (raw[: inference.RAW_IMAGE_BYTES], inference.RAW_CONTENT_TYPE, 1),
+        "raw-64": (raw, inference.RAW_CONTENT_TYPE, 64),
+        "npy-uint8-64": (npy_uint8.getvalue(), "application/x-npy", 64),
+        "npy-float32-64": (npy_float32.getvalue(), "application/x-npy", 64),
+        "png-28x28": (png, "image/png", 1),
+        "jpeg-280x280": (jpeg, "image/jpeg", 1),
+        "tar-64": (archive, "application/x-tar", 64),
+    }
+    return {
+        f"input_fn/{name}": measure(
+            lambda body=body, content_type=content_type: inference.input_fn(body, content_type),
+            runs,
+            items=items,
+        )
+        for name, (body, content_type, items) in cases.items()
+    }
+
+
+def bench_predict_fn(runs, model):
+    """Score random batches of every size."""
+    results = {}
+    for batch_size in BATCH_SIZES:
+        batch = torch.rand(batch_size, 1, 28, 28) * 255
+        results[f"predict_fn/batch-{batch_size}"] = measure(
+            lambda batch=batch: inference.predict_fn(batch, model, inference.InvocationContext()),
+            max(10, runs * 16 // batch_size),
+            items=batch_size,
+        )
+    return results
+
+
+def bench_cold_start(runs, model_dir):
+    """Load the model from scratch, then time the first request it serves."""
+    batch = torch.rand(1, 1, 28, 28) * 255
+    loads, first_requests = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model = inference.model_fn(model_dir)
+        loads.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        inference.predict_fn(batch, model, inference.InvocationContext())
+        first_requests.append(time.perf_counter() - start)
+    return {
+        "cold-start/model_fn": summarize(loads),
+        "cold-start/first-request": summarize(first_requests),
+    }
+
+
+def bench_output_fn(runs):
+    """Encode 256 predictions in every response format, with and without their top 3 labels."""
+    log_probabilities = torch.randn(256, 10).log_softmax(1)
+    scores, labels = log_probabilities.topk(3, dim=1)
+    predictions = {
+        "": inference.Prediction(log_probabilities.argmax(1)),
+        "top3-": inference.Prediction(labels[:, 0], labels, scores.exp()),
+    }
+    formats = {"json": "application/json", "npy": "application/x-npy"}
+    if inference.msgpack is not None:
+        formats["msgpack"] = inference.MSGPACK_CONTENT_TYPE
+    results = {}
+    for top, prediction in predictions.items():
+        for name, accept in formats.items():
+            # The plain JSON case keeps its original name, so that older baselines still gate it.
+            case = "batch" if name == "json" and not top else f"{top}{name}"
+            results[f"output_fn/{case}-256"] = measure(
+                lambda prediction=prediction, accept=accept: inference.output_fn(
+                    prediction, accept, inference.InvocationContext()
+                ),
+                runs,
+                items=256,
+            )
+    return results
+
+
+def bench_api(runs):
+    """Post distinct uploads to `/predict`, so every request misses the prediction cache."""
+    # Imported here because importing the API creates its SageMaker client.
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    from fastapi.testclient import TestClient  # noqa: PLC0415
+
+    from serverless import api  # noqa: PLC0415
+
+    api.backend = _StubBackend()
+    client = TestClient(api.app)
+    counter = iter(range(sys.maxsize))
+
+    def post():
+        files = {"file": ("image.png", next(counter).to_bytes(8, "big") + bytes(776))}
+        client.post("/predict", files=files).raise_for_status()
+
+    return {"api/predict": measure(post, runs)}
+
+
+def bench_preprocess(runs, size=(4032, 3024)):
+    """Shrink a JPEG photo to raw pixels in the API, and decode it in `input_fn` for comparison."""
+    # A smooth image with some noise, which compresses about as well as a photo.
+    noise = np.random.default_rng(0).integers(0, 32, (size[1], size[0], 3), dtype=np.uint8)
+    gradient = np.asarray(Image.linear_gradient("L").resize(size), dtype=np.uint8)[..., None]
+    buffer = io.BytesIO()
+    Image.fromarray(gradient // 2 + noise).save(buffer, format="JPEG", quality=90)
+    jpeg, preprocess = buffer.getvalue(), Preprocessor()
+    name = f"jpeg-{size[0]}x{size[1]}"
+    # Each run takes milliseconds to a hundred milliseconds, so they are timed over fewer runs.
+    runs = max(10, runs // 10)
+    return {
+        f"preprocess/{name}": measure(lambda: preprocess(jpeg), runs),
+        f"preprocess/input_fn-{name}": measure(
+            lambda: inference.input_fn(jpeg, "image/jpeg"), runs
+        ),
+    }
+
+
+def bench_train(runs, batch_size=64):
+    """Run SGD steps of `Net` on random batches."""
+    torch.manual_seed(0)
+    model = Net().train()
+    optimizer = optim.SGD(model.parameters(), lr=0.01, momentum=0.5)
+    data, target = torch.randn(batch_size, 1, 28, 28), torch.randint(0, 10, (batch_size,))
+
+    def step():
+        optimizer.zero_grad()
+        F.nll_loss(model(data), target).backward()
+        optimizer.step()
+
+    return {f"train/step-batch-{batch_size}": measure(step, runs, items=batch_size)}
+
+
+def bench_augment(runs, batch_size=64):
+    """Augment a batch with every transform, as a batch and as per-sample torchvision transforms."""
+    torch.manual_seed(0)
+    data = torch.randn(batch_size, 1, 28, 28)
+    augment = BatchAugment(torch.device("cpu"), shear=10.0, elastic_alpha=2.0, erasing=0.5)
+    per_sample = transforms.Compose(
+        [
+            transforms.RandomAffine(10, (0.1, 0.1), (0.9, 1.1), 10, fill=BACKGROUND),
+            transforms.ElasticTransform(2.0, 4.0, fill=BACKGROUND),
+            transforms.RandomErasing(0.5),
+        ]
+    )
+
+    def augment_per_sample():
+        return [per_sample(image) for image in data]
+
+    return {
+        f"augment/batch-{batch_size}": measure(lambda: augment(data), runs, items=batch_size),
+        # About a hundred times slower, so timed over fewer runs.
+        f"augment/per-sample-{batch_size}": measure(
+            augment_per_sample, max(10, runs // 10), items=batch_size
+        ),
+    }
+
+
+def compare(results, baseline, tolerance, tail_tolerance):
+    """List the cases of `results` that regressed against `baseline` by more than a tolerance.
+
+    Args:
+        results (dict): The metrics of every case of this run.
+        baseline (dict): The metrics of every case of the baseline run.
+        tolerance (float): The tolerated relative change of p50 and throughput, e.g. 0.2 for 20%.
+        tail_tolerance (float): The tolerated relative change of p99, which is noisier.
+
+    Returns:
+        list[str]: One description per regressed metric.
+    """
+    regressions = []
+    for case, metrics in results.items():
+        for metric, direction in METRICS.items():
+            reference = baseline.get(case, {}).get(metric)
+            if not reference:
+                continue
+            change = (metrics[metric] - reference) / reference
+            if direction * change > (tail_tolerance if metric in TAIL_METRICS else tolerance):
+                regressions.append(
+                    f"{case} {metric}: {reference:.4g} -> {metrics[metric]:.4g} ({change:+.0%})"
+                )
+    return regressions
+
+
+def run(args):
+    """Run every benchmark, in one thread, like a single SageMaker worker."""
+    torch.set_num_threads(args.threads)
+    os.environ["INFERENCE_THREADS"] = str(args.threads)  # Read by model_fn.
+    if args.model_dir:
+        model = inference.model_fn(args.model_dir)
+    else:
+        model = inference.prepare_model(Net(), torch.device("cpu"))
+    results = {
+        **bench_input_fn(args.runs),
+        **bench_predict_fn(args.runs, model),
+        **(bench_cold_start(max(10, args.runs // 10), args.model_dir) if args.model_dir else {}),
+        **bench_output_fn(args.runs),
+        **bench_api(args.runs),
+        **bench_preprocess(args.runs),
+        **bench_train(args.runs),
+        **bench_augment(args.runs),
+    }
+    for case, metrics in results.items():
+        print(
+            f"{case:<24}  p50={metrics['p50_ms']:>8.3f}ms  p99={metrics['p99_ms']:>8.3f}ms  "
+            f"throughput={metrics['throughput']:>10.0f}/s"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200, help="timed runs per case (default: 200)")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads (default: 1)")
+    parser.add_argument(
+        "--model-dir",
+        type=str,
+        default=None,
+        help="benchmark the model served from this directory (default: an untrained Net)",
+    )
+    parser.add_argument(
+        "--baseline", type=str, default=None, help="fail on regressions against this JSON file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="tolerated relative regression of p50 and throughput (default: 0.2)",
+    )
+    parser.add_argument(
+        "--tail-tolerance",
+        type=float,
+        default=0.5,
+        help="tolerated relative regression of p99 (default: 0.5)",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="write the results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    # Read the baseline first, so that it can be overwritten by the output.
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, args.tail_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression against {args.baseline}.")
@@ -1,4 +1,7 @@
 """Module description goes here."""
+import json
+import os
+
 import boto3
 import sagemaker
 import wandb
@@ -24,12 +27,21 @@ wandb.init(
 )
 wandb_run_url = wandb.run.get_url()  # type: ignore
 
-# Hyperparameters
+# Hyperparameters, overridden by the best configuration of the last sweep (see sweep.py).
 hyperparameters = {
     "epochs": 20,
     "backend": "gloo",
     "momentum": 0.5,
+    # Horovod communication, chosen with benchmarks/communication.py.
+    "compression": "none",
+    "backward-passes-per-step": 1,
+    "fusion-threshold-mb": 0,
+    "cycle-time-ms": 0,
 }
+HYPERPARAMETERS_FILE = os.path.join(os.path.dirname(__file__), "hyperparameters.json")
+if os.path.exists(HYPERPARAMETERS_FILE):
+    with open(HYPERPARAMETERS_FILE) as f:
+        hyperparameters.update(json.load(f))
 
 # Environment Variables
 environment = {
@@ -52,6 +64,11 @@ estimator = Estimator(
     base_job_name=settings.output_s3_uri,
     output_path=settings.output_s3_uri,
     code_location=settings.output_s3_uri,
+    # Checkpoints are synced with S3 from /opt/ml/checkpoints, so spot interruptions resume.
+    checkpoint_s3_uri=settings.checkpoint_s3_uri,
+    use_spot_instances=settings.use_spot_instances,
+    max_run=settings.max_run,
+    max_wait=settings.max_wait if settings.use_spot_instances else None,
     sagemaker_session=SESSION,
     source_dir="./",
     dependencies=["src/mnist_sagemaker_ci_cd/deps/fit/requirements.txt"],
@@ -68,6 +85,7 @@ message = (
     f"| --- | --- |\n"
     f"| Job Name | {settings.short_sha} |\n"
     f"| Training Instance | {TRAINING_INSTANCE} |\n"
+    f"| Spot Training | {settings.use_spot_instances} |\n"
     f"| W&B :sparkles: Job URL | [Here]({wandb_run_url}) |\n"
     f"| S3 Artifacts | [Here]({settings.s3_http_url}) |\n"
     f"| Training Logs | [Here]({settings.cloudwatch_logs}) |\n"
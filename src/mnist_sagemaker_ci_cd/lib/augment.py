@@ -0,0 +1,156 @@
+"""Random affine, elastic and erasing augmentation of whole training batches, on the device.
+
+Per-sample torchvision transforms run in Python, image by image, in the loader's worker. Here, every
+transform is drawn for the whole `(B, 1, H, W)` batch at once: the affine transforms and the
+elastic displacement fields are combined into one sampling grid, which resamples the batch with a
+single `grid_sample`, and the erased rectangles are one broadcast mask. It runs on the device the
+batch was moved to, after the loader.
+
+The random numbers come from a generator on that device, reseeded from the seed, the rank and the
+epoch by `set_epoch`, so that every rank augments its shard differently and a run is reproducible.
+"""
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F  # noqa: N812
+
+try:
+    from mnist_sagemaker_ci_cd.lib.tensor_data import MEAN, STD
+except ImportError:  # SageMaker runs train.py as a script from inside lib/.
+    from tensor_data import MEAN, STD
+
+# A black pixel, once normalized like the training images.
+BACKGROUND = -MEAN / STD
+
+
+class BatchAugment:
+    """Augment batches of normalized images with random transforms drawn per image.
+
+    Attributes:
+        degrees (float): The largest rotation, in degrees either way.
+        translate (float): The largest translation, as a fraction of the image size either way.
+        scale (float): The largest relative zoom in or out.
+        shear (float): The largest shear, in degrees either way.
+        elastic_alpha (float): The largest elastic displacement in pixels along each axis, 0 to
+            disable.
+        elastic_sigma (float): The smoothness of the elastic displacements: the spacing in pixels
+            of the random displacements interpolated between.
+        erasing (float): The probability of erasing a rectangle of an image.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        device,
+        *,
+        seed=0,
+        rank=0,
+        degrees=10.0,
+        translate=0.1,
+        scale=0.1,
+        shear=0.0,
+        elastic_alpha=0.0,
+        elastic_sigma=4.0,
+        erasing=0.0,
+    ):
+        """Create the generator on `device`, seeded for epoch 0 of `rank`."""
+        self.degrees = degrees
+        self.translate = translate
+        self.scale = scale
+        self.shear = shear
+        self.elastic_alpha = elastic_alpha
+        self.elastic_sigma = elastic_sigma
+        self.erasing = erasing
+        self._seed = seed
+        self._rank = rank
+        self._generator = torch.Generator(device=device)
+        self._interpolations = {}
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch):
+        """Reseed the generator for an epoch, like `DistributedSampler.set_epoch`."""
+        seed = np.random.SeedSequence([self._seed, self._rank, epoch]).generate_state(1)[0]
+        self._generator.manual_seed(int(seed))
+
+    def __call__(self, images):
+        """Augment a `(B, 1, H, W)` batch of normalized images, returning a new batch."""
+        grid = F.affine_grid(self._affine(images), images.shape, align_corners=False)
+        if self.elastic_alpha:
+            grid = grid + self._displacement(images)
+        # Resample around the background, so that pixels moved in from outside are black.
+        images = (
+            F.grid_sample(images - BACKGROUND, grid, padding_mode="zeros", align_corners=False)
+            + BACKGROUND
+        )
+        if self.erasing:
+            images = images.masked_fill(self._erased(images), 0.0)
+        return images
+
+    def _uniform(self, low, high, *shape, device):
+        """Uniform random numbers in `[low, high)`, from the generator."""
+        return torch.rand(*shape, generator=self._generator, device=device) * (high - low) + low
+
+    def _affine(self, images):
+        """The `(B, 2, 3)` matrices mapping output to input coordinates, in `affine_grid` units."""
+        batch_size, device = len(images), images.device
+        angle = torch.deg2rad(self._uniform(-self.degrees, self.degrees, batch_size, device=device))
+        shear = torch.deg2rad(self._uniform(-self.shear, self.shear, batch_size, device=device))
+        zoom = self._uniform(1 - self.scale, 1 + self.scale, batch_size, device=device)
+        # affine_grid coordinates span [-1, 1], so a shift of a fraction of the size doubles.
+        shift = self._uniform(-self.translate, self.translate, batch_size, 2, device=device) * 2
+        cos, sin, tan = torch.cos(angle), torch.sin(angle), torch.tan(shear)
+        # The inverse of a rotation, then a shear along x, then a zoom.
+        theta = torch.stack(
+            [
+                torch.stack([cos, sin + cos * tan], 1),
+                torch.stack([-sin, cos - sin * tan], 1),
+            ],
+            1,
+        ) / zoom.view(-1, 1, 1)
+        return torch.cat([theta, shift.unsqueeze(2)], 2)
+
+    def _displacement(self, images):
+        """Smooth random `(B, H, W, 2)` displacements of the sampling grid.
+
+        Random displacements on a coarse grid, `elastic_sigma` pixels apart, are interpolated to
+        every pixel, which smooths them like the Gaussian blur of per-pixel noise in
+        `ElasticTransform` at a fraction of its cost. The bicubic interpolation is separable, so
+        it is two small matrix products.
+        """
+        batch_size, _, height, width = images.shape
+        rows, columns = (self._interpolation(side, images.device) for side in (height, width))
+        noise = self._uniform(
+            -1, 1, batch_size, 2, rows.shape[1], columns.shape[1], device=images.device
+        )
+        # Bicubic interpolation overshoots its points a little, which the clamp undoes.
+        noise = (rows @ noise @ columns.T).clamp(-1, 1)
+        # Pixels to grid units, in which the image spans 2 along each axis.
+        size = torch.tensor([width, height], dtype=noise.dtype, device=noise.device)
+        return noise.permute(0, 2, 3, 1) * (2 * self.elastic_alpha / size)
+
+    def _interpolation(self, size, device):
+        """The `(size, points)` matrix interpolating points `elastic_sigma` pixels apart, cached."""
+        if size not in self._interpolations:
+            points = max(2, round(size / self.elastic_sigma))
+            identity = torch.eye(points, device=device).view(points, 1, points, 1)
+            columns = F.interpolate(identity, size=(size, 1), mode="bicubic", align_corners=True)
+            self._interpolations[size] = columns.view(points, size).T.contiguous()
+        return self._interpolations[size]
+
+    def _erased(self, images):
+        """A `(B, 1, H, W)` mask of one random rectangle per erased image, like `RandomErasing`."""
+        batch_size, _, height, width = images.shape
+        device = images.device
+        erased = self._uniform(0, 1, batch_size, device=device) < self.erasing
+        area = self._uniform(0.02, 0.33, batch_size, device=device) * height * width
+        ratio = torch.exp(self._uniform(math.log(0.3), math.log(3.3), batch_size, device=device))
+        h = torch.sqrt(area * ratio).clamp(1, height)
+        w = torch.sqrt(area / ratio).clamp(1, width)
+        top = self._uniform(0, 1, batch_size, device=device) * (height - h)
+        left = self._uniform(0, 1, batch_size, device=device) * (width - w)
+        rows = torch.arange(height, device=device).view(1, -1)
+        columns = torch.arange(width, device=device).view(1, -1)
+        in_rows = (rows >= top.view(-1, 1)) & (rows < (top + h).view(-1, 1))
+        in_columns = (columns >= left.view(-1, 1)) & (columns < (left + w).view(-1, 1))
+        mask = in_rows.unsqueeze(2) & in_columns.unsqueeze(1) & erased.view(-1, 1, 1)
+        return mask.unsqueeze(1)
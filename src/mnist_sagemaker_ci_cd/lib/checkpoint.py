@@ -0,0 +1,191 @@
+"""Periodic training checkpoints, written by a background thread, and resuming from them.
+
+A checkpoint holds the model and optimizer state, the position of the training loop and the RNG
+states. The training thread only copies that state to host memory; a writer thread serializes it to
+disk, atomically, so a preemption never leaves a truncated file under a checkpoint name. When the
+writer is still busy, a newer checkpoint replaces the pending one instead of queueing behind it.
+
+SageMaker syncs `/opt/ml/checkpoints` with the estimator's `checkpoint_s3_uri`, and restores it when
+a managed spot job restarts. The per-epoch test metrics are appended to `metrics.jsonl` in the same
+directory, so a running job's progress can be followed from S3.
+"""
+import glob
+import json
+import logging
+import os
+import random
+import threading
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = "/opt/ml/checkpoints"
+CHECKPOINT_PATTERN = "checkpoint-*.pt"
+KEYS = {"model", "optimizer", "epoch", "step", "rng"}
+METRICS_FILE = "metrics.jsonl"
+
+
+def _to_cpu(state):
+    """Copy every tensor of a nested state to host memory, so training can keep updating it."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: _to_cpu(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(_to_cpu(value) for value in state)
+    return state
+
+
+def rng_state():
+    """The states of every random number generator training draws from."""
+    return {
+        "python": random.getstate(),
+        # The global NumPy generator, still the one DataLoader workers and most libraries draw from.
+        "numpy": np.random.get_state(),  # noqa: NPY002
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def set_rng_state(state):
+    """Restore the random number generators from `rng_state`."""
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])  # noqa: NPY002
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def append_metrics(directory, metrics):
+    """Append one record of metrics, e.g. an epoch's test accuracy, to `metrics.jsonl`."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, METRICS_FILE), "a") as f:
+        f.write(json.dumps(metrics) + "\n")
+
+
+def read_metrics(lines):
+    """Parse the records of a `metrics.jsonl` file, ignoring a last line still being written."""
+    records = []
+    for line in lines:
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            break
+    return records
+
+
+def load_latest(directory):
+    """Load the newest checkpoint of `directory` that can be read, skipping corrupt ones.
+
+    Returns:
+        dict | None: The checkpoint, with its tensors on the CPU, or None if there is none.
+    """
+    for path in sorted(glob.glob(os.path.join(directory, CHECKPOINT_PATTERN)), reverse=True):
+        try:
+            state = torch.load(path, map_location="cpu", weights_only=False)
+        except Exception as e:
+            logger.warning(f"Skipping the unreadable checkpoint {path}: {e}")
+            continue
+        if isinstance(state, dict) and state.keys() >= KEYS:
+            logger.info(f"Resuming from {path}")
+            return state
+        logger.warning(f"Skipping the incomplete checkpoint {path}")
+    return None
+
+
+class AsyncCheckpointer:
+    """Write checkpoints from a background thread, keeping the `keep` newest ones.
+
+    Attributes:
+        directory (str): Where the checkpoints are written.
+        keep (int): How many checkpoints are kept, older ones are deleted once a newer one is written.
+    """
+
+    def __init__(self, directory=CHECKPOINT_DIR, keep=2):
+        """Start the writer thread."""
+        self.directory = directory
+        self.keep = keep
+        self._pending = None
+        self._busy = False
+        self._closed = False
+        self._error = None
+        self._condition = threading.Condition()
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="checkpointer", daemon=True)
+        self._thread.start()
+
+    def save(self, model, optimizer, epoch, step):
+        """Snapshot the training state and queue it for writing.
+
+        Args:
+            model (torch.nn.Module): The model.
+            optimizer (torch.optim.Optimizer): The optimizer, possibly a Horovod
+                `DistributedOptimizer`.
+            epoch (int): The epoch training resumes at.
+            step (int): The number of batches of `epoch` already trained on.
+        """
+        state = {
+            "model": _to_cpu(model.state_dict()),
+            "optimizer": _to_cpu(optimizer.state_dict()),
+            "epoch": epoch,
+            "step": step,
+            "rng": rng_state(),
+        }
+        with self._condition:
+            self._raise_error()
+            self._pending = state
+            self._condition.notify_all()
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending is None and not self._busy)
+            self._raise_error()
+
+    def close(self):
+        """Write the queued checkpoint, then stop the writer thread."""
+        self.wait()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed.") from error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._closed)
+                if self._pending is None:
+                    return
+                state, self._pending, self._busy = self._pending, None, True
+            try:
+                self._write(state)
+            except Exception as e:
+                logger.exception("Writing a checkpoint failed")
+                with self._condition:
+                    self._error = e
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _write(self, state):
+        """Write one checkpoint atomically, then delete the oldest ones."""
+        name = f"checkpoint-{state['epoch']:04d}-{state['step']:08d}.pt"
+        path = os.path.join(self.directory, name)
+        partial = f"{path}.partial"
+        with open(partial, "wb") as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+        checkpoints = sorted(glob.glob(os.path.join(self.directory, CHECKPOINT_PATTERN)))
+        for old in checkpoints[: -self.keep]:
+            os.remove(old)
+        logger.debug(f"Wrote {path}")
@@ -0,0 +1,25 @@
+"""Tensor fusion settings of the Horovod optimizer.
+
+Horovod fuses the gradients ready within one cycle into buffers of up to its fusion threshold
+before reducing them. Both are read from the environment by `hvd.init`, and default to 128 MiB
+and 1 ms. This module does not import Horovod, so that the communication benchmark and the tests
+share the settings without it.
+"""
+
+
+def fusion_environment(fusion_threshold_mb=0.0, cycle_time_ms=0.0):
+    """The Horovod environment variables of a fusion buffer size and cycle time.
+
+    Args:
+        fusion_threshold_mb (float): The size of the fusion buffer in MiB, 0 to keep Horovod's.
+        cycle_time_ms (float): The fusion cycle time in ms, 0 to keep Horovod's.
+
+    Returns:
+        dict[str, str]: The variables to set before `hvd.init`.
+    """
+    environment = {}
+    if fusion_threshold_mb:
+        environment["HOROVOD_FUSION_THRESHOLD"] = str(int(fusion_threshold_mb * 1024 * 1024))
+    if cycle_time_ms:
+        environment["HOROVOD_CYCLE_TIME"] = str(cycle_time_ms)
+    return environment
@@ -0,0 +1,61 @@
+"""Sharding of an epoch's samples that follows the workers of an elastic training job.
+
+A `DistributedSampler` shards one shuffled order of the dataset by striding through it, so after
+`k` batches of `B` samples on each of `W` workers, they trained on exactly the first `k * B * W`
+samples of that order together. When Horovod Elastic adds or removes workers mid-epoch, the samples
+after that position are resharded between the new workers, which carry on with the same epoch
+instead of skipping or repeating samples. The shuffled order does not depend on the number of
+workers, and before any resharding the shards are those of `DistributedSampler`.
+
+It does not import Horovod: the training loop counts the samples trained on in its elastic state,
+and reshards the samplers once that state is restored and synced.
+"""
+import math
+
+import torch.utils.data.distributed
+
+
+class ElasticDistributedSampler(torch.utils.data.distributed.DistributedSampler):
+    """A `DistributedSampler` whose shards can be redrawn for another number of workers.
+
+    Attributes:
+        processed (int): The samples of the epoch's order trained on by every worker together, which
+            are left out of the shards.
+    """
+
+    def __init__(self, dataset, num_replicas=1, rank=0, **kwargs):
+        """Initialize the sampler, passing `kwargs` such as `shuffle` to `DistributedSampler`."""
+        super().__init__(dataset, num_replicas=num_replicas, rank=rank, **kwargs)
+        self.processed = 0
+
+    def reshard(self, num_replicas, rank, processed=0):
+        """Shard the samples after the first `processed` of the epoch between `num_replicas` workers.
+
+        Args:
+            num_replicas (int): The number of workers.
+            rank (int): The rank of this worker.
+            processed (int): The samples of the epoch already trained on.
+        """
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.processed = processed
+
+    def __len__(self):
+        """The number of samples of this worker's shard."""
+        return math.ceil(max(0, len(self.dataset) - self.processed) / self.num_replicas)
+
+    def __iter__(self):
+        """Yield the indices of this worker's shard of the samples not trained on yet."""
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(len(self.dataset), generator=generator).tolist()
+        else:
+            order = list(range(len(self.dataset)))
+        remaining = order[self.processed :]
+        # Pad the shards to the same length with the first samples, like `DistributedSampler`.
+        total_size = len(self) * self.num_replicas
+        padding = total_size - len(remaining)
+        if padding:
+            remaining += (remaining * math.ceil(padding / len(remaining)))[:padding]
+        return iter(remaining[self.rank : total_size : self.num_replicas])
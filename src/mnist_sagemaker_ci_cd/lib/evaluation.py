@@ -0,0 +1,76 @@
+"""Evaluation loop that keeps its running totals on the device.
+
+The loss, the correct count and the optional confusion matrix are accumulated as device tensors and
+packed into one flat tensor, so a whole evaluation needs a single host sync, and a single allreduce
+across Horovod ranks. Only the examples sampled for logging are kept, so memory does not grow with
+the size of the test set.
+"""
+import torch
+import torch.nn.functional as F  # noqa: N812
+
+
+def evaluate(  # noqa: PLR0913
+    model, loader, device, *, num_classes=0, sample_every=100, max_samples=100
+):
+    """Evaluate a model without syncing with the device until the end.
+
+    Args:
+        model (torch.nn.Module): The model, returning log-probabilities.
+        loader (Iterable): Yields `(data, target)` batches.
+        device (torch.device): The device the model is on.
+        num_classes (int): The number of classes of the confusion matrix, 0 to skip it.
+        sample_every (int): Keep every `sample_every`-th example, and its prediction, for logging.
+        max_samples (int): The maximum number of examples kept for logging.
+
+    Returns:
+        tuple[torch.Tensor, torch.Tensor, torch.Tensor]: The packed totals (see `unpack_totals`),
+            the sampled examples and their predicted labels, all on `device`.
+    """
+    loss = torch.zeros((), dtype=torch.float64, device=device)
+    correct = torch.zeros((), dtype=torch.int64, device=device)
+    confusion = torch.zeros(num_classes * num_classes, dtype=torch.int64, device=device)
+    examples, predictions = [], []
+    count = sampled = 0
+    model.eval()
+    with torch.no_grad():
+        for inputs, labels in loader:
+            data = inputs.to(device, non_blocking=True)
+            target = labels.to(device, non_blocking=True)
+            output = model(data)
+            loss += F.nll_loss(output, target, reduction="sum")
+            pred = output.argmax(1)
+            correct += pred.eq(target).sum()
+            if num_classes:
+                confusion += torch.bincount(
+                    target * num_classes + pred, minlength=confusion.numel()
+                )
+            if sampled < max_samples:
+                # The first index of this batch that falls on the sampling stride.
+                keep = slice((-count) % sample_every, None, sample_every)
+                examples.append(data[keep][: max_samples - sampled])
+                predictions.append(pred[keep][: max_samples - sampled])
+                sampled += len(examples[-1])
+            count += len(data)
+    totals = torch.cat(
+        [torch.stack([loss, correct.double(), loss.new_tensor(count)]), confusion.double()]
+    )
+    if not examples:
+        return totals, torch.empty(0, device=device), torch.empty(0, device=device)
+    return totals, torch.cat(examples), torch.cat(predictions)
+
+
+def unpack_totals(totals, num_classes=0):
+    """Copy the totals of `evaluate`, possibly summed over workers, to the host.
+
+    Returns:
+        tuple[float, float, list[list[int]] | None]: The average loss, the accuracy as a fraction,
+            and the confusion matrix, with a row per actual class and a column per predicted class.
+    """
+    loss, correct, count, *confusion = totals.cpu().tolist()
+    matrix = None
+    if num_classes:
+        matrix = [
+            [int(n) for n in confusion[row * num_classes : (row + 1) * num_classes]]
+            for row in range(num_classes)
+        ]
+    return loss / count, correct / count, matrix
@@ -0,0 +1,95 @@
+"""Export of the trained model to compiled TorchScript and ONNX artifacts.
+
+The compiled artifacts are written next to `model.pth` so that `inference.model_fn` can serve the
+fastest one available. An artifact is only kept if it passes a parity check against the eager model.
+"""
+import logging
+import os
+
+import torch
+
+try:
+    import onnxruntime
+except ImportError:  # ONNX Runtime is optional, without it the ONNX graph cannot be verified.
+    onnxruntime = None
+
+logger = logging.getLogger(__name__)
+
+TORCHSCRIPT_FILE = "model.pt"
+ONNX_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.pt"
+PARITY_ATOL = 1e-4
+
+
+def parity_batch(batch_size=64):
+    """A fixed batch of random 28x28 images, in the raw 0-255 range that `input_fn` produces."""
+    generator = torch.Generator().manual_seed(0)
+    return torch.rand(batch_size, 1, 28, 28, generator=generator) * 255
+
+
+def check_parity(expected, actual, name, atol=PARITY_ATOL):
+    """Raise a ValueError if a compiled artifact's outputs differ from the eager model's."""
+    expected, actual = torch.as_tensor(expected), torch.as_tensor(actual)
+    error = (expected - actual).abs().max().item()
+    if error > atol or not torch.equal(expected.argmax(1), actual.argmax(1)):
+        raise ValueError(f"{name} does not match the eager model (max abs error {error:.2e}).")
+    logger.info(f"{name} matches the eager model (max abs error {error:.2e}).")
+
+
+def export_torchscript(model, model_dir):
+    """Trace and freeze the model into a TorchScript module, verified against the eager model."""
+    path = os.path.join(model_dir, TORCHSCRIPT_FILE)
+    batch = parity_batch()
+    with torch.no_grad():
+        module = torch.jit.freeze(torch.jit.trace(model, batch[:1]))
+        check_parity(model(batch), module(batch), "TorchScript")
+    module.save(path)
+    return path
+
+
+def export_onnx(model, model_dir):
+    """Export the model to an ONNX graph with a dynamic batch axis, verified with ONNX Runtime."""
+    if onnxruntime is None:
+        logger.warning("Skipping the ONNX export, onnxruntime is not installed to verify it.")
+        return None
+    path = os.path.join(model_dir, ONNX_FILE)
+    batch = parity_batch()
+    torch.onnx.export(
+        model,
+        (batch[:1],),
+        path,
+        input_names=["input"],
+        output_names=["log_probs"],
+        dynamic_axes={"input": {0: "batch"}, "log_probs": {0: "batch"}},
+        opset_version=17,
+    )
+    session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+    try:
+        with torch.no_grad():
+            check_parity(model(batch), session.run(None, {"input": batch.numpy()})[0], "ONNX")
+    except ValueError:
+        os.remove(path)
+        raise
+    return path
+
+
+def export_compiled(model, model_dir):
+    """Write every compiled artifact that passes its parity check next to `model.pth`.
+
+    A failed export is logged and skipped, since `model_fn` can always fall back to the
+    eager model.
+
+    Returns:
+        list[str]: The paths of the exported artifacts.
+    """
+    model = model.cpu().eval()
+    paths = []
+    for export in (export_torchscript, export_onnx):
+        try:
+            path = export(model, model_dir)
+        except Exception as e:
+            logger.warning(f"Skipping {export.__name__}: {e}")
+            continue
+        if path is not None:
+            paths.append(path)
+    return paths
@@ -2,109 +2,582 @@
 import io
 import logging
 import os
+import tarfile
+import warnings
+import zipfile
+from email import policy
+from email.parser import BytesParser
+from http import HTTPStatus
+from typing import NamedTuple
 
 import numpy as np
 import torch
-import torch.nn.functional as F
 from PIL import Image
-from sagemaker_inference import encoder
-from torch import nn
-
-
-class Net(nn.Module):
-    """Neural network model for image classification."""
-
-    def __init__(self):
-        """Initialize the neural network model."""
-        super(Net, self).__init__()  # noqa: UP008
-        self.conv1 = nn.Conv2d(1, 10, kernel_size=5)
-        self.conv2 = nn.Conv2d(10, 20, kernel_size=5)
-        self.conv2_drop = nn.Dropout2d()
-        self.fc1 = nn.Linear(320, 50)
-        self.fc2 = nn.Linear(50, 10)
-
-    def forward(self, x):
-        """Forward pass of the neural network.
-
-        Args:
-            x (torch.Tensor): Input tensor.
-
-        Returns:
-            torch.Tensor: Output tensor after passing through the network.
-        """
-        x = F.relu(F.max_pool2d(self.conv1(x), 2))
-        x = F.relu(F.max_pool2d(self.conv2_drop(self.conv2(x)), 2))
-        x = x.view(-1, 320)
-        x = F.relu(self.fc1(x))
-        x = F.dropout(x, training=self.training)
-        x = self.fc2(x)
-        return F.log_softmax(x, dim=1)
-
-
-def model_fn(model_dir):
-    """Load the PyTorch model from the `model_dir` directory."""
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = Net()
-    with open(os.path.join(model_dir, "model.pth"), "rb") as f:
-        model.load_state_dict(torch.load(f))
-        logging.info("Model loaded.")
-    return model.to(device)
+from sagemaker_inference import content_types, encoder, errors
 
+try:
+    import onnxruntime
+except ImportError:  # ONNX Runtime is optional, model_fn then serves the TorchScript module.
+    onnxruntime = None
 
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, output_fn then only answers JSON and `.npy`.
+    msgpack = None
+
+try:
+    from mnist_sagemaker_ci_cd.lib.export import ONNX_FILE, QUANTIZED_FILE, TORCHSCRIPT_FILE
+    from mnist_sagemaker_ci_cd.lib.net import Net
+    from mnist_sagemaker_ci_cd.lib.raw_format import (
+        IMAGE_SIGNATURES,
+        IMAGE_SIZE,
+        RAW_CONTENT_TYPE,
+        RAW_IMAGE_BYTES,
+        RAW_SUFFIX,
+    )
+    from mnist_sagemaker_ci_cd.lib.stage_metrics import StageMetrics, request_id
+except ImportError:  # SageMaker loads this file from inside lib/, next to its sibling modules.
+    from export import ONNX_FILE, QUANTIZED_FILE, TORCHSCRIPT_FILE
+    from net import Net
+    from raw_format import (
+        IMAGE_SIGNATURES,
+        IMAGE_SIZE,
+        RAW_CONTENT_TYPE,
+        RAW_IMAGE_BYTES,
+        RAW_SUFFIX,
+    )
+    from stage_metrics import StageMetrics, request_id
+
+logger = logging.getLogger(__name__)
+
+CUSTOM_ATTRIBUTES_HEADER = "X-Amzn-SageMaker-Custom-Attributes"
+TOP_K_ATTRIBUTE = "top-k"
+# The endpoint cannot serve a metrics route, so the stage latencies are printed as CloudWatch EMF
+# documents every METRICS_EMF_INTERVAL seconds (0 disables them).
+METRICS_EMF_INTERVAL = float(os.environ.get("METRICS_EMF_INTERVAL", "60"))
+metrics = StageMetrics(
+    "mnist_inference",
+    debug_sample_rate=float(os.environ.get("METRICS_DEBUG_SAMPLE_RATE", "0.01")),
+)
+# Batch sizes run through the model once it is loaded, so that the first requests do not pay for
+# allocations and kernel selection (an empty list disables the warmup).
+WARMUP_BATCH_SIZES = tuple(
+    int(size) for size in os.environ.get("MODEL_WARMUP_BATCH_SIZES", "1,8,64").split(",") if size
+)
+WARMUP_RUNS = 3
+
+
+class OnnxModel:
+    """Serve an ONNX graph with ONNX Runtime behind the interface `predict_fn` expects of a module."""
+
+    def __init__(self, path, threads=0):
+        """Start an ONNX Runtime session on the CPU, with `threads` intra-op threads (0: all)."""
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, x):
+        """Run the graph on a batch and return its log-probabilities."""
+        return torch.from_numpy(self.session.run(None, {"input": x.cpu().numpy()})[0])
+
+
+class ServingModel:
+    """A model prepared once for serving: on its device, in evaluation mode and warmed up.
+
+    Instances are immutable, so that every request and worker thread shares the same state without
+    preparing anything per request.
+
+    Attributes:
+        model (Callable[[torch.Tensor], torch.Tensor]): The module, or ONNX model, returning
+            log-probabilities.
+        device (torch.device): The device batches are moved to.
+        kind (str): The artifact served, "int8", "onnx", "torchscript" or "eager".
+    """
+
+    __slots__ = ("device", "kind", "model")
+
+    def __init__(self, model, device, kind):
+        """Wrap a model that is already on `device` and in evaluation mode."""
+        object.__setattr__(self, "model", model)
+        object.__setattr__(self, "device", device)
+        object.__setattr__(self, "kind", kind)
+
+    def __setattr__(self, name, value):
+        """Refuse changes, the model is shared by every request."""
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __call__(self, batch):
+        """Score a `(N, 1, 28, 28)` batch and return its log-probabilities."""
+        with torch.inference_mode():
+            return self.model(batch.to(self.device, non_blocking=True))
+
+    def warmup(self, batch_sizes=WARMUP_BATCH_SIZES, runs=WARMUP_RUNS):
+        """Run dummy batches of every size, a few times for the TorchScript profiling executor."""
+        for batch_size in batch_sizes:
+            batch = torch.zeros(batch_size, 1, *IMAGE_SIZE)
+            for _ in range(runs):
+                self(batch)
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+
+def prepare_model(model, device, kind="eager", warmup_batch_sizes=WARMUP_BATCH_SIZES):
+    """Place a model on `device` in evaluation mode, without gradients, and warm it up.
+
+    Returns:
+        ServingModel: The prepared model, which `predict_fn` expects.
+    """
+    if isinstance(model, torch.nn.Module):
+        model = model.to(device).eval()
+        for parameter in model.parameters():
+            parameter.requires_grad_(False)
+    serving_model = ServingModel(model, device, kind)
+    serving_model.warmup(warmup_batch_sizes)
+    return serving_model
+
+
+def serving_threads(workers=None):
+    """The intra-op threads of one model server worker: the instance's vCPUs split between them.
+
+    `INFERENCE_THREADS` overrides it. SageMaker starts `SAGEMAKER_MODEL_SERVER_WORKERS` workers, each
+    loading its own copy of the model.
+
+    Args:
+        workers (int): The workers splitting the vCPUs, such as the threads of the API's local
+            backend (default: `SAGEMAKER_MODEL_SERVER_WORKERS`, or 1).
+    """
+    if os.environ.get("INFERENCE_THREADS"):
+        return int(os.environ["INFERENCE_THREADS"])
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    workers = workers or int(os.environ.get("SAGEMAKER_MODEL_SERVER_WORKERS") or 1)
+    return max(1, (cpus or 1) // workers)
+
+
+def model_fn(model_dir, context=None):
+    """Load the model of the `model_dir` directory with `load_model`, on the worker's device.
+
+    The inference toolkit passes the `context` only to handlers that take one more parameter than
+    it has arguments, so this signature must not change.
+
+    Args:
+        model_dir (str): The directory holding the model artifacts.
+        context (sagemaker_inference.model_server.context.ModelServerContext): Model server context,
+            whose `gpu_id` is the GPU of this worker.
+
+    Returns:
+        ServingModel: The prepared model.
+    """
+    gpu_id = context.system_properties.get("gpu_id") if context else None
+    return load_model(model_dir, gpu_id=gpu_id)
+
+
+def load_model(model_dir, gpu_id=None, threads=None):
+    """Load the fastest model artifact available in the `model_dir` directory, ready to serve.
+
+    On CPU, the int8 model is served when training published it, which it only does if it passed
+    the accuracy gate. Next comes the ONNX graph, served with ONNX Runtime when it is installed.
+    Otherwise the frozen TorchScript module is served, optimized for inference when on CPU. Both
+    were checked against the eager model when training exported them. The eager `Net` is only
+    rebuilt from `model.pth` for models trained before the compiled artifacts existed.
+
+    The model is placed on the worker's GPU, or limited to its share of the CPUs, and warmed up
+    once here, so `predict_fn` only runs the forward pass.
+
+    Args:
+        model_dir (str): The directory holding the model artifacts.
+        gpu_id (int): The GPU of this worker, when there are GPUs (default: the first one).
+        threads (int): The intra-op threads on CPU (default: `serving_threads()`).
+
+    Returns:
+        ServingModel: The prepared model.
+    """
+    if torch.cuda.is_available():
+        device = torch.device(f"cuda:{gpu_id or 0}")
+    else:
+        device = torch.device("cpu")
+        torch.set_num_threads(threads or serving_threads())
+    quantized_path = os.path.join(model_dir, QUANTIZED_FILE)
+    onnx_path = os.path.join(model_dir, ONNX_FILE)
+    torchscript_path = os.path.join(model_dir, TORCHSCRIPT_FILE)
+    if device.type == "cpu" and os.path.exists(quantized_path):
+        model, kind = torch.jit.load(quantized_path, map_location=device), "int8"
+    elif device.type == "cpu" and onnxruntime is not None and os.path.exists(onnx_path):
+        model, kind = OnnxModel(onnx_path, torch.get_num_threads()), "onnx"
+    elif os.path.exists(torchscript_path):
+        model, kind = torch.jit.load(torchscript_path, map_location=device), "torchscript"
+        if device.type == "cpu":
+            model = torch.jit.optimize_for_inference(model)
+    else:
+        model, kind = Net(), "eager"
+        with open(os.path.join(model_dir, "model.pth"), "rb") as f:
+            model.load_state_dict(torch.load(f, map_location=device))
+    serving_model = prepare_model(model, device, kind)
+    logger.info(f"Serving the {kind} model on {device}, with {torch.get_num_threads()} threads.")
+    return serving_model
+
+
+# Content types that carry a single encoded image, decoded with PIL.
+IMAGE_CONTENT_TYPES = {
+    "application/octet-stream",
+    "image/png",
+    "image/jpeg",
+    "image/bmp",
+    "image/gif",
+}
+
+
+def _parse_content_type(content_type):
+    """Split a content type header into its lowercase media type and its parameters."""
+    media_type, _, params = (content_type or "application/octet-stream").partition(";")
+    parameters = {}
+    for param in params.split(";"):
+        key, _, value = param.partition("=")
+        if key.strip():
+            parameters[key.strip().lower()] = value.strip().strip('"')
+    return media_type.strip().lower(), parameters
+
+
+def _decode_raw(payload):
+    """View raw uint8 images as a `(N, 1, 28, 28)` array, without copying the payload."""
+    if not payload or len(payload) % RAW_IMAGE_BYTES:
+        raise ValueError(
+            f"Raw images must be a multiple of {RAW_IMAGE_BYTES} bytes, got {len(payload)} bytes."
+        )
+    return np.frombuffer(payload, dtype=np.uint8).reshape(-1, 1, *IMAGE_SIZE)
+
+
+def _decode_npy(payload):
+    """View the array of a `.npy` payload where it lies in the request body, without copying it.
+
+    Only the header is parsed by NumPy. Arrays that cannot be viewed in place, in Fortran order or
+    of object dtype, fall back to `np.load`.
+    """
+    size_bytes = 2 if payload[6:7] == b"\x01" else 4  # The header length field of format 1.0.
+    offset = 8 + size_bytes + int.from_bytes(payload[8 : 8 + size_bytes], "little")
+    header = io.BytesIO(bytes(payload[:offset]))
+    version = np.lib.format.read_magic(header)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+    if fortran_order or dtype.hasobject:
+        return np.load(io.BytesIO(payload), allow_pickle=False)
+    count = int(np.prod(shape))
+    return np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def _decode_payload(payload):
+    """Decode one image, either raw pixels or an encoded image."""
+    if len(payload) == RAW_IMAGE_BYTES and not bytes(payload[:4]).startswith(IMAGE_SIGNATURES):
+        return _decode_raw(payload)
+    return _decode_image(payload)
+
+
+def _decode_image(payload):
+    """Decode one encoded image into a `(28, 28)` float32 array."""
+    image = Image.open(io.BytesIO(payload))
+    grayscale_image = image.convert("L")
+    resized_image = grayscale_image.resize(IMAGE_SIZE)
+    return np.asarray(resized_image, dtype=np.float32)
+
+
+def _stack_arrays(arrays):
+    """Reshape a sequence of `(28, 28)`, `(N, 28, 28)` or `(N, 1, 28, 28)` arrays into one batch."""
+    if not arrays:
+        raise ValueError("The request did not contain any images.")
+    batch = []
+    for array in arrays:
+        if array.shape[-2:] != IMAGE_SIZE:
+            raise ValueError(f"Expected images of shape {IMAGE_SIZE}, got {array.shape}.")
+        batch.append(array.reshape(-1, 1, *IMAGE_SIZE).astype(np.float32, copy=False))
+    if len(batch) == 1:
+        return batch[0]
+    return np.concatenate(batch, axis=0)
+
+
+def _decode_tar(payload):
+    """Decode every regular file of a tar archive, raw pixels or encoded, in archive order.
+
+    Members named with `RAW_SUFFIX` are raw pixels, the others are told apart by their size and
+    leading bytes.
+    """
+    with tarfile.open(fileobj=io.BytesIO(payload)) as archive:
+        return [
+            (_decode_raw if member.name.endswith(RAW_SUFFIX) else _decode_payload)(
+                archive.extractfile(member).read()  # type: ignore
+            )
+            for member in archive.getmembers()
+            if member.isfile()
+        ]
+
+
+def _decode_zip(payload):
+    """Decode every file of a zip archive, raw pixels or encoded, in archive order."""
+    with zipfile.ZipFile(io.BytesIO(payload)) as archive:
+        return [
+            _decode_payload(archive.read(info)) for info in archive.infolist() if not info.is_dir()
+        ]
+
+
+def _decode_multipart(payload, content_type):
+    """Decode every part of a `multipart/form-data` body, raw pixels or encoded, in request order."""
+    header = f"Content-Type: {content_type}\r\n\r\n".encode()
+    message = BytesParser(policy=policy.HTTP).parsebytes(header + bytes(payload))
+    return [_decode_payload(part.get_payload(decode=True)) for part in message.iter_parts()]
+
+
+class InvocationContext:
+    """The subset of the model server context that the handlers read, for calls outside SageMaker.
+
+    The API's local backend, the endpoint emulator and the bulk scorer pass it to `predict_fn` and
+    `output_fn` in place of the context of the SageMaker model server.
+
+    Attributes:
+        custom_attributes (str): The `CUSTOM_ATTRIBUTES_HEADER` of the invocation, e.g. `top-k=3`.
+    """
+
+    system_properties = {"gpu_id": 0}  # noqa: RUF012
+
+    def __init__(self, custom_attributes=""):
+        """Carry the custom attributes of one invocation."""
+        self.custom_attributes = custom_attributes
+
+    def get_request_header(self, idx, key):
+        """Read a header of the request, of which only the custom attributes are forwarded."""
+        return self.custom_attributes if key == CUSTOM_ATTRIBUTES_HEADER else None
+
+
+def _request_attributes(context):
+    """Parse the SageMaker custom attributes of a request, e.g. `request-id=abc,top-k=3`."""
+    get_request_header = getattr(context, "get_request_header", None)
+    header = get_request_header(0, CUSTOM_ATTRIBUTES_HEADER) if get_request_header else None
+    attributes = {}
+    for attribute in (header or "").split(","):
+        key, _, value = attribute.strip().partition("=")
+        if key:
+            attributes[key] = value
+    return attributes
+
+
+def _top_k(attributes):
+    """The number of best labels to return per image, from the `top-k` attribute (0: only one)."""
+    value = attributes.get(TOP_K_ATTRIBUTE) or "0"
+    if not value.isdigit():
+        raise errors.GenericInferenceToolkitError(
+            HTTPStatus.BAD_REQUEST,
+            f"The {TOP_K_ATTRIBUTE} attribute must be an integer, got {value}.",
+        )
+    return int(value)
+
+
+def _decode(payload, content_type):
+    """Decode a request body into a `(N, 1, 28, 28)` array, dispatching on its content type."""
+    media_type, parameters = _parse_content_type(content_type)
+    if media_type == RAW_CONTENT_TYPE:
+        arrays = [_decode_raw(payload)]
+    elif media_type == content_types.NPY:
+        arrays = [_decode_npy(payload)]
+    elif media_type == "application/octet-stream":
+        arrays = [_decode_payload(payload)]
+    elif media_type in IMAGE_CONTENT_TYPES:
+        arrays = [_decode_image(payload)]
+    elif media_type == content_types.NPZ:
+        with np.load(io.BytesIO(payload), allow_pickle=False) as archive:
+            arrays = [archive[name] for name in archive.files]
+    elif media_type == "application/x-tar":
+        arrays = _decode_tar(payload)
+    elif media_type == "application/zip":
+        arrays = _decode_zip(payload)
+    elif media_type == "multipart/form-data" and "boundary" in parameters:
+        arrays = _decode_multipart(payload, content_type)
+    else:
+        raise errors.GenericInferenceToolkitError(
+            HTTPStatus.UNSUPPORTED_MEDIA_TYPE, f"Content type {content_type} is not supported."
+        )
+    return _stack_arrays(arrays)
+
+
+@metrics.time("input_fn")
 def input_fn(request_body, request_content_type):
-    """An input_fn that loads a numpy array from the request body.
+    """An input_fn that decodes one or many images from the request body into a single batch.
+
+    Raw pixels (`application/x-mnist-uint8`, or `application/octet-stream` bodies of exactly 784
+    bytes that are not an encoded image) and `.npy` arrays are viewed in place with
+    `np.frombuffer`, so their only copy is the conversion to float32, if any. Only encoded images
+    go through PIL.
 
     Args:
-        request_body (io.BytesIO): Input data. This is data that has already been serialized by sagemaker.serializer.NumpySerializer()
+        request_body (bytes): Input data. Either raw 28x28 uint8 pixels, a single encoded image
+            (PNG, JPEG, ...), a `.npy`/`.npz` stack of 28x28 arrays, a tar or zip archive of
+            images, or a `multipart/form-data` body with one image per part.
         request_content_type (str): Request content type.
 
+    Returns:
+        torch.Tensor: A `(N, 1, 28, 28)` float tensor, with the images in request order.
+
+    Raises:
+        sagemaker_inference.errors.GenericInferenceToolkitError: With status 415 for an
+            unsupported content type, or 400 for a body that cannot be decoded.
     """
-    logging.info("Received content.")
     try:
-        image = Image.open(io.BytesIO(request_body))
-        grayscale_image = image.convert("L")
-        resized_image = grayscale_image.resize((28, 28))
-        array = np.array(resized_image, dtype=np.float32).reshape(1, 1, 28, 28)
-    except Exception as e:
-        logging.info(f"Error: {e}")
-    logging.info(f"Input: {array.shape}")
-    return torch.from_numpy(array).float()
+        array = _decode(request_body, request_content_type)
+    except errors.BaseInferenceToolkitError:
+        raise
+    except (ValueError, TypeError, OSError, EOFError, tarfile.TarError, zipfile.BadZipFile) as e:
+        raise errors.GenericInferenceToolkitError(
+            HTTPStatus.BAD_REQUEST, f"Could not decode the {request_content_type} body: {e}"
+        ) from e
+    metrics.debug(logger, "Input: %s %s", request_content_type, array.shape)
+    # float32 `.npy` bodies are served as read-only views of the request body, which predict_fn
+    # never writes to.
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", "The given NumPy array is not writable", UserWarning)
+        return torch.from_numpy(array)
+
+
+class Prediction(NamedTuple):
+    """The predictions of a batch, in request order.
+
+    Attributes:
+        labels (torch.Tensor): The `(N,)` most likely label of every image.
+        top_labels (torch.Tensor | None): The `(N, k)` k most likely labels of every image, best
+            first, when the request asked for a top-k.
+        top_scores (torch.Tensor | None): The `(N, k)` probabilities of `top_labels`.
+    """
+
+    labels: torch.Tensor
+    top_labels: torch.Tensor | None = None
+    top_scores: torch.Tensor | None = None
 
 
 def predict_fn(input_data, model, context):
-    """Preprocess input data and make predictions.
+    """Make predictions with the model prepared by `model_fn`.
+
+    The `top-k` custom attribute of the request, e.g. `top-k=3`, asks for the k most likely labels
+    of every image and their probabilities, on top of the best label.
 
     Args:
         input_data (torch.Tensor): Input data.
-        model (torch.nn.Module): PyTorch model.
+        model (ServingModel): The prepared model.
         context (sagemaker_inference.model_server.context.ModelServerContext): Model server context.
 
     Returns:
-        torch.Tensor: Predictions.
+        Prediction: The predictions of every input image, computed in a single forward pass.
     """
-    device = torch.device(
-        "cuda:" + str(context.system_properties.get("gpu_id"))
-        if torch.cuda.is_available()
-        else "cpu"
+    attributes = _request_attributes(context)
+    request_id.set(attributes.get("request-id") or "-")
+    top_k = _top_k(attributes)
+    with metrics.time("predict_fn.forward"):
+        log_probabilities = model(input_data)
+        if not top_k:
+            return Prediction(log_probabilities.argmax(1))
+        scores, labels = log_probabilities.topk(min(top_k, log_probabilities.shape[1]), dim=1)
+        return Prediction(labels[:, 0], labels, scores.exp())
+
+
+MSGPACK_CONTENT_TYPE = "application/x-msgpack"
+# The content types output_fn encodes, JSON first as the answer to wildcards.
+RESPONSE_CONTENT_TYPES = (content_types.JSON, content_types.NPY) + (
+    (MSGPACK_CONTENT_TYPE,) if msgpack is not None else ()
+)
+
+
+def _negotiate(accept):
+    """Pick the supported media type the Accept header prefers, by quality then by order."""
+    media_ranges = []
+    for index, media_range in enumerate((accept or "*/*").split(",")):
+        if not media_range.strip():
+            continue
+        media_type, parameters = _parse_content_type(media_range)
+        try:
+            quality = float(parameters.get("q", "1"))
+        except ValueError:
+            quality = 0.0
+        if quality > 0:
+            media_ranges.append((-quality, index, media_type))
+    for _, _, media_type in sorted(media_ranges):
+        if media_type in ("*/*", "application/*"):
+            return content_types.JSON
+        if media_type in RESPONSE_CONTENT_TYPES:
+            return media_type
+    raise errors.GenericInferenceToolkitError(
+        HTTPStatus.NOT_ACCEPTABLE,
+        f"Accept {accept} is not supported, use one of {', '.join(RESPONSE_CONTENT_TYPES)}.",
     )
-    model.to(device)
-    model.eval()
-    with torch.no_grad():
-        logging.info("Making predictions on input.")
-        return model(input_data.to(device)).argmax(1)
 
 
-def output_fn(prediction, content_type, context):
-    """An output_fn that dumps the prediction to a JSON format.
+def _encode_npy(arrays):
+    """Write the labels as a `.npy` array, or with a top-k as records of labels and scores."""
+    if "labels" in arrays:
+        labels, scores = arrays["labels"], arrays["scores"]
+        k = labels.shape[1]
+        array = np.empty(
+            len(labels), dtype=[("label", labels.dtype, (k,)), ("score", scores.dtype, (k,))]
+        )
+        array["label"], array["score"] = labels, scores
+    else:
+        array = arrays["prediction"]
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _encode_msgpack(arrays):
+    """Write the arrays as a msgpack map, each in the layout `msgpack_numpy` decodes."""
+    return msgpack.packb(
+        {
+            name: {
+                b"nd": True,
+                b"type": array.dtype.str,
+                b"kind": b"",
+                b"shape": list(array.shape),
+                b"data": np.ascontiguousarray(array).data.cast("B"),
+            }
+            for name, array in arrays.items()
+        },
+        use_bin_type=True,
+    )
+
+
+def output_fn(prediction, accept, context):
+    """An output_fn that encodes the predictions, in request order, in the format the client accepts.
+
+    JSON is meant for humans: `{"prediction": [...]}`, plus the `labels` and `scores` lists of the
+    k best labels of every image when the request asked for a top-k. Machines should accept
+    `application/x-npy`, or `application/x-msgpack` when msgpack is installed, which are written
+    from the tensors' buffers without going through Python lists. The `.npy` holds the `(N,)`
+    labels, or with a top-k `(N,)` records whose `label` and `score` fields have shape `(k,)`.
+    The msgpack map holds the `prediction`, `labels` and `scores` arrays.
 
     Args:
-        prediction (torch.Tensor): Predictions.
-        content_type (str): Response content type (this must be specified as a sagemaker.deserializers.JSONDeserializer() if the output is a dictionary.
+        prediction (Prediction): Predictions.
+        accept (str): The Accept header of the request, where a wildcard or nothing means JSON.
         context (sagemaker_inference.model_server.context.ModelServerContext): Model server context.
+
+    Returns:
+        tuple[bytes | str, str]: The response body and its content type.
+
+    Raises:
+        sagemaker_inference.errors.GenericInferenceToolkitError: With status 406 when none of the
+            accepted types is supported.
     """
-    output = {"prediction": prediction.detach().cpu().numpy().tolist()}
-    logging.info(f"Output: {output}")
-    try:
-        return encoder.encode(output, content_type)
-    except Exception as e:
-        logging.info(f"Error: {e}")
+    with metrics.time("output_fn"):
+        media_type = _negotiate(accept)
+        tensors = {"prediction": prediction.labels}
+        if prediction.top_labels is not None:
+            tensors.update(labels=prediction.top_labels, scores=prediction.top_scores)
+        arrays = {name: tensor.detach().cpu().numpy() for name, tensor in tensors.items()}
+        metrics.debug(logger, "Output: %s %s", media_type, arrays["prediction"])
+        if media_type == content_types.NPY:
+            body = _encode_npy(arrays)
+        elif media_type == MSGPACK_CONTENT_TYPE:
+            body = _encode_msgpack(arrays)
+        else:
+            body = encoder.encode(
+                {name: array.tolist() for name, array in arrays.items()}, media_type
+            )
+    metrics.flush_emf(METRICS_EMF_INTERVAL)
+    return body, media_type
@@ -0,0 +1,310 @@
+"""Training metrics logged off the step loop: accumulated on the device, written by a background thread.
+
+The training thread only adds each step's metric tensors to running sums on their device, which
+needs no synchronization with the device. Every `log_interval` steps, `snapshot` averages the sums
+and, when training is distributed, starts an asynchronous allreduce of them. That allreduce is
+only waited for at the next snapshot, by when it has long completed. Only rank 0 reports: its
+snapshots, and the records passed to `log`, are queued for a writer thread. That thread copies
+them to the host and hands them to the backends (W&B, the logger, or memory in tests) in batches.
+
+The queue is bounded, and a snapshot that finds it full is dropped rather than stalling training.
+The time spent in the training thread is measured and reported when the sink is closed.
+"""
+import collections
+import logging
+import queue
+import threading
+import time
+from typing import NamedTuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# Queue markers asking the writer thread to write its records now, and then to stop.
+_FLUSH = object()
+_STOP = object()
+
+
+class Table(NamedTuple):
+    """A table of rows, logged as a W&B table.
+
+    Attributes:
+        columns (list[str]): The column names.
+        rows (list[list]): The rows.
+    """
+
+    columns: list
+    rows: list
+
+
+class ImageTable(NamedTuple):
+    """Images and their predictions, logged as a W&B table of images.
+
+    Attributes:
+        images (torch.Tensor): The `(N, 1, H, W)` images, which may still be on the device.
+        predictions (torch.Tensor): The `(N,)` predicted labels.
+    """
+
+    images: torch.Tensor
+    predictions: torch.Tensor
+
+
+def _to_host(value):
+    """Copy the tensors of a logged value to the host, as Python numbers or NumPy arrays."""
+    if isinstance(value, torch.Tensor):
+        value = value.detach().cpu()
+        return value.item() if value.dim() == 0 else value.numpy()
+    if isinstance(value, ImageTable):
+        return ImageTable(_to_host(value.images), _to_host(value.predictions))
+    return value
+
+
+class LoggerBackend:
+    """Write every record as one line of the module logger."""
+
+    def __init__(self, log=logger):
+        """Write to `log`."""
+        self.log = log
+
+    def write(self, records):
+        """Write a batch of records."""
+        for record in records:
+            fields = []
+            for key, value in record.items():
+                if isinstance(value, float):
+                    fields.append(f"{key}: {value:.6f}")
+                elif isinstance(value, (Table, ImageTable)):
+                    fields.append(f"{key}: {len(value[1])} rows")
+                else:
+                    fields.append(f"{key}: {value}")
+            self.log.info(", ".join(fields))
+
+
+class WandbBackend:
+    """Log every record to the current W&B run, building its tables and images."""
+
+    def __init__(self):
+        """Use the run started by `wandb.init`."""
+        import wandb  # noqa: PLC0415
+
+        self.wandb = wandb
+
+    def write(self, records):
+        """Log a batch of records."""
+        for record in records:
+            self.wandb.log({key: self._convert(value) for key, value in record.items()})
+
+    def _convert(self, value):
+        if isinstance(value, Table):
+            return self.wandb.Table(data=value.rows, columns=value.columns)
+        if isinstance(value, ImageTable):
+            rows = [
+                [self.wandb.Image(image), prediction]
+                for image, prediction in zip(value.images, value.predictions.tolist(), strict=True)
+            ]
+            return self.wandb.Table(data=rows, columns=["images", "predictions"])
+        return value
+
+
+class MemoryBackend:
+    """Keep the records in memory, for tests and runs without a network.
+
+    Attributes:
+        records (list[dict]): Every record written, in order.
+        writes (int): The number of batches written.
+    """
+
+    def __init__(self):
+        """Start empty."""
+        self.records = []
+        self.writes = 0
+
+    def write(self, records):
+        """Keep a batch of records."""
+        self.records.extend(records)
+        self.writes += 1
+
+
+class MetricSink:
+    """Accumulate metrics on the device, and report them from rank 0 on a background thread.
+
+    Attributes:
+        backends (list): Objects whose `write(records)` method receives every batch of records.
+        rank (int): The rank of this process, of which only rank 0 reports.
+        dropped (int): The records dropped because the queue was full.
+        steps (int): The steps added so far.
+        overhead (float): The seconds spent in `add`, `snapshot` and `log`, in the training thread.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        backends,
+        *,
+        rank=0,
+        allreduce_async=None,
+        synchronize=None,
+        batch_size=16,
+        flush_interval=10.0,
+        max_pending=64,
+    ):
+        """Start the writer thread.
+
+        Args:
+            backends (list): The backends written to.
+            rank (int): The rank of this process.
+            allreduce_async (Callable[[torch.Tensor, str], Any]): Starts the average of a tensor
+                over every rank and returns a handle, e.g. `hvd.allreduce_async` with
+                `op=hvd.Average`. None when training on a single process.
+            synchronize (Callable[[Any], torch.Tensor]): Waits for a handle of `allreduce_async`
+                and returns the averaged tensor, e.g. `hvd.synchronize`.
+            batch_size (int): Records written to the backends at once.
+            flush_interval (float): Seconds after which fewer records are written anyway.
+            max_pending (int): Records queued for the writer thread, beyond which they are dropped.
+        """
+        self.backends = backends
+        self.rank = rank
+        self.dropped = 0
+        self.steps = 0
+        self.overhead = 0.0
+        self._allreduce_async = allreduce_async
+        self._synchronize = synchronize
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._sums = {}
+        self._count = 0
+        self._snapshots = 0
+        self._reducing = collections.deque()
+        self._queue = queue.Queue(max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="metric-sink", daemon=True)
+        self._thread.start()
+
+    def add(self, **metrics):
+        """Add one step's metric tensors, e.g. its loss, to the running sums on their device."""
+        start = time.perf_counter()
+        for name, value in metrics.items():
+            tensor = value.detach()
+            self._sums[name] = self._sums[name] + tensor if name in self._sums else tensor.clone()
+        self._count += 1
+        self.steps += 1
+        self.overhead += time.perf_counter() - start
+
+    def snapshot(self, **fields):
+        """Report the averages of the metrics added since the last snapshot, tagged with `fields`.
+
+        Must be called at the same steps on every rank, when training is distributed.
+        """
+        start = time.perf_counter()
+        if self._count:
+            names = sorted(self._sums)
+            averages = torch.stack([self._sums[name] for name in names]) / self._count
+            self._sums, self._count = {}, 0
+            if self._allreduce_async is not None:
+                self._snapshots += 1
+                handle = self._allreduce_async(averages, name=f"metric_sink.{self._snapshots}")
+                self._reducing.append((handle, names, fields))
+                # Wait for the previous allreduce only, which completed during the last interval.
+                while len(self._reducing) > 1:
+                    self._finish_reduction()
+            else:
+                self._enqueue((names, averages, fields))
+        self.overhead += time.perf_counter() - start
+
+    def log(self, record):
+        """Report a record from rank 0 as is, with tensors copied to the host by the writer thread."""
+        start = time.perf_counter()
+        self._enqueue((None, record, None))
+        self.overhead += time.perf_counter() - start
+
+    def reset(self, rank):
+        """Drop the metrics added or being averaged, when the workers of an elastic job changed.
+
+        The allreduces started before the change never complete, and the metrics added since the
+        last commit are those of batches trained on again. The allreduces are named by a count of
+        snapshots, which restarts so that they match those of the workers that just joined.
+
+        Args:
+            rank (int): The new rank of this process.
+        """
+        self._reducing.clear()
+        self._sums, self._count, self._snapshots = {}, 0, 0
+        self.rank = rank
+
+    def flush(self):
+        """Report everything snapshot or logged so far, and wait until the backends wrote it."""
+        while self._reducing:
+            self._finish_reduction()
+        self._put(_FLUSH, block=True)
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Flush, stop the writer thread and log the overhead of the sink on the training thread."""
+        self.flush()
+        self._put(_STOP, block=True)
+        self._thread.join()
+        if self.steps:
+            logger.info(
+                f"Metric sink: {1e6 * self.overhead / self.steps:.1f} us per step "
+                f"on the training thread, {self.dropped} records dropped"
+            )
+
+    def _finish_reduction(self):
+        handle, names, fields = self._reducing.popleft()
+        self._enqueue((names, self._synchronize(handle), fields))
+
+    def _enqueue(self, item):
+        if self.rank != 0:
+            return
+        self._raise_error()
+        if not self._put(item, block=False):
+            self.dropped += 1
+
+    def _put(self, item, block):
+        try:
+            self._queue.put(item, block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing the metrics failed.") from error
+
+    @staticmethod
+    def _record(item):
+        """Build a record from a queued item, copying its tensors to the host."""
+        names, values, fields = item
+        if names is None:
+            return {key: _to_host(value) for key, value in values.items()}
+        return {**fields, **dict(zip(names, values.tolist(), strict=True))}
+
+    def _run(self):
+        """Write the queued records in batches, until told to stop."""
+        records, deadline = [], None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item, queued = self._queue.get(timeout=timeout), True
+            except queue.Empty:  # The oldest record has waited for flush_interval seconds.
+                item, queued = _FLUSH, False
+            try:
+                if item is not _FLUSH and item is not _STOP:
+                    records.append(self._record(item))
+                    deadline = deadline or time.monotonic() + self._flush_interval
+                if records and (
+                    item is _FLUSH or item is _STOP or len(records) >= self._batch_size
+                ):
+                    for backend in self.backends:
+                        backend.write(records)
+                    records, deadline = [], None
+            except Exception as e:
+                logger.exception("Writing the metrics failed")
+                self._error, records, deadline = e, [], None
+            finally:
+                if queued:
+                    self._queue.task_done()
+            if item is _STOP:
+                return
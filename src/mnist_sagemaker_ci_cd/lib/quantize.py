@@ -0,0 +1,132 @@
+"""Post-training int8 quantization of the trained model, gated on test-set accuracy.
+
+The convolutions are statically quantized, with activation ranges calibrated on a slice of the
+MNIST training set, and `fc1`/`fc2` are dynamically quantized. The quantized model is compared to
+the fp32 model on the test set and only published next to `model.pth` if it loses at most
+`max_accuracy_drop` percentage points of accuracy.
+"""
+import copy
+import json
+import logging
+import os
+import statistics
+import time
+
+import torch
+from torch.ao.quantization import QConfigMapping, default_dynamic_qconfig, get_default_qconfig
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+from torchvision import datasets, transforms
+
+try:
+    from mnist_sagemaker_ci_cd.lib.export import QUANTIZED_FILE, TORCHSCRIPT_FILE
+except ImportError:  # SageMaker runs the training script from inside lib/.
+    from export import QUANTIZED_FILE, TORCHSCRIPT_FILE
+
+logger = logging.getLogger(__name__)
+
+REPORT_FILE = "quantization.json"
+
+# The endpoint feeds the model raw 0-255 grayscale pixels (see `inference.input_fn`), so the
+# calibration and the accuracy gate use the same preprocessing.
+SERVING_TRANSFORM = transforms.Compose(
+    [transforms.PILToTensor(), transforms.Lambda(torch.Tensor.float)]
+)
+
+
+def _serving_loader(data_dir, train, batch_size, samples=None):
+    """Load MNIST with the serving preprocessing, optionally keeping only the first `samples`."""
+    dataset = datasets.MNIST(data_dir, train=train, transform=SERVING_TRANSFORM)
+    if samples is not None:
+        dataset = torch.utils.data.Subset(dataset, range(min(samples, len(dataset))))
+    return torch.utils.data.DataLoader(dataset, batch_size=batch_size)
+
+
+def quantize_model(model, calibration_loader):
+    """Statically quantize the convolutions and dynamically quantize the linear layers."""
+    engine = torch.backends.quantized.engine
+    qconfig_mapping = (
+        QConfigMapping()
+        .set_module_name("conv1", get_default_qconfig(engine))
+        .set_module_name("conv2", get_default_qconfig(engine))
+        .set_module_name("fc1", default_dynamic_qconfig)
+        .set_module_name("fc2", default_dynamic_qconfig)
+    )
+    example, _ = next(iter(calibration_loader))
+    prepared = prepare_fx(copy.deepcopy(model).cpu().eval(), qconfig_mapping, (example,))
+    with torch.no_grad():
+        for data, _ in calibration_loader:
+            prepared(data)
+    return torch.jit.script(convert_fx(prepared))
+
+
+def accuracy(model, loader):
+    """The percentage of correctly classified examples."""
+    correct = 0
+    with torch.no_grad():
+        for data, target in loader:
+            correct += model(data).argmax(1).eq(target).sum().item()
+    return 100.0 * correct / len(loader.dataset)
+
+
+def latency_ms(model, batch_size, runs=50):
+    """The median latency of a forward pass over a batch, in milliseconds."""
+    batch = torch.zeros(batch_size, 1, 28, 28)
+    timings = []
+    with torch.no_grad():
+        for _ in range(5):
+            model(batch)
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(batch)
+            timings.append(1000 * (time.perf_counter() - start))
+    return statistics.median(timings)
+
+
+def quantize_and_publish(  # noqa: PLR0913
+    model, model_dir, data_dir, *, calibration_samples=2048, max_accuracy_drop=0.5, batch_size=1000
+):
+    """Quantize the model, compare it to the fp32 model and publish it if it passes the gate.
+
+    Args:
+        model (torch.nn.Module): The trained fp32 model.
+        model_dir (str): The directory holding `model.pth` and its compiled exports.
+        data_dir (str): The directory holding the MNIST dataset.
+        calibration_samples (int): The number of training images used to calibrate activations.
+        max_accuracy_drop (float): The largest tolerated loss of test accuracy, in percentage points.
+        batch_size (int): The batch size used for calibration and evaluation.
+
+    Returns:
+        dict: The size, latency and accuracy of both models, and whether the int8 model was published.
+    """
+    model = model.cpu().eval()
+    calibration_loader = _serving_loader(data_dir, True, batch_size, calibration_samples)
+    test_loader = _serving_loader(data_dir, False, batch_size)
+    quantized = quantize_model(model, calibration_loader)
+
+    path = os.path.join(model_dir, QUANTIZED_FILE)
+    quantized.save(path)
+    fp32_path = os.path.join(model_dir, TORCHSCRIPT_FILE)
+    report = {
+        "fp32": {"size_bytes": os.path.getsize(fp32_path) if os.path.exists(fp32_path) else None},
+        "int8": {"size_bytes": os.path.getsize(path)},
+    }
+    for name, candidate in (("fp32", model), ("int8", quantized)):
+        report[name].update(
+            accuracy=accuracy(candidate, test_loader),
+            latency_ms_batch_1=latency_ms(candidate, 1),
+            latency_ms_batch_256=latency_ms(candidate, 256),
+        )
+    report["accuracy_drop"] = report["fp32"]["accuracy"] - report["int8"]["accuracy"]
+    report["max_accuracy_drop"] = max_accuracy_drop
+    report["published"] = report["accuracy_drop"] <= max_accuracy_drop
+
+    if report["published"]:
+        logger.info(f"Publishing the int8 model: {json.dumps(report)}")
+    else:
+        os.remove(path)
+        logger.warning(
+            f"Not publishing the int8 model, it loses too much accuracy: {json.dumps(report)}"
+        )
+    with open(os.path.join(model_dir, REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=4)
+    return report
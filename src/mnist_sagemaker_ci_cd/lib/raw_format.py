@@ -0,0 +1,13 @@
+"""The raw image format that the API's edge preprocessing sends and `inference.input_fn` decodes.
+
+Raw images are 28x28 uint8 pixels in row-major order, one image after the other, with no header.
+This module only holds constants, so that the Lambda bundle can ship it without the package.
+"""
+RAW_CONTENT_TYPE = "application/x-mnist-uint8"
+IMAGE_SIZE = (28, 28)
+RAW_IMAGE_BYTES = IMAGE_SIZE[0] * IMAGE_SIZE[1]
+# The suffix of the tar members that hold raw images, which are decoded without sniffing them.
+RAW_SUFFIX = ".raw"
+# The leading bytes of the formats decoded with PIL, which tell an encoded image from raw pixels
+# when the format is not given.
+IMAGE_SIGNATURES = (b"\x89PNG", b"\xff\xd8", b"BM", b"GIF8")
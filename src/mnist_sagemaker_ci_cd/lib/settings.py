@@ -1,5 +1,6 @@
 """This module contains the settings for the SageMaker Script."""
 import os
+from typing import Literal
 
 from pydantic import BaseSettings
 
@@ -13,6 +14,16 @@ class Settings(BaseSettings):
                 github_repository (str): The URL of the GitHub repository.
                 github_actor (str): The username of the GitHub actor (user or bot) triggering the pipeline.
                 output_s3_uri (str): The S3 URI for the output of the pipeline.
+                checkpoint_s3_uri (str): The S3 URI SageMaker syncs the training checkpoints with, so that
+                    a restarted job resumes from them.
+                use_spot_instances (bool): Whether to train on managed spot instances.
+                max_run (int): The maximum training time of a job, in seconds.
+                max_wait (int): The maximum time a spot job may take, waiting for capacity included, in
+                    seconds. It must be at least `max_run`.
+                inference_backend (str): Where the REST API runs the model: "sagemaker" forwards to the
+                    deployed endpoint, "local" loads the model in the API process.
+                model_dir (str): The directory holding `model.pth` for the local inference backend.
+                inference_workers (int): The number of worker threads of the local inference backend.
 
     Methods:
     check_s3_uri(cls, v): A validator method that checks if the provided URI is a valid S3 URI.
@@ -39,11 +50,20 @@ class Settings(BaseSettings):
         "SAGEMAKER_IAM_ROLE",
         "arn:aws:iam::220582896887:role/service-role/AmazonSageMaker-ExecutionRole-20221102T214473",
     )
+    checkpoint_s3_uri: str = f"s3://with-context-sagemaker/checkpoints/{github_repo_name}/{github_ref_name}/{short_sha}/"
+    use_spot_instances: bool = False
+    max_run: int = 24 * 60 * 60
+    max_wait: int = 48 * 60 * 60
     cloudwatch_logs: str = rf"https://us-east-1.console.aws.amazon.com/cloudwatch/home?region=us-east-1#logsV2:log-groups/log-group/\$252Faws\$252Fsagemaker\$252FTrainingJobs\$3FlogStreamNameFilter\$3D{short_sha}"
 
     # W&B Environment Variables
     wandb_api_key: str = os.environ.get("WANDB_API_KEY", "")
 
+    # Serving Environment Variables
+    inference_backend: Literal["sagemaker", "local"] = "sagemaker"
+    model_dir: str = os.environ.get("SM_MODEL_DIR", "/opt/ml/model")
+    inference_workers: int = os.cpu_count() or 1
+
 
 if __name__ == "__main__":
     settings = Settings()
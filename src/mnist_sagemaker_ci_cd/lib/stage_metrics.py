@@ -0,0 +1,170 @@
+"""Per-stage latency histograms of the serving path, exported as Prometheus text or CloudWatch EMF.
+
+Only the standard library is used, so that the same module serves the SageMaker endpoint, which
+loads it next to `inference.py`, the app container and the Lambda bundle, which the deploy workflow
+copies it into. Recording a latency costs a
+`perf_counter` call, a bisect and a lock, a few microseconds at most.
+"""
+from __future__ import annotations
+
+import bisect
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import re
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from typing import Any
+
+# Upper bounds of the histogram buckets, in milliseconds.
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+REQUEST_ID_HEADER = "X-Request-ID"
+# Request IDs are forwarded in the comma-separated `CustomAttributes` of SageMaker invocations, so
+# callers' IDs are only accepted when they cannot smuggle in an attribute of their own.
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+
+def new_request_id() -> str:
+    """Return a random request ID."""
+    return uuid.uuid4().hex
+
+
+def valid_request_id(value: str | None) -> str:
+    """Return a caller's request ID if it matches `REQUEST_ID_PATTERN`, or a new one otherwise."""
+    if value and REQUEST_ID_PATTERN.fullmatch(value):
+        return value
+    return new_request_id()
+
+
+class Histogram:
+    """Counts of observed latencies, bucketed by `BUCKETS_MS`, with their sum and maximum."""
+
+    def __init__(self) -> None:
+        """Initialize an empty histogram."""
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Record one latency, in milliseconds."""
+        self.counts[bisect.bisect_left(BUCKETS_MS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class StageMetrics:
+    """Latency histograms of every serving stage, shared by all the threads of a process.
+
+    Prometheus histograms are cumulative since the process started. EMF documents are deltas: every
+    flush reports the latencies observed since the previous one.
+
+    Attributes:
+        namespace (str): Prefixes the Prometheus metric and names the CloudWatch namespace.
+        debug_sample_rate (float): The fraction of requests whose debug logs are emitted.
+    """
+
+    def __init__(self, namespace: str, debug_sample_rate: float = 0.01):
+        """Initialize the metrics."""
+        self.namespace = namespace
+        self.debug_sample_rate = debug_sample_rate
+        self._lock = threading.Lock()
+        self._totals: dict[str, Histogram] = {}
+        self._deltas: dict[str, Histogram] = {}
+        self._last_flush = time.monotonic()
+
+    def observe(self, stage: str, value: float) -> None:
+        """Record the latency of one stage, in milliseconds."""
+        with self._lock:
+            for histograms in (self._totals, self._deltas):
+                if stage not in histograms:
+                    histograms[stage] = Histogram()
+                histograms[stage].observe(value)
+
+    @contextlib.contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Record how long the body of the `with` block takes as the latency of `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, 1000 * (time.perf_counter() - start))
+
+    def sampled(self) -> bool:
+        """Whether this request's debug logs should be emitted."""
+        return random.random() < self.debug_sample_rate
+
+    def debug(self, logger: logging.Logger, message: str, *args: Any) -> None:
+        """Log a debug message, tagged with the request ID, for a sample of the requests."""
+        if logger.isEnabledFor(logging.DEBUG) and self.sampled():
+            logger.debug(f"[%s] {message}", request_id.get(), *args)
+
+    def prometheus(self) -> str:
+        """Render the cumulative histograms in the Prometheus text exposition format."""
+        name = f"{self.namespace}_stage_latency_ms"
+        lines = [
+            f"# HELP {name} Latency of each serving stage, in milliseconds.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._totals.items()):
+                cumulative = 0
+                # Both sequences have one entry per bucket. Python 3.9, the Lambda runtime, has no
+                # `strict=True`.
+                for bound, count in zip((*BUCKETS_MS, "+Inf"), histogram.counts):  # noqa: B905
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def emf(self) -> list[str]:
+        """Return one CloudWatch Embedded Metric Format document per stage and reset the deltas.
+
+        Each latency is reported at the upper bound of its bucket (the maximum for the last one), as
+        the `Values` and `Counts` arrays that EMF accepts for pre-aggregated distributions.
+        """
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        timestamp = int(time.time() * 1000)
+        documents = []
+        for stage, histogram in sorted(deltas.items()):
+            values, counts = [], []
+            for bound, count in zip((*BUCKETS_MS, histogram.max), histogram.counts):  # noqa: B905
+                if count:
+                    values.append(min(bound, histogram.max))
+                    counts.append(count)
+            document = {
+                "_aws": {
+                    "Timestamp": timestamp,
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": self.namespace,
+                            "Dimensions": [["Stage"]],
+                            "Metrics": [{"Name": "Latency", "Unit": "Milliseconds"}],
+                        }
+                    ],
+                },
+                "Stage": stage,
+                "Latency": {"Values": values, "Counts": counts},
+            }
+            documents.append(json.dumps(document, separators=(",", ":")))
+        return documents
+
+    def flush_emf(self, interval: float) -> None:
+        """Print the EMF documents to stdout at most once every `interval` seconds.
+
+        CloudWatch Logs turns the printed documents into metrics. An interval of 0 disables EMF.
+        """
+        if interval <= 0 or time.monotonic() - self._last_flush < interval:
+            return
+        self._last_flush = time.monotonic()
+        for document in self.emf():
+            print(document, flush=True)
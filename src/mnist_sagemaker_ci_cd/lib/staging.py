@@ -0,0 +1,97 @@
+"""Staging of the DVC-tracked dataset into the training input directory, cached by content hash.
+
+`dvc pull` downloads the whole `data.dvc` directory. Here, it only runs when the directory's md5,
+read from the `.dvc` file, is missing from a local cache. The pulled files are then moved into
+`<cache_dir>/<md5>/` and hardlinked into the input directory, so neither staging them nor
+re-staging them on a later job copies any data. The default cache directory is the one that
+SageMaker warm pools keep between jobs.
+
+A file lock serializes the processes that stage the same md5, but staging is meant to run once per
+node, from local rank 0, with the other ranks waiting on a barrier.
+"""
+import fcntl
+import logging
+import os
+import shutil
+import subprocess
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get("DATA_CACHE_DIR", "/opt/ml/sagemaker/warmpoolcache/dvc")
+
+
+def dvc_dir_md5(dvc_file):
+    """Read the md5 and workspace path of the directory tracked by a `.dvc` file.
+
+    Returns:
+        tuple[str, str]: The md5 of the directory, without the `.dir` suffix, and its path relative
+            to the `.dvc` file.
+    """
+    with open(dvc_file) as f:
+        (out,) = yaml.safe_load(f)["outs"]
+    return out["md5"].removesuffix(".dir"), out["path"]
+
+
+def _pull(dvc_file, entry):
+    """Pull the tracked directory with DVC and move it into the cache entry `entry`."""
+    repo_dir = os.path.dirname(os.path.abspath(dvc_file))
+    _, path = dvc_dir_md5(dvc_file)
+    logger.info(f"Pulling {dvc_file} with DVC")
+    subprocess.run(["dvc", "pull", os.path.basename(dvc_file)], cwd=repo_dir, check=True)
+    partial = f"{entry}.{os.getpid()}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    # A rename when the workspace and the cache share a filesystem, a copy otherwise.
+    shutil.move(os.path.join(repo_dir, path), partial)
+    for root, _, files in os.walk(partial):
+        for name in files:
+            # The files are shared by every hardlink staged from them.
+            os.chmod(os.path.join(root, name), 0o444)
+    os.replace(partial, entry)
+
+
+def _link(source, destination):
+    """Hardlink `source` to `destination`, or copy it across filesystems, replacing atomically."""
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return
+    partial = f"{destination}.{os.getpid()}.partial"
+    try:
+        os.link(source, partial)
+    except OSError:
+        shutil.copy2(source, partial)
+    os.replace(partial, destination)
+
+
+def stage_data(data_dir, dvc_file="data.dvc", cache_dir=CACHE_DIR):
+    """Make the files of the directory tracked by `dvc_file` available under `data_dir`.
+
+    Args:
+        data_dir (str): The directory the tracked files are staged into, e.g. `MNIST/raw/...`
+            of the tracked directory becomes `<data_dir>/MNIST/raw/...`.
+        dvc_file (str): The `.dvc` file of the tracked directory, in a DVC repository whose default
+            remote holds it.
+        cache_dir (str): The directory holding one entry per pulled md5.
+
+    Returns:
+        bool: Whether the cache was warm, so nothing was pulled.
+    """
+    md5, _ = dvc_dir_md5(dvc_file)
+    entry = os.path.join(cache_dir, md5)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(f"{entry}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        warm = os.path.isdir(entry)
+        if warm:
+            logger.info(f"Data cache hit for {md5}, skipping the pull")
+        else:
+            _pull(dvc_file, entry)
+        staged = 0
+        for root, _, files in os.walk(entry):
+            target_dir = os.path.join(data_dir, os.path.relpath(root, entry))
+            os.makedirs(target_dir, exist_ok=True)
+            for name in files:
+                _link(os.path.join(root, name), os.path.join(target_dir, name))
+                staged += 1
+    logger.info(f"Staged {staged} files of {md5} into {data_dir}")
+    return warm
@@ -0,0 +1,136 @@
+"""Preloaded MNIST tensors, memory-mapped from an on-disk cache and served in whole batches.
+
+The torchvision `MNIST` dataset decodes, converts and normalizes every image in Python, one sample
+at a time. Here, the IDX files are instead converted once into normalized float32 arrays saved as
+`.npy` files next to them. Training memory-maps those arrays, shards them by rank and yields every
+batch with a single indexing operation.
+"""
+import logging
+import math
+import os
+
+import numpy as np
+import torch
+from torchvision import datasets
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = "tensors"
+MEAN, STD = 0.1307, 0.3081
+
+
+def _cache_paths(data_dir, train):
+    """The paths of the cached images and labels of one split."""
+    split = "train" if train else "test"
+    cache_dir = os.path.join(data_dir, "MNIST", CACHE_DIR)
+    return (
+        os.path.join(cache_dir, f"{split}-images.npy"),
+        os.path.join(cache_dir, f"{split}-labels.npy"),
+    )
+
+
+def _save_atomic(path, array):
+    """Save an array so that concurrent readers never see a partially written file."""
+    partial = f"{path}.{os.getpid()}.partial"
+    with open(partial, "wb") as f:
+        np.save(f, array)
+    os.replace(partial, path)
+
+
+def build_cache(data_dir, train):
+    """Convert one MNIST split into normalized `(N, 1, 28, 28)` float32 images and int64 labels.
+
+    Args:
+        data_dir (str): The directory holding the torchvision `MNIST/raw` IDX files.
+        train (bool): Whether to convert the training split, or the test split.
+
+    Returns:
+        tuple[str, str]: The paths of the cached images and labels.
+    """
+    images_path, labels_path = _cache_paths(data_dir, train)
+    if os.path.exists(images_path) and os.path.exists(labels_path):
+        return images_path, labels_path
+    logger.info(f"Building the tensor cache of {images_path}")
+    os.makedirs(os.path.dirname(images_path), exist_ok=True)
+    # Same arithmetic as `ToTensor` followed by `Normalize`, so both loaders see identical inputs.
+    mnist = datasets.MNIST(data_dir, train=train)
+    images = mnist.data.unsqueeze(1).float().div(255).sub(MEAN).div(STD)
+    _save_atomic(images_path, images.numpy())
+    _save_atomic(labels_path, mnist.targets.numpy())
+    return images_path, labels_path
+
+
+class MemmapMNIST:
+    """One MNIST split, memory-mapped from the tensor cache.
+
+    Attributes:
+        images (numpy.memmap): The normalized `(N, 1, 28, 28)` float32 images.
+        labels (numpy.memmap): The int64 labels.
+    """
+
+    def __init__(self, data_dir, train=True):
+        """Build the tensor cache if needed and memory-map it."""
+        images_path, labels_path = build_cache(data_dir, train)
+        self.images = np.load(images_path, mmap_mode="r")
+        self.labels = np.load(labels_path, mmap_mode="r")
+
+    def __len__(self):
+        """The number of examples."""
+        return len(self.labels)
+
+    def batch(self, indices):
+        """Gather the examples at `indices` as an `(images, labels)` pair of tensors."""
+        return torch.from_numpy(self.images[indices]), torch.from_numpy(self.labels[indices])
+
+
+class BatchLoader:
+    """Yield whole batches from a `MemmapMNIST` shard, in place of a `DataLoader`.
+
+    Sharding and shuffling are done by a `DistributedSampler`, exactly as for the torchvision
+    loaders, so `sampler`, `dataset` and `len()` mean the same thing and the batches are the same.
+
+    Attributes:
+        dataset (MemmapMNIST): The split being served.
+        sampler (torch.utils.data.distributed.DistributedSampler): This rank's shard.
+        batch_size (int): The number of examples per batch.
+        pin_memory (bool): Whether to return batches in page-locked memory, which is only done
+            when CUDA is available, like `DataLoader`.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        dataset,
+        batch_size,
+        num_replicas=1,
+        rank=0,
+        pin_memory=False,
+        *,
+        sampler=None,
+        **kwargs,
+    ):
+        """Initialize the loader, passing `kwargs` such as `shuffle` to the sampler.
+
+        A `sampler` of the dataset, e.g. an `ElasticDistributedSampler`, replaces the
+        `DistributedSampler` of `num_replicas` and `rank`.
+        """
+        self.dataset = dataset
+        if sampler is None:
+            sampler = torch.utils.data.distributed.DistributedSampler(
+                dataset, num_replicas=num_replicas, rank=rank, **kwargs
+            )
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+    def __len__(self):
+        """The number of batches."""
+        return math.ceil(len(self.sampler) / self.batch_size)
+
+    def __iter__(self):
+        """Yield `(images, labels)` batches of this rank's shard."""
+        indices = np.fromiter(self.sampler, dtype=np.int64, count=len(self.sampler))
+        for start in range(0, len(indices), self.batch_size):
+            data, target = self.dataset.batch(indices[start : start + self.batch_size])
+            if self.pin_memory:
+                data, target = data.pin_memory(), target.pin_memory()
+            yield data, target
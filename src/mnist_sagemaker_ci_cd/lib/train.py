@@ -1,83 +1,111 @@
 """This module contains the training logic for MNIST."""
 import argparse
+import functools
+import itertools
 import json
 import logging
 import os
-import subprocess
 import sys
 
 import horovod.torch as hvd
-import numpy as np
 import torch.nn.functional as F
 import torch.utils.data.distributed
 import wandb
-from torch import nn, optim
+from torch import optim
 from torchvision import datasets, transforms
 
+try:
+    from mnist_sagemaker_ci_cd.lib.augment import BatchAugment
+    from mnist_sagemaker_ci_cd.lib.checkpoint import (
+        CHECKPOINT_DIR,
+        AsyncCheckpointer,
+        append_metrics,
+        load_latest,
+        set_rng_state,
+    )
+    from mnist_sagemaker_ci_cd.lib.compression import fusion_environment
+    from mnist_sagemaker_ci_cd.lib.elastic import ElasticDistributedSampler
+    from mnist_sagemaker_ci_cd.lib.evaluation import evaluate, unpack_totals
+    from mnist_sagemaker_ci_cd.lib.export import export_compiled
+    from mnist_sagemaker_ci_cd.lib.metric_sink import (
+        ImageTable,
+        LoggerBackend,
+        MetricSink,
+        Table,
+        WandbBackend,
+    )
+    from mnist_sagemaker_ci_cd.lib.net import Net
+    from mnist_sagemaker_ci_cd.lib.quantize import quantize_and_publish
+    from mnist_sagemaker_ci_cd.lib.staging import CACHE_DIR, stage_data
+    from mnist_sagemaker_ci_cd.lib.tensor_data import BatchLoader, MemmapMNIST, build_cache
+except ImportError:  # SageMaker runs this file as a script from inside lib/.
+    from augment import BatchAugment
+    from checkpoint import (
+        CHECKPOINT_DIR,
+        AsyncCheckpointer,
+        append_metrics,
+        load_latest,
+        set_rng_state,
+    )
+    from compression import fusion_environment
+    from elastic import ElasticDistributedSampler
+    from evaluation import evaluate, unpack_totals
+    from export import export_compiled
+    from metric_sink import ImageTable, LoggerBackend, MetricSink, Table, WandbBackend
+    from net import Net
+    from quantize import quantize_and_publish
+    from staging import CACHE_DIR, stage_data
+    from tensor_data import BatchLoader, MemmapMNIST, build_cache
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 logger.addHandler(logging.StreamHandler(sys.stdout))
 
+# The gradient compressions of `hvd.DistributedOptimizer`: fp16 casts each floating point gradient
+# to half precision for its allreduce, halving the bytes sent. Horovod has no bfloat16 to reduce.
+COMPRESSORS = {"none": hvd.Compression.none, "fp16": hvd.Compression.fp16}
 
-def retrieve_data():
-    """Retrieve data from Data Version Control.
 
-    This function retrieves the data from DVC and moves it to the input directory.
-    It is advisable not to keep this unless you are not using DVC.
+def retrieve_data(data_dir, cache_dir):
+    """Stage the DVC-tracked data into the input directory, pulling it only on a cache miss.
 
-    This function moves the contents of the data/ folder using the *.* wildcard to move all subfolders and files.
+    Runs on local rank 0 of every node, while the other ranks wait for it on a barrier.
     """
-    # Data Version Control
-    commands = [
-        "dvc pull",
-        "cp -rv data/* /opt/ml/input/data/",
-        "rm -rf data",
-        "ls -hR /opt/ml/input/data/",
-    ]
-
-    for cmd in commands:
-        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
-
-        # Check if the command was executed successfully
-        if process.returncode != 0:
-            print(f"Error executing '{cmd}': {stderr.decode()}")
-        else:
-            print(f"Output of '{cmd}': {stdout.decode()}")
-
-
-class Net(nn.Module):
-    """Neural network model for image classification."""
-
-    def __init__(self):
-        """Initialize the neural network model."""
-        super(Net, self).__init__()  # noqa: UP008
-        self.conv1 = nn.Conv2d(1, 10, kernel_size=5)
-        self.conv2 = nn.Conv2d(10, 20, kernel_size=5)
-        self.conv2_drop = nn.Dropout2d()
-        self.fc1 = nn.Linear(320, 50)
-        self.fc2 = nn.Linear(50, 10)
-
-    def forward(self, x):
-        """Forward pass of the neural network.
-
-        Args:
-            x (torch.Tensor): Input tensor.
-
-        Returns:
-            torch.Tensor: Output tensor after passing through the network.
-        """
-        x = F.relu(F.max_pool2d(self.conv1(x), 2))
-        x = F.relu(F.max_pool2d(self.conv2_drop(self.conv2(x)), 2))
-        x = x.view(-1, 320)
-        x = F.relu(self.fc1(x))
-        x = F.dropout(x, training=self.training)
-        x = self.fc2(x)
-        return F.log_softmax(x, dim=1)
-
-
-def _get_train_data_loader(batch_size, training_dir, **kwargs):
+    warm = stage_data(data_dir, "data.dvc", cache_dir)
+    logger.info(f"Data {'found in' if warm else 'pulled into'} the cache at {cache_dir}")
+
+
+def _prepare_data(args):
+    """Stage the data if `args.stage_data`, and build the tensor cache of the `tensor` data loader."""
+    if args.stage_data:
+        logger.info(f"\nStaging Data from DVC into {args.data_dir}.\n")
+        retrieve_data(args.data_dir, args.data_cache_dir)
+    if args.data_loader == "tensor":
+        build_cache(args.data_dir, train=True)
+        build_cache(args.data_dir, train=False)
+
+
+def _sampler(dataset, elastic):
+    """This rank's shard of a dataset, which an elastic job reshards when workers come and go."""
+    if elastic:
+        return ElasticDistributedSampler(dataset, num_replicas=hvd.size(), rank=hvd.rank())
+    return torch.utils.data.distributed.DistributedSampler(
+        dataset, num_replicas=hvd.size(), rank=hvd.rank()
+    )
+
+
+def _get_train_data_loader(
+    batch_size, training_dir, data_loader="torchvision", elastic=False, **kwargs
+):
     logger.info("Get train data sampler and data loader")
+    if data_loader == "tensor":
+        dataset = MemmapMNIST(training_dir, train=True)
+        return BatchLoader(
+            dataset,
+            batch_size,
+            pin_memory=kwargs.get("pin_memory", False),
+            sampler=_sampler(dataset, elastic),
+        )
     dataset = datasets.MNIST(
         training_dir,
         train=True,
@@ -85,17 +113,25 @@ def _get_train_data_loader(batch_size, training_dir, **kwargs):
             [transforms.ToTensor(), transforms.Normalize((0.1307,), (0.3081,))]
         ),
     )
-    train_sampler = torch.utils.data.distributed.DistributedSampler(
-        dataset, num_replicas=hvd.size(), rank=hvd.rank()
-    )
+    train_sampler = _sampler(dataset, elastic)
     train_loader = torch.utils.data.DataLoader(
         dataset, batch_size=batch_size, sampler=train_sampler, **kwargs
     )
     return train_loader
 
 
-def _get_test_data_loader(test_batch_size, training_dir, **kwargs):
+def _get_test_data_loader(
+    test_batch_size, training_dir, data_loader="torchvision", elastic=False, **kwargs
+):
     logger.info("Get test data sampler and data loader")
+    if data_loader == "tensor":
+        dataset = MemmapMNIST(training_dir, train=False)
+        return BatchLoader(
+            dataset,
+            test_batch_size,
+            pin_memory=kwargs.get("pin_memory", False),
+            sampler=_sampler(dataset, elastic),
+        )
     dataset = datasets.MNIST(
         training_dir,
         train=False,
@@ -103,9 +139,7 @@ def _get_test_data_loader(test_batch_size, training_dir, **kwargs):
             [transforms.ToTensor(), transforms.Normalize((0.1307,), (0.3081,))]
         ),
     )
-    test_sampler = torch.utils.data.distributed.DistributedSampler(
-        dataset, num_replicas=hvd.size(), rank=hvd.rank()
-    )
+    test_sampler = _sampler(dataset, elastic)
     test_loader = torch.utils.data.DataLoader(
         dataset, batch_size=test_batch_size, sampler=test_sampler, **kwargs
     )
@@ -116,28 +150,39 @@ def train(args):
     """Train the model."""
     logger.debug(f"Number of gpus available - {args.num_gpus}")
 
-    # Horovod: initialize library
+    # Horovod: initialize library, with the fusion buffer and cycle time it reads at init.
+    os.environ.update(fusion_environment(args.fusion_threshold_mb, args.cycle_time_ms))
     hvd.init()
     torch.manual_seed(args.seed)
 
     rank = hvd.rank()
-    # DVC - Retrieve Data from Remote.
-    if rank == 0:
-        logger.info("\nRetrieving Data from DVC.\n")
-        logger.info(f"\nData Directory: {args.data_dir}\n")
-        retrieve_data()
-
-    # Horovod: pin GPU to local rank
-    torch.cuda.set_device(hvd.local_rank())
-    torch.cuda.manual_seed(args.seed)
+    # DVC - Stage the data, and convert it into the tensor cache, once per node, and hold every rank
+    # until it is there. Workers joining an elastic job cannot wait for the others, so each one
+    # prepares it, serialized by the cache's lock and the atomic writes of the tensor cache.
+    if args.elastic or hvd.local_rank() == 0:
+        _prepare_data(args)
+    if not args.elastic:
+        hvd.barrier()
+
+    use_cuda = args.num_gpus > 0 and torch.cuda.is_available()
+    device = torch.device("cuda" if use_cuda else "cpu")
+    if use_cuda:
+        # Horovod: pin GPU to local rank
+        torch.cuda.set_device(hvd.local_rank())
+        torch.cuda.manual_seed(args.seed)
 
     # Horovod: limit number of CPU threads to be used per worker
-    torch.set_num_threads(1)
+    torch.set_num_threads(args.threads_per_worker or _threads_per_worker(use_cuda))
+    logger.debug(f"Training on {device} with {torch.get_num_threads()} threads per worker")
 
-    kwargs = {"num_workers": 1, "pin_memory": True}
+    kwargs = {"num_workers": 1, "pin_memory": use_cuda}
 
-    train_loader = _get_train_data_loader(args.batch_size, args.data_dir, **kwargs)
-    test_loader = _get_test_data_loader(args.test_batch_size, args.data_dir, **kwargs)
+    train_loader = _get_train_data_loader(
+        args.batch_size, args.data_dir, args.data_loader, args.elastic, **kwargs
+    )
+    test_loader = _get_test_data_loader(
+        args.test_batch_size, args.data_dir, args.data_loader, args.elastic, **kwargs
+    )
 
     logger.debug(
         "Processes {}/{} ({:.0f}%) of train data".format(
@@ -161,104 +206,305 @@ def train(args):
 
     lr_scaler = hvd.size()
 
-    model.cuda()
+    model.to(device)
 
     # Horovod: scale learning rate by lr_scaler.
     optimizer = optim.SGD(model.parameters(), lr=args.lr * lr_scaler, momentum=args.momentum)
 
-    # Horovod: broadcast parameters & optimizer state.
-    hvd.broadcast_parameters(model.state_dict(), root_rank=0)
-    hvd.broadcast_optimizer_state(optimizer, root_rank=0)
+    # An elastic job broadcasts rank 0's state, resumed or not, whenever it syncs its workers.
+    start_epoch, start_step = _resume(
+        model, optimizer, args.checkpoint_dir, broadcast=not args.elastic
+    )
+    # Every rank sums its losses on the device; rank 0 reports the average over all ranks.
+    sink = MetricSink(
+        [LoggerBackend(logger), WandbBackend()],
+        rank=rank,
+        allreduce_async=functools.partial(hvd.allreduce_async, op=hvd.Average)
+        if hvd.size() > 1 or args.elastic
+        else None,
+        synchronize=hvd.synchronize,
+    )
 
-    # Horovod: wrap optimizer with DistributedOptimizer.
-    optimizer = hvd.DistributedOptimizer(optimizer, named_parameters=model.named_parameters())
+    if not args.elastic:
+        # Horovod: broadcast parameters & optimizer state.
+        hvd.broadcast_parameters(model.state_dict(), root_rank=0)
+        hvd.broadcast_optimizer_state(optimizer, root_rank=0)
+
+    # Horovod: wrap optimizer with DistributedOptimizer, reducing compressed gradients once every
+    # backward_passes_per_step batches.
+    optimizer = hvd.DistributedOptimizer(
+        optimizer,
+        named_parameters=model.named_parameters(),
+        compression=COMPRESSORS[args.compression],
+        backward_passes_per_step=args.backward_passes_per_step,
+    )
 
-    for epoch in range(1, args.epochs + 1):
-        model.train()
-        for batch_idx, (data, target) in enumerate(train_loader, 1):
-            data, target = data.cuda(), target.cuda()
-            optimizer.zero_grad()
-            output = model(data)
-            loss = F.nll_loss(output, target)
-            loss.backward()
-            optimizer.step()
-            if batch_idx % args.log_interval == 0:
-                logger.info(
-                    "Train Epoch: {} [{}/{} ({:.0f}%)] Loss: {:.6f}".format(
-                        epoch,
-                        batch_idx * len(data),
-                        len(train_loader.sampler),  # type: ignore
-                        100.0 * batch_idx / len(train_loader),
-                        loss.item(),
-                    )  # type: ignore
-                )
-                wandb.log({"Train/Loss": loss.item()})
-        test(model, test_loader)
-    save_model(model, args.model_dir)
+    if args.elastic:
+        # Horovod: the state committed in memory, and restored when workers are lost or added. The
+        # position in the epoch counts the samples trained on by every worker together.
+        state = hvd.elastic.TorchState(
+            model,
+            optimizer,
+            epoch=start_epoch,
+            samples=start_step * args.batch_size * hvd.size(),
+        )
+        _train_elastic(state, args, train_loader, test_loader, device, sink=sink)
+    else:
+        augment = _batch_augment(args, device, rank)
+        checkpointer = AsyncCheckpointer(args.checkpoint_dir) if rank == 0 else None
+        for epoch in range(start_epoch, args.epochs + 1):
+            _train_epoch(
+                model,
+                optimizer,
+                train_loader,
+                device,
+                epoch,
+                start_step=start_step if epoch == start_epoch else 0,
+                log_interval=args.log_interval,
+                backward_passes_per_step=args.backward_passes_per_step,
+                augment=augment,
+                sink=sink,
+                checkpointer=checkpointer,
+                checkpoint_interval=args.checkpoint_interval,
+            )
+            _finish_epoch(
+                model,
+                optimizer,
+                test_loader,
+                device,
+                epoch,
+                args=args,
+                sink=sink,
+                checkpointer=checkpointer,
+            )
+        if checkpointer:
+            checkpointer.close()
+    # Only rank 0 writes the model artifacts. Workers lost by an elastic job change the rank of the
+    # others, so it is read again.
+    if hvd.rank() == 0:
+        save_model(model, args.model_dir)
+        if args.quantize:
+            report = quantize_and_publish(
+                model,
+                args.model_dir,
+                args.data_dir,
+                calibration_samples=args.quantize_calibration_samples,
+                max_accuracy_drop=args.quantize_max_accuracy_drop,
+            )
+            sink.log({f"quantization/{name}": value for name, value in report.items()})
+    sink.close()
     wandb.run.finish()  # type: ignore
 
 
-def _metric_average(val, name):
-    """Compute the average over all workers for a metric tracked by horovod."""
-    tensor = torch.tensor(val)
-    avg_tensor = hvd.allreduce(tensor, name=name)
-    return avg_tensor.item()
-
-
-def test(model, test_loader):
-    """Validate the model."""
-    model.eval()
-    test_loss = 0
-    test_accuracy = 0
-    examples = []
-    predictions = []
-
-    with torch.no_grad():
-        for data, target in test_loader:
-            data, target = data.cuda(), target.cuda()
-            output = model(data)
-            test_loss += F.nll_loss(output, target, size_average=False).item()  # sum up batch loss
-            pred = output.max(1, keepdim=True)[1]  # get the index of the max log-probability
-            test_accuracy += pred.eq(target.view_as(pred)).sum().item()
+@hvd.elastic.run
+def _train_elastic(state, args, train_loader, test_loader, device, *, sink):  # noqa: PLR0913
+    """Train from the last committed state, again every time workers are lost or added.
 
-            # Log example data and predictions
-            examples.append(data.cpu().detach().numpy())
-            predictions.append(pred.cpu().detach().numpy())
-
-    # Horovod: use test_sampler to determine the number of examples in this worker's partition.
-    test_loss /= len(test_loader.sampler)
-    test_accuracy /= len(test_loader.sampler)
-
-    # Horovod: average metric values across workers.
-    test_loss = _metric_average(test_loss, "avg_loss")
-    test_accuracy = _metric_average(test_accuracy, "avg_accuracy")
+    Horovod Elastic calls this once the workers restored their last commit, if one of them was lost,
+    and synced the state of rank 0 to every worker, new ones included. The samplers then shard the
+    samples left in the epoch between the workers, and the learning rate is scaled by their number.
+    The state is committed every `commit_interval` batches and after every epoch.
+    """
+    rank, size = hvd.rank(), hvd.size()
+    train_loader.sampler.reshard(size, rank, state.samples)
+    test_loader.sampler.reshard(size, rank)
+    # Horovod: scale learning rate by the new number of workers.
+    for group in state.optimizer.param_groups:
+        group["lr"] = args.lr * size
+    # Drop the gradients and metrics of the batches trained on since the commit.
+    state.optimizer.zero_grad()
+    sink.reset(rank)
+    augment = _batch_augment(args, device, rank)
+    checkpointer = AsyncCheckpointer(args.checkpoint_dir) if rank == 0 else None
+    try:
+        while state.epoch <= args.epochs:
+            _train_epoch(
+                state.model,
+                state.optimizer,
+                train_loader,
+                device,
+                state.epoch,
+                log_interval=args.log_interval,
+                backward_passes_per_step=args.backward_passes_per_step,
+                augment=augment,
+                sink=sink,
+                state=state,
+                commit_interval=args.commit_interval,
+            )
+            _finish_epoch(
+                state.model,
+                state.optimizer,
+                test_loader,
+                device,
+                state.epoch,
+                args=args,
+                sink=sink,
+                checkpointer=checkpointer,
+            )
+            state.epoch, state.samples = state.epoch + 1, 0
+            train_loader.sampler.reshard(size, rank)
+            state.commit()
+    finally:
+        if checkpointer:
+            checkpointer.close()
+
+
+def _train_epoch(  # noqa: PLR0913
+    model,
+    optimizer,
+    train_loader,
+    device,
+    epoch,
+    *,
+    start_step=0,
+    log_interval=10,
+    backward_passes_per_step=1,
+    augment=None,
+    sink=None,
+    checkpointer=None,
+    checkpoint_interval=0,
+    state=None,
+    commit_interval=0,
+):
+    """Train for one epoch, from its `start_step`-th batch, checkpointing every few batches.
+
+    The loss stays on the device: the sink averages it over every `log_interval` batches and
+    reports it without synchronizing the step loop with the device. The gradients of
+    `backward_passes_per_step` batches are accumulated before each optimizer step, which reduces
+    them over the workers; the last step of an epoch takes the batches left over, and averages
+    their losses over them alone. Every batch is augmented by `augment` once on the device, if
+    given. In an elastic job, `state` counts the samples trained on and is committed every
+    `commit_interval` batches, after an optimizer step.
+    """
+    model.train()
+    if augment:
+        augment.set_epoch(epoch)
+    batches = enumerate(train_loader, 1)
+    if start_step:
+        # Skip the batches trained on before the checkpoint.
+        batches = itertools.islice(batches, start_step, None)
+    for batch_idx, (data, target) in batches:
+        data, target = data.to(device), target.to(device)
+        output = model(augment(data) if augment else data)
+        loss = F.nll_loss(output, target)
+        first = batch_idx - (batch_idx - 1) % backward_passes_per_step
+        passes = min(backward_passes_per_step, len(train_loader) - first + 1)
+        (loss / passes).backward()
+        stepped = batch_idx % backward_passes_per_step == 0 or batch_idx == len(train_loader)
+        if stepped:
+            optimizer.step()
+            optimizer.zero_grad()
+        if state:
+            state.samples += len(data) * hvd.size()
+        if sink:
+            sink.add(**{"Train/Loss": loss})
+            if batch_idx % log_interval == 0:
+                sink.snapshot(epoch=epoch, batch=f"{batch_idx}/{len(train_loader)}")
+        if checkpointer and checkpoint_interval and batch_idx % checkpoint_interval == 0:
+            checkpointer.save(model, optimizer, epoch, batch_idx)
+        if state and commit_interval and stepped and batch_idx % commit_interval == 0:
+            state.commit()
+
+
+def _finish_epoch(  # noqa: PLR0913
+    model, optimizer, test_loader, device, epoch, *, args, sink, checkpointer
+):
+    """Test the model after an epoch, and record its test metrics and checkpoint it on rank 0."""
+    test_loss, test_accuracy = test(model, test_loader, device, args.confusion_matrix, sink)
+    if checkpointer:
+        # Sweeps stop weak trials early on this per-epoch record.
+        append_metrics(
+            args.checkpoint_dir,
+            {"epoch": epoch, "test/Loss": test_loss, "test/Accuracy": 100 * test_accuracy},
+        )
+        checkpointer.save(model, optimizer, epoch + 1, 0)
+
+
+def _resume(model, optimizer, checkpoint_dir, broadcast=True):
+    """Load the newest checkpoint on rank 0, to be broadcast with the initial state.
+
+    The model and optimizer are only loaded on rank 0, and must then be broadcast to every rank.
+    The RNG states are broadcast here, unless `broadcast` is False: workers joining an elastic job
+    cannot take part in a broadcast, and get the position of rank 0 when its state is synced.
+
+    Returns:
+        tuple[int, int]: The epoch to resume at, and the number of its batches already trained on.
+    """
+    checkpoint = load_latest(checkpoint_dir) if hvd.rank() == 0 else None
+    if checkpoint is not None:
+        model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+    position = (
+        (checkpoint["epoch"], checkpoint["step"], checkpoint["rng"]) if checkpoint else (1, 0, None)
+    )
+    if broadcast:
+        position = hvd.broadcast_object(position, root_rank=0, name="resume")
+    epoch, step, rng = position
+    if rng is not None:
+        set_rng_state(rng)
+    return epoch, step
+
+
+def _batch_augment(args, device, rank):
+    """The augmentation of the training batches on the device, different on every rank, if any."""
+    if not args.augment:
+        return None
+    return BatchAugment(
+        device,
+        seed=args.seed,
+        rank=rank,
+        degrees=args.augment_degrees,
+        translate=args.augment_translate,
+        scale=args.augment_scale,
+        shear=args.augment_shear,
+        elastic_alpha=args.augment_elastic_alpha,
+        elastic_sigma=args.augment_elastic_sigma,
+        erasing=args.augment_erasing,
+    )
 
-    # Log example data and predictions using wandb
-    examples = np.concatenate(examples, axis=0)
-    predictions = np.concatenate(predictions, axis=0)
 
-    # Select every 100th image and prediction
-    selected_examples = examples[::100]
-    selected_predictions = predictions[::100]
+def _threads_per_worker(use_cuda):
+    """One thread per GPU worker, otherwise the CPUs of the host split between its workers."""
+    if use_cuda:
+        return 1
+    return max(1, (os.cpu_count() or 1) // hvd.local_size())
 
-    # Convert predictions to integers
-    selected_predictions = selected_predictions.astype(int)
 
-    table_data = [
-        [wandb.Image(img), pred]
-        for img, pred in zip(selected_examples, selected_predictions, strict=False)
-    ]
-    table = wandb.Table(data=table_data, columns=["images", "predictions"])
-    wandb.log({"table": table})
+def test(model, test_loader, device, confusion_matrix, sink):
+    """Validate the model, returning the average test loss and accuracy of every worker.
 
-    logger.info(f"Test set: Average loss: {test_loss:.4f}, Accuracy: {100 * test_accuracy:.2f}%\n")
-    wandb.log({"test/Loss": test_loss, "test/Accuracy": 100 * test_accuracy})
+    The metrics, examples and confusion matrix are reported by the sink, whose writer thread builds
+    the W&B tables.
+    """
+    num_classes = 10 if confusion_matrix else 0
+    totals, examples, predictions = evaluate(model, test_loader, device, num_classes=num_classes)
+
+    # Horovod: sum the loss, accuracy and confusion matrix of every worker in one allreduce.
+    totals = hvd.allreduce(totals, op=hvd.Sum, name="test_totals")
+    test_loss, test_accuracy, confusion = unpack_totals(totals, num_classes)
+
+    # Log every 100th example and its prediction using wandb
+    record = {
+        "test/Loss": test_loss,
+        "test/Accuracy": 100 * test_accuracy,
+        "table": ImageTable(examples, predictions),
+    }
+    if confusion is not None:
+        columns = ["actual", *(f"predicted {label}" for label in range(num_classes))]
+        rows = [[label, *counts] for label, counts in enumerate(confusion)]
+        record["test/ConfusionMatrix"] = Table(columns, rows)
+    sink.log(record)
+    return test_loss, test_accuracy
 
 
 def save_model(model, model_dir):
-    """Save the model."""
+    """Save the model, along with the compiled TorchScript and ONNX artifacts served by model_fn.
+
+    Runs on rank 0 only, which has the same model as every other rank.
+    """
     path = os.path.join(model_dir, "model.pth")
     torch.save(model.cpu().state_dict(), path)
+    export_compiled(model, model_dir)
 
 
 if __name__ == "__main__":
@@ -306,6 +552,176 @@ if __name__ == "__main__":
         default="gloo",
         help="backend for distributed training (tcp, gloo on cpu and gloo, nccl on gpu)",
     )
+    parser.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=0,
+        metavar="N",
+        help="CPU threads per worker (default: 1 with GPUs, else the host's CPUs split between workers)",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default="none",
+        choices=sorted(COMPRESSORS),
+        help="type the gradients are cast to for their allreduce (default: none)",
+    )
+    parser.add_argument(
+        "--backward-passes-per-step",
+        type=int,
+        default=1,
+        metavar="N",
+        help="batches whose gradients are accumulated before each allreduce and step (default: 1)",
+    )
+    parser.add_argument(
+        "--fusion-threshold-mb",
+        type=float,
+        default=0.0,
+        metavar="MB",
+        help="Horovod tensor fusion buffer size in MiB, 0 for Horovod's default (default: 0)",
+    )
+    parser.add_argument(
+        "--cycle-time-ms",
+        type=float,
+        default=0.0,
+        metavar="MS",
+        help="Horovod cycle time for fusing gradients in ms, 0 for Horovod's default (default: 0)",
+    )
+    parser.add_argument(
+        "--elastic",
+        type=int,
+        default=0,
+        metavar="0|1",
+        help="train with Horovod Elastic, carrying on when workers are lost or added, when launched "
+        "by horovodrun with --min-np and --max-np, 1 to enable (default: 0)",
+    )
+    parser.add_argument(
+        "--commit-interval",
+        type=int,
+        default=10,
+        metavar="N",
+        help="batches between commits of the elastic training state, the batches a lost worker "
+        "costs at most (default: 10)",
+    )
+    parser.add_argument(
+        "--data-loader",
+        type=str,
+        default="torchvision",
+        choices=["tensor", "torchvision"],
+        help="tensor: batches sliced from a memory-mapped tensor cache, "
+        "torchvision: per-sample MNIST decoding (default: torchvision)",
+    )
+    parser.add_argument(
+        "--augment",
+        type=int,
+        default=0,
+        metavar="0|1",
+        help="augment the training batches on the device, 1 to enable (default: 0)",
+    )
+    parser.add_argument(
+        "--augment-degrees",
+        type=float,
+        default=10.0,
+        metavar="D",
+        help="largest random rotation, in degrees (default: 10)",
+    )
+    parser.add_argument(
+        "--augment-translate",
+        type=float,
+        default=0.1,
+        metavar="F",
+        help="largest random translation, as a fraction of the image size (default: 0.1)",
+    )
+    parser.add_argument(
+        "--augment-scale",
+        type=float,
+        default=0.1,
+        metavar="F",
+        help="largest random relative zoom in or out (default: 0.1)",
+    )
+    parser.add_argument(
+        "--augment-shear",
+        type=float,
+        default=0.0,
+        metavar="D",
+        help="largest random shear, in degrees (default: 0)",
+    )
+    parser.add_argument(
+        "--augment-elastic-alpha",
+        type=float,
+        default=0.0,
+        metavar="PX",
+        help="largest elastic displacement in pixels, 0 to disable (default: 0)",
+    )
+    parser.add_argument(
+        "--augment-elastic-sigma",
+        type=float,
+        default=4.0,
+        metavar="PX",
+        help="smoothness of the elastic displacements, in pixels (default: 4)",
+    )
+    parser.add_argument(
+        "--augment-erasing",
+        type=float,
+        default=0.0,
+        metavar="P",
+        help="probability of erasing a random rectangle of an image (default: 0)",
+    )
+    parser.add_argument(
+        "--confusion-matrix",
+        type=int,
+        default=0,
+        metavar="0|1",
+        help="log the per-class confusion matrix after every epoch, 1 to enable (default: 0)",
+    )
+    parser.add_argument(
+        "--quantize",
+        type=int,
+        default=1,
+        metavar="0|1",
+        help="publish an int8 model if it passes the accuracy gate, 0 to skip (default: 1)",
+    )
+    parser.add_argument(
+        "--quantize-max-accuracy-drop",
+        type=float,
+        default=0.5,
+        metavar="PP",
+        help="test accuracy the int8 model may lose, in percentage points (default: 0.5)",
+    )
+    parser.add_argument(
+        "--quantize-calibration-samples",
+        type=int,
+        default=2048,
+        metavar="N",
+        help="training images used to calibrate the int8 model (default: 2048)",
+    )
+    parser.add_argument(
+        "--data-cache-dir",
+        type=str,
+        default=CACHE_DIR,
+        help="directory caching the pulled DVC data by md5 (default: the SageMaker warm pool cache)",
+    )
+    parser.add_argument(
+        "--stage-data",
+        type=int,
+        default=1,
+        metavar="0|1",
+        help="stage the DVC data into --data-dir, 0 when it is already there (default: 1)",
+    )
+    parser.add_argument(
+        "--checkpoint-dir",
+        type=str,
+        default=CHECKPOINT_DIR,
+        help="directory of the checkpoints to resume from and write (default: /opt/ml/checkpoints)",
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=int,
+        default=0,
+        metavar="N",
+        help="also checkpoint every N batches, on top of every epoch, 0 to disable, "
+        "elastic jobs only checkpoint every epoch (default: 0)",
+    )
 
     # Sagemaker specific environment variables
     parser.add_argument("--hosts", type=list, default=json.loads(os.environ["SM_HOSTS"]))
@@ -0,0 +1,281 @@
+"""Offline bulk scoring of images through the inference handlers, like a SageMaker batch transform.
+
+Images are streamed from JSONL files, directories of images and tar shards, in the order given.
+They are decoded by `inference.input_fn` in a pool of worker processes, one large batch per task,
+and every batch goes through `predict_fn` and `output_fn` in this process with the model loaded
+once by `model_fn`. At most two batches per worker are in flight, so memory stays bounded whatever
+the size of the inputs.
+
+Predictions are written to a JSONL file, one `{"id", "prediction"}` line per image in input order
+(plus `labels` and `scores` with `--top-k`, or `error` for an image that cannot be decoded). After
+every batch, the number of images scored and the length of the output are saved next to it, so an
+interrupted run resumes where it stopped when started again with the same inputs.
+
+A JSONL line holds one image, base64-encoded as `image` or as a `path` relative to the file, and
+an optional `id`. Images are identified by their path otherwise.
+
+Run it with `python -m mnist_sagemaker_ci_cd.score --model-dir /path/to/model --output
+predictions.jsonl images/ shard-000.tar requests.jsonl`.
+"""
+import argparse
+import base64
+import collections
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+
+from mnist_sagemaker_ci_cd.lib import inference
+from mnist_sagemaker_ci_cd.lib.settings import Settings
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".bmp", ".gif"}
+PROGRESS_SUFFIX = ".progress"
+
+
+def _read_jsonl(path):
+    directory = os.path.dirname(path)
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            key = str(record.get("id", f"{path}:{line_number}"))
+            if "image" in record:
+                yield key, "base64", record["image"]
+            else:
+                yield key, "path", os.path.join(directory, record["path"])
+
+
+def _read_directory(path):
+    for root, directories, files in os.walk(path):
+        directories.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_SUFFIXES:
+                image_path = os.path.join(root, name)
+                yield image_path, "path", image_path
+
+
+def _read_tar(path):
+    with tarfile.open(path, mode="r|*") as archive:
+        for member in archive:
+            if member.isfile():
+                payload = archive.extractfile(member).read()  # type: ignore
+                yield f"{path}/{member.name}", "bytes", payload
+
+
+def read_records(paths):
+    """Stream the images of every input, in order, as `(id, kind, data)` records.
+
+    The data of a record is its bytes, its base64 encoding or its path, as `kind` says, so that
+    files are read and decoded by the workers rather than by this process.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            yield from _read_directory(path)
+        elif path.endswith(".jsonl"):
+            yield from _read_jsonl(path)
+        elif tarfile.is_tarfile(path):
+            yield from _read_tar(path)
+        else:
+            yield path, "path", path
+
+
+def _payload(kind, data):
+    if kind == "path":
+        with open(data, "rb") as f:
+            return f.read()
+    if kind == "base64":
+        return base64.b64decode(data)
+    return data
+
+
+def decode_batch(records):
+    """Decode a batch of records with `input_fn`.
+
+    Returns:
+        tuple[np.ndarray, list[str | None]]: The `(N, 1, 28, 28)` images that could be decoded, and
+            per record, None or the reason it could not be, e.g. a record that is not valid base64.
+    """
+    images, errors = [], []
+    for _, kind, data in records:
+        try:
+            images.append(inference.input_fn(_payload(kind, data), "application/octet-stream"))
+            errors.append(None)
+        except inference.errors.BaseInferenceToolkitError as e:
+            errors.append(e.message)
+        except (OSError, ValueError) as e:  # An unreadable file, or a `binascii.Error`.
+            errors.append(str(e))
+    if not images:
+        return np.empty((0, 1, *inference.IMAGE_SIZE), dtype=np.float32), errors
+    return torch.cat(images).numpy(), errors
+
+
+def _load_progress(output, inputs):
+    """The number of records already scored, truncating the output to what was checkpointed."""
+    progress_path = output + PROGRESS_SUFFIX
+    if not os.path.exists(progress_path):
+        open(output, "w").close()
+        return 0
+    with open(progress_path) as f:
+        progress = json.load(f)
+    if progress["inputs"] != inputs:
+        raise ValueError(
+            f"{progress_path} belongs to a run over {progress['inputs']}, delete it to start over."
+        )
+    with open(output, "r+") as f:
+        f.truncate(progress["offset"])
+    return progress["records"]
+
+
+def _save_progress(output, inputs, records, offset):
+    progress_path = output + PROGRESS_SUFFIX
+    with open(f"{progress_path}.partial", "w") as f:
+        json.dump({"inputs": inputs, "records": records, "offset": offset}, f)
+    os.replace(f"{progress_path}.partial", progress_path)
+
+
+def _lines(records, errors, response):
+    """Format the predictions of a batch, in record order, as JSONL lines."""
+    predictions = iter(zip(*response.values(), strict=True))
+    for (key, _, _), error in zip(records, errors, strict=True):
+        if error is not None:
+            yield json.dumps({"id": key, "error": error}) + "\n"
+        else:
+            yield (
+                json.dumps({"id": key, **dict(zip(response, next(predictions), strict=True))})
+                + "\n"
+            )
+
+
+def score(  # noqa: PLR0913
+    model,
+    inputs,
+    output,
+    *,
+    batch_size=1024,
+    workers=0,
+    top_k=0,
+    log_interval=10.0,
+):
+    """Score every image of `inputs` and append the predictions to `output`, resuming if possible.
+
+    Args:
+        model (ServingModel): The model prepared by `inference.model_fn`.
+        inputs (list[str]): JSONL files, directories of images and tar shards.
+        output (str): The JSONL file of the predictions.
+        batch_size (int): Images per batch, decoded by one worker and scored in one forward pass.
+        workers (int): Decoding processes, 0 to decode in this process.
+        top_k (int): Also return the `top_k` best labels of every image and their probabilities.
+        log_interval (float): Seconds between two progress reports on stderr.
+
+    Returns:
+        dict: The images scored by this run, the images that could not be decoded, the seconds it
+            took and the images per second.
+    """
+    done = _load_progress(output, inputs)
+    records = itertools.islice(read_records(inputs), done, None)
+    batches = iter(lambda: list(itertools.islice(records, batch_size)), [])
+    # Asks `predict_fn` for the `top_k` best labels of every image.
+    context = inference.InvocationContext(f"{inference.TOP_K_ATTRIBUTE}={top_k}")
+    executor = None
+    if workers:
+        executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    pending = collections.deque()
+    scored = failed = 0
+    start = last_log = time.perf_counter()
+    try:
+        with open(output, "a") as f:
+            while True:
+                while len(pending) < max(1, 2 * workers) and (batch := next(batches, None)):
+                    pending.append(
+                        (batch, executor.submit(decode_batch, batch) if executor else None)
+                    )
+                if not pending:
+                    break
+                batch, task = pending.popleft()
+                images, errors = task.result() if task else decode_batch(batch)
+                response = {}
+                if len(images):
+                    prediction = inference.predict_fn(torch.from_numpy(images), model, context)
+                    body, _ = inference.output_fn(prediction, "application/json", context)
+                    response = json.loads(body)
+                f.writelines(_lines(batch, errors, response))
+                f.flush()
+                os.fsync(f.fileno())
+                done += len(batch)
+                scored += len(batch)
+                failed += sum(error is not None for error in errors)
+                _save_progress(output, inputs, done, f.tell())
+                now = time.perf_counter()
+                if now - last_log >= log_interval:
+                    last_log = now
+                    print(f"{done} images, {scored / (now - start):.0f} images/s", file=sys.stderr)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    seconds = time.perf_counter() - start
+    return {
+        "images": scored,
+        "failed": failed,
+        "seconds": seconds,
+        "images_per_second": scored / seconds if seconds else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "inputs", nargs="+", help="JSONL files, directories of images and tar shards"
+    )
+    parser.add_argument(
+        "--model-dir",
+        type=str,
+        default=Settings().model_dir,
+        help="the directory of the model artifacts (default: $SM_MODEL_DIR or /opt/ml/model)",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="predictions.jsonl",
+        help="the JSONL file of the predictions (default: predictions.jsonl)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1024, help="images per batch (default: 1024)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=(os.cpu_count() or 1) - 1,
+        help="decoding processes, 0 to decode in-process (default: the number of CPUs - 1)",
+    )
+    parser.add_argument(
+        "--top-k", type=int, default=0, help="also write the k best labels and their scores"
+    )
+    parser.add_argument(
+        "--log-interval",
+        type=float,
+        default=10.0,
+        help="seconds between two progress reports (default: 10)",
+    )
+    args = parser.parse_args()
+
+    result = score(
+        inference.model_fn(args.model_dir),
+        args.inputs,
+        args.output,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        top_k=args.top_k,
+        log_interval=args.log_interval,
+    )
+    print(
+        f"{result['images']} images ({result['failed']} failed) in {result['seconds']:.1f}s, "
+        f"{result['images_per_second']:.0f} images/s"
+    )
@@ -0,0 +1,407 @@
+"""Hyperparameter sweep of `train.py`, with asynchronous successive halving (ASHA) early stopping.
+
+Every trial samples a configuration from the search space and runs `train.py`, several at a time,
+either as local processes or as SageMaker training jobs. After every epoch, `train.py` appends its
+test accuracy to `metrics.jsonl` in its checkpoint directory, which SageMaker syncs to S3. Trials are
+compared at rungs of `min_epochs * reduction_factor**k` epochs, and a trial whose accuracy is not in
+the top `1 / reduction_factor` of the trials that reached the same rung is stopped there, so the
+compute goes to the promising configurations.
+
+All trials share one staged copy of the dataset: it is staged once, then passed to the local trials
+as their data directory, or uploaded once to S3 as the `training` channel of every job. The best
+configuration is written to `hyperparameters.json`, which the next `fit.py` run trains with.
+
+Run it with `python -m mnist_sagemaker_ci_cd.sweep --trials 16 --parallel 4`, or with
+`--mode sagemaker` to run the trials as training jobs.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from mnist_sagemaker_ci_cd.lib import tensor_data
+from mnist_sagemaker_ci_cd.lib.checkpoint import METRICS_FILE, read_metrics
+from mnist_sagemaker_ci_cd.lib.settings import Settings
+from mnist_sagemaker_ci_cd.lib.staging import dvc_dir_md5, stage_data
+
+HYPERPARAMETERS_FILE = os.path.join(os.path.dirname(__file__), "hyperparameters.json")
+# The entry point of the SageMaker jobs, relative to the repository root, their source directory.
+TRAIN_SCRIPT = "src/mnist_sagemaker_ci_cd/lib/train.py"
+SAGEMAKER_DATA_DIR = "/opt/ml/input/data/training"
+# Outside the repository, which fit.py uploads whole as the jobs' source directory.
+WORK_DIR = os.path.expanduser("~/.cache/mnist-sagemaker-ci-cd")
+# The tuned arguments of train.py: ("log", low, high), ("uniform", low, high) or ("choice", values).
+SEARCH_SPACE = {
+    "lr": ("log", 1e-3, 3e-1),
+    "momentum": ("uniform", 0.0, 0.95),
+    "batch-size": ("choice", [32, 64, 128, 256]),
+}
+
+
+def sample(space, rng):
+    """Draw one configuration from a search space."""
+    config = {}
+    for name, (kind, *bounds) in space.items():
+        if kind == "log":
+            value = math.exp(rng.uniform(math.log(bounds[0]), math.log(bounds[1])))
+        elif kind == "uniform":
+            value = rng.uniform(*bounds)
+        else:
+            config[name] = rng.choice(bounds[0])
+            continue
+        config[name] = float(f"{value:.4g}")
+    return config
+
+
+class Asha:
+    """Asynchronous successive halving: stop trials that fall behind at a rung.
+
+    A trial reaching a rung continues if its accuracy is above the `1 - 1 / reduction_factor`
+    quantile of the accuracies recorded at that rung so far, its own included. Decisions never wait
+    for other trials, so no worker sits idle, and early trials are judged against fewer peers.
+
+    Attributes:
+        rungs (list[int]): The epochs at which trials are compared.
+        results (dict[int, list[float]]): The accuracies recorded at every rung.
+    """
+
+    def __init__(self, min_epochs, max_epochs, reduction_factor=3):
+        """Place the rungs at `min_epochs * reduction_factor**k` epochs, below `max_epochs`."""
+        self.reduction_factor = reduction_factor
+        self.rungs = []
+        epochs = min_epochs
+        while epochs < max_epochs:
+            self.rungs.append(epochs)
+            epochs *= reduction_factor
+        self.results = {rung: [] for rung in self.rungs}
+
+    def report(self, epoch, accuracy):
+        """Record a trial's accuracy after `epoch` epochs, and return whether it should continue."""
+        if epoch not in self.results:
+            return True
+        self.results[epoch].append(accuracy)
+        cutoff = np.percentile(self.results[epoch], 100 * (1 - 1 / self.reduction_factor))
+        return accuracy >= cutoff
+
+
+class LocalTrial:
+    """A trial running `train.py` as a process on this machine, on the CPU."""
+
+    def __init__(self, name, config, args):
+        """Start the process, in a fresh directory for its checkpoints, metrics, model and log."""
+        self.directory = os.path.join(args.output_dir, name)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        model_dir = os.path.join(self.directory, "model")
+        os.makedirs(model_dir)
+        threads = max(1, (os.cpu_count() or 1) // args.parallel)
+        command = [
+            sys.executable,
+            os.path.join(os.path.dirname(__file__), "lib", "train.py"),
+            *_arguments(args, config, args.data_dir),
+            f"--checkpoint-dir={self.directory}",
+            f"--threads-per-worker={threads}",
+        ]
+        environment = {
+            **os.environ,
+            "SM_HOSTS": '["algo-1"]',
+            "SM_CURRENT_HOST": "algo-1",
+            "SM_MODEL_DIR": model_dir,
+            "SM_NUM_GPUS": "0",
+            "WANDB_MODE": "disabled",
+            "WANDB_RUN_ID": name,
+            "GITHUB_SHA": name,
+        }
+        with open(os.path.join(self.directory, "train.log"), "w") as log:
+            self.process = subprocess.Popen(
+                command, env=environment, stdout=log, stderr=subprocess.STDOUT
+            )
+
+    def metrics(self):
+        """The per-epoch metrics written so far."""
+        path = os.path.join(self.directory, METRICS_FILE)
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return read_metrics(f)
+
+    def running(self):
+        """Whether the process is still running."""
+        return self.process.poll() is None
+
+    def stop(self):
+        """Terminate the process."""
+        self.process.terminate()
+        self.process.wait()
+
+
+class SageMakerTrial:
+    """A trial running `train.py` as a SageMaker training job, which reports its metrics to S3."""
+
+    def __init__(self, name, config, args, data_uri):
+        """Launch the job, on the shared `training` channel, without waiting for it."""
+        # Imported here so that local sweeps do not need the SageMaker SDK.
+        import boto3  # noqa: PLC0415
+        import sagemaker  # noqa: PLC0415
+        from sagemaker.estimator import Estimator  # noqa: PLC0415
+
+        settings = Settings()
+        self.name = name
+        self.checkpoint_s3_uri = f"{settings.checkpoint_s3_uri}sweep/{name}/"
+        session = sagemaker.Session(boto3.Session(region_name="us-east-1"))
+        estimator = Estimator(
+            image_uri=settings.ecr_repo_name,
+            role=settings.iam_role,
+            entry_point=TRAIN_SCRIPT,
+            instance_type=args.instance_type,
+            instance_count=1,
+            environment={"WANDB_MODE": "disabled", "WANDB_RUN_ID": name, "GITHUB_SHA": name},
+            hyperparameters={**_hyperparameters(args, config), "data-dir": SAGEMAKER_DATA_DIR},
+            output_path=settings.output_s3_uri,
+            code_location=settings.output_s3_uri,
+            checkpoint_s3_uri=self.checkpoint_s3_uri,
+            use_spot_instances=settings.use_spot_instances,
+            max_run=settings.max_run,
+            max_wait=settings.max_wait if settings.use_spot_instances else None,
+            sagemaker_session=session,
+            source_dir="./",
+            dependencies=["src/mnist_sagemaker_ci_cd/deps/fit/requirements.txt"],
+        )
+        estimator.fit({"training": data_uri}, job_name=name, wait=False, logs="None")
+        self.client = session.sagemaker_client
+        self.s3 = boto3.client("s3")
+
+    def metrics(self):
+        """The per-epoch metrics synced to S3 so far."""
+        bucket, _, prefix = self.checkpoint_s3_uri.removeprefix("s3://").partition("/")
+        try:
+            response = self.s3.get_object(Bucket=bucket, Key=prefix + METRICS_FILE)
+        except self.s3.exceptions.NoSuchKey:
+            return []
+        return read_metrics(response["Body"].read().decode().splitlines())
+
+    def running(self):
+        """Whether the job is still in progress."""
+        job = self.client.describe_training_job(TrainingJobName=self.name)
+        return job["TrainingJobStatus"] == "InProgress"
+
+    def stop(self):
+        """Stop the job."""
+        self.client.stop_training_job(TrainingJobName=self.name)
+
+
+def _hyperparameters(args, config):
+    """The arguments of `train.py` for a trial, besides its data and checkpoint directories."""
+    # Trials only compare test accuracies: the int8 model is left to the final fit.py run.
+    return {"epochs": args.max_epochs, "backend": "gloo", "stage-data": 0, "quantize": 0, **config}
+
+
+def _arguments(args, config, data_dir):
+    """The command line of `train.py` for a local trial, which reads the tensor cache `run` built."""
+    hyperparameters = {
+        **_hyperparameters(args, config),
+        "data-dir": data_dir,
+        "data-loader": "tensor",
+    }
+    return [f"--{name}={value}" for name, value in hyperparameters.items()]
+
+
+def run_sweep(start_trial, scheduler, configs, parallel, poll=5.0):
+    """Run one trial per configuration, `parallel` at a time, stopping the weak ones at every rung.
+
+    Args:
+        start_trial (Callable[[str, dict], LocalTrial | SageMakerTrial]): Starts a trial, given its
+            name and configuration.
+        scheduler (Asha): Decides which trials continue at every rung.
+        configs (list[dict]): The configurations to try.
+        parallel (int): The maximum number of trials running at once.
+        poll (float): The delay between two checks of the running trials, in seconds.
+
+    Returns:
+        list[dict]: Per trial, its name, configuration, last epoch and test accuracy, and whether it
+            was stopped early.
+    """
+    pending = [(f"trial-{index:03d}", config) for index, config in enumerate(configs)]
+    running, results = {}, {}
+    while pending or running:
+        while pending and len(running) < parallel:
+            name, config = pending.pop(0)
+            running[name] = start_trial(name, config)
+            results[name] = {
+                "name": name,
+                "config": config,
+                "epochs": 0,
+                "accuracy": None,
+                "stopped": False,
+            }
+        for name, trial in list(running.items()):
+            # Checked before reading the metrics, so the last epoch of a finished trial is read.
+            alive = trial.running()
+            result = results[name]
+            for record in trial.metrics():
+                if record["epoch"] <= result["epochs"]:
+                    continue
+                result["epochs"], result["accuracy"] = record["epoch"], record["test/Accuracy"]
+                if not scheduler.report(record["epoch"], record["test/Accuracy"]):
+                    print(f"{name}: stopped at epoch {record['epoch']}")
+                    trial.stop()
+                    result["stopped"], alive = True, False
+                    break
+            if not alive:
+                print(
+                    f"{name}: {result['accuracy']}% after {result['epochs']} epochs, {result['config']}"
+                )
+                del running[name]
+        if running:
+            time.sleep(poll)
+    return list(results.values())
+
+
+def best_result(results):
+    """The result of the trial that trained the longest, and then reached the best accuracy.
+
+    None when no trial completed an epoch, e.g. because every one of them failed.
+    """
+    return max(
+        (result for result in results if result["accuracy"] is not None),
+        key=lambda result: (result["epochs"], result["accuracy"]),
+        default=None,
+    )
+
+
+def run(args):
+    """Stage the data once, run the sweep and write the best configuration for `fit.py`."""
+    if args.stage_data:
+        stage_data(args.data_dir, args.dvc_file, args.data_cache_dir)
+    if args.mode == "local":
+        # Built once, rather than raced for by every trial, which all use the `tensor` data loader.
+        tensor_data.build_cache(args.data_dir, train=True)
+        tensor_data.build_cache(args.data_dir, train=False)
+
+        def start_trial(name, config):
+            return LocalTrial(name, config, args)
+
+    else:
+        import boto3  # noqa: PLC0415
+        import sagemaker  # noqa: PLC0415
+
+        md5, _ = dvc_dir_md5(args.dvc_file)
+        data_uri = (
+            sagemaker.Session(boto3.Session(region_name="us-east-1"))
+            .upload_data(
+                os.path.join(args.data_dir, "MNIST", "raw"),
+                bucket="with-context-sagemaker",
+                key_prefix=f"datasets/mnist-staged/{md5}/MNIST/raw",
+            )
+            .removesuffix("/MNIST/raw")
+        )
+        sweep_id = f"{Settings().short_sha}-{int(time.time())}"
+
+        def start_trial(name, config):
+            return SageMakerTrial(f"{sweep_id}-{name}", config, args, data_uri)
+
+    rng = random.Random(args.seed)
+    configs = [sample(SEARCH_SPACE, rng) for _ in range(args.trials)]
+    scheduler = Asha(args.min_epochs, args.max_epochs, args.reduction_factor)
+    results = run_sweep(start_trial, scheduler, configs, args.parallel, args.poll)
+    best = best_result(results)
+    if best is None:
+        print(f"no successful trial, {args.hyperparameters_file} left unchanged")
+        return {"results": results, "best": None}
+    with open(args.hyperparameters_file, "w") as f:
+        json.dump(best["config"], f, indent=4)
+        f.write("\n")
+    print(f"best: {best['name']} {best['accuracy']}% {best['config']}")
+    print(f"wrote {args.hyperparameters_file}")
+    return {"results": results, "best": best}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--mode",
+        type=str,
+        default="local",
+        choices=["local", "sagemaker"],
+        help="run the trials as local processes, or as SageMaker jobs (default: local)",
+    )
+    parser.add_argument(
+        "--trials", type=int, default=16, help="configurations to try (default: 16)"
+    )
+    parser.add_argument(
+        "--parallel", type=int, default=4, help="trials running at once (default: 4)"
+    )
+    parser.add_argument(
+        "--min-epochs", type=int, default=1, help="epochs of the first rung (default: 1)"
+    )
+    parser.add_argument(
+        "--max-epochs", type=int, default=9, help="epochs of a full trial (default: 9)"
+    )
+    parser.add_argument(
+        "--reduction-factor",
+        type=int,
+        default=3,
+        help="1 / the fraction of trials continuing at every rung (default: 3)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="sampling seed (default: 0)")
+    parser.add_argument(
+        "--data-dir",
+        type=str,
+        default=os.path.join(WORK_DIR, "data"),
+        help="the data directory shared by every trial (default: ~/.cache/mnist-sagemaker-ci-cd/data)",
+    )
+    parser.add_argument(
+        "--stage-data",
+        type=int,
+        default=1,
+        metavar="0|1",
+        help="stage the DVC data into --data-dir first, 0 when it is already there (default: 1)",
+    )
+    parser.add_argument(
+        "--dvc-file",
+        type=str,
+        default="data.dvc",
+        help="the .dvc file of the data (default: data.dvc)",
+    )
+    parser.add_argument(
+        "--data-cache-dir",
+        type=str,
+        default=os.path.join(WORK_DIR, "dvc"),
+        help="the cache of the pulled DVC data (default: ~/.cache/mnist-sagemaker-ci-cd/dvc)",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=os.path.join(WORK_DIR, "trials"),
+        help="the directory of the local trials (default: ~/.cache/mnist-sagemaker-ci-cd/trials)",
+    )
+    parser.add_argument(
+        "--instance-type",
+        type=str,
+        default="ml.g4dn.xlarge",
+        help="the instance type of the SageMaker trials (default: ml.g4dn.xlarge)",
+    )
+    parser.add_argument(
+        "--poll", type=float, default=5.0, help="seconds between checks of the trials (default: 5)"
+    )
+    parser.add_argument(
+        "--hyperparameters-file",
+        type=str,
+        default=HYPERPARAMETERS_FILE,
+        help="where the best configuration is written for fit.py (default: next to fit.py)",
+    )
+    parser.add_argument(
+        "--output", type=str, default=None, help="write every trial's results to this JSON file"
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
@@ -1,18 +1,124 @@
 """REST API."""
+import functools
 import json
+import logging
 import os
+from collections.abc import Awaitable, Callable
 
-import boto3
 from dotenv import load_dotenv
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from mangum import Mangum
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 
+try:  # The app container imports `serverless.api`, the Lambda bundle imports `api` from its root.
+    from serverless.backends import Backend, LocalBackend, SageMakerBackend
+    from serverless.batching import MicroBatcher
+    from serverless.cache import DynamoDBStore, MemoryStore, PredictionCache
+    from serverless.preprocess import ImageTooLargeError, Preprocessor
+except ImportError:
+    from backends import Backend, LocalBackend, SageMakerBackend
+    from batching import MicroBatcher
+    from cache import DynamoDBStore, MemoryStore, PredictionCache
+    from preprocess import ImageTooLargeError, Preprocessor
+
+try:  # Shared with the endpoint. The deploy workflow copies them into the Lambda bundle's root.
+    from mnist_sagemaker_ci_cd.lib.raw_format import RAW_CONTENT_TYPE
+    from mnist_sagemaker_ci_cd.lib.stage_metrics import (
+        REQUEST_ID_HEADER,
+        StageMetrics,
+        request_id,
+        valid_request_id,
+    )
+except ImportError:
+    from raw_format import RAW_CONTENT_TYPE
+    from stage_metrics import REQUEST_ID_HEADER, StageMetrics, request_id, valid_request_id
+
+try:  # The app container ships the whole package and can serve the model in-process.
+    from mnist_sagemaker_ci_cd.lib.settings import Settings
+except ImportError:  # The Lambda bundle only ships this directory and always calls SageMaker.
+    Settings = None  # type: ignore
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 ENDPOINT = os.environ.get("DEPLOY_SHA")
-sagemaker_runtime = boto3.client("sagemaker-runtime")
+SETTINGS = Settings() if Settings is not None else None
+
+# In-process backend: the model in SETTINGS.model_dir is loaded once and scored on a pool of
+# SETTINGS.inference_workers threads, with no network hop to SageMaker.
+#
+# SageMaker runtime client: at most SAGEMAKER_MAX_CONCURRENCY invocations are in flight at once,
+# each bounded by the connect/read timeouts and retried with backoff up to SAGEMAKER_MAX_ATTEMPTS.
+# SAGEMAKER_RUNTIME_URL points the client at another runtime, e.g. a local stub endpoint.
+backend: Backend
+if SETTINGS is not None and SETTINGS.inference_backend == "local":
+    backend = LocalBackend(SETTINGS.model_dir, workers=SETTINGS.inference_workers)
+else:
+    backend = SageMakerBackend(
+        ENDPOINT,
+        max_concurrency=int(os.environ.get("SAGEMAKER_MAX_CONCURRENCY", "16")),
+        connect_timeout=float(os.environ.get("SAGEMAKER_CONNECT_TIMEOUT", "2")),
+        read_timeout=float(os.environ.get("SAGEMAKER_READ_TIMEOUT", "30")),
+        max_attempts=int(os.environ.get("SAGEMAKER_MAX_ATTEMPTS", "3")),
+        endpoint_url=os.environ.get("SAGEMAKER_RUNTIME_URL"),
+    )
+
+# Metrics: the latency of every serving stage is recorded in histograms, served on GET /metrics
+# in the Prometheus format and, every METRICS_EMF_INTERVAL seconds (0 disables it), printed as
+# CloudWatch EMF documents. Debug logs are emitted for METRICS_DEBUG_SAMPLE_RATE of the requests.
+METRICS_EMF_INTERVAL = float(os.environ.get("METRICS_EMF_INTERVAL", "0"))
+metrics = StageMetrics(
+    "mnist_api", debug_sample_rate=float(os.environ.get("METRICS_DEBUG_SAMPLE_RATE", "0.01"))
+)
+backend.metrics = metrics
+
+# Prediction cache: uploads are keyed by their bytes and the deployed model, and identical
+# concurrent uploads share one backend call. Entries live for PREDICTION_CACHE_TTL seconds in an
+# in-process LRU of PREDICTION_CACHE_SIZE entries (0 disables the cache), or in the DynamoDB table
+# PREDICTION_CACHE_TABLE when set, so that every Lambda/uvicorn worker shares them.
+CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "4096"))
+CACHE_TTL = float(os.environ.get("PREDICTION_CACHE_TTL", "3600"))
+CACHE_TABLE = os.environ.get("PREDICTION_CACHE_TABLE")
+cache = PredictionCache(
+    DynamoDBStore(CACHE_TABLE, ttl=CACHE_TTL)
+    if CACHE_TABLE
+    else MemoryStore(max_entries=CACHE_SIZE, ttl=CACHE_TTL),
+    model_version=ENDPOINT or "",
+)
+
+# Edge preprocessing: uploads over PREDICT_MAX_UPLOAD_BYTES are rejected, before their body is read
+# when they declare their length. With PREDICT_PREPROCESS=1, uploads are decoded (JPEGs in draft
+# mode), converted to grayscale and resized here, and the endpoint only receives their 784 raw
+# pixels. Images of more than PREDICT_MAX_IMAGE_PIXELS pixels are rejected before they are decoded.
+# The bytes saved are served on GET /preprocess. Preprocessing requires Pillow.
+MAX_UPLOAD_BYTES = int(os.environ.get("PREDICT_MAX_UPLOAD_BYTES", str(6 * 1024 * 1024)))
+preprocessor = (
+    Preprocessor(max_image_pixels=int(os.environ.get("PREDICT_MAX_IMAGE_PIXELS", "50000000")))
+    if os.environ.get("PREDICT_PREPROCESS", "0") == "1"
+    else None
+)
+# The content type of the bodies sent to the backend, when it is not the default.
+UPLOAD_KWARGS = {"content_type": RAW_CONTENT_TYPE} if preprocessor else {}
+
+# Micro-batching: concurrent /predict calls are collected for up to PREDICT_BATCH_WINDOW_MS
+# milliseconds (or PREDICT_MAX_BATCH_SIZE uploads) and sent to the endpoint as one request.
+# A window of 0 disables batching and forwards every upload on its own.
+BATCH_WINDOW_MS = float(os.environ.get("PREDICT_BATCH_WINDOW_MS", "0"))
+MAX_BATCH_SIZE = int(os.environ.get("PREDICT_MAX_BATCH_SIZE", "32"))
+batcher = MicroBatcher(
+    functools.partial(backend.predict_batch, **UPLOAD_KWARGS),
+    max_batch_size=MAX_BATCH_SIZE,
+    window_ms=BATCH_WINDOW_MS,
+)
+
+# Accept header values that get the default JSON body, served through the cache and the batcher.
+# Other formats, such as `.npy` or msgpack, and top-k requests are forwarded on their own, and
+# binary responses are passed through as the endpoint encoded them.
+JSON_MEDIA_RANGES = {"", "*/*", "application/*", "application/json"}
 
 app = FastAPI(
     middleware=[
@@ -26,30 +132,129 @@ app = FastAPI(
 )
 
 
+@app.middleware("http")
+async def reject_large_uploads(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    """Reject an upload that declares a length over the limit, before its body is read."""
+    length = request.headers.get("content-length", "")
+    if request.url.path == "/predict" and length.isdigit() and int(length) > MAX_UPLOAD_BYTES:
+        return JSONResponse(
+            {"detail": f"Uploads are limited to {MAX_UPLOAD_BYTES} bytes."}, status_code=413
+        )
+    return await call_next(request)
+
+
+# Added last, so that it runs first and tags every response, rejections included.
+@app.middleware("http")
+async def propagate_request_id(
+    request: Request, call_next: Callable[[Request], Awaitable[Response]]
+) -> Response:
+    """Tag the request with the caller's request ID, or a new one, and echo it in the response.
+
+    A missing or malformed ID, e.g. one that would add a custom attribute, is replaced by a new one.
+    """
+    request_id.set(valid_request_id(request.headers.get(REQUEST_ID_HEADER)))
+    response = await call_next(request)
+    response.headers[REQUEST_ID_HEADER] = request_id.get()
+    metrics.flush_emf(METRICS_EMF_INTERVAL)
+    return response
+
+
 @app.get("/")
 def read_root() -> str:
     """Read root."""
     return "You have reached the MNIST Sagemaker Endpoint. Please make a POST request to /predict with a file."
 
 
+def _accepts_default_json(accept: str) -> bool:
+    """Whether every media range of an Accept header is satisfied by the default JSON body."""
+    return all(
+        media_range.split(";")[0].strip().lower() in JSON_MEDIA_RANGES
+        for media_range in accept.split(",")
+    )
+
+
 @app.post("/predict")
-async def predict_file(file: UploadFile = File(...)) -> dict:
-    """Predict file."""
-    contents = await file.read()
-    try:
-        response = sagemaker_runtime.invoke_endpoint(
-            EndpointName=ENDPOINT,
-            ContentType="application/octet-stream",  # Change this depending on your payload format
-            Accept="application/json",
-            Body=contents,
+async def predict_file(request: Request, file: UploadFile = File(...), top_k: int = 0) -> Response:
+    """Predict file.
+
+    With `top_k`, the k most likely labels and their probabilities are returned too. Clients that
+    accept `application/x-npy` or `application/x-msgpack` get the endpoint's response as is.
+    """
+    accept = request.headers.get("accept", "")
+    if top_k or not _accepts_default_json(accept):
+        return await _predict_file_as(file, accept, top_k)
+    with metrics.time("api.predict"):
+        contents = await _read(file)
+        if BATCH_WINDOW_MS > 0:
+            predict = batcher.submit
+        else:
+            predict = functools.partial(backend.predict, **UPLOAD_KWARGS)
+        if CACHE_TABLE or CACHE_SIZE > 0:
+            prediction = await cache.get_or_compute(contents, predict)
+        else:
+            prediction = await predict(contents)
+    metrics.debug(logger, "Predicted %s for %s", prediction, file.filename)
+    return JSONResponse(
+        {
+            "filename": file.filename,
+            "prediction": prediction,
+        }
+    )
+
+
+async def _predict_file_as(file: UploadFile, accept: str, top_k: int) -> Response:
+    """Score one upload in the format negotiated by the endpoint, bypassing the cache and batcher."""
+    with metrics.time("api.predict"):
+        contents = await _read(file)
+        body, content_type = await backend.invoke(
+            contents,
+            **UPLOAD_KWARGS,
+            accept=accept or "application/json",
+            attributes={"top-k": top_k} if top_k else None,
         )
-    except Exception as e:
-        raise (e)
-    prediction = json.loads(response["Body"].read().decode("utf-8"))
-    return {
-        "filename": file.filename,
-        "prediction": prediction["prediction"][0],
-    }
+    if not content_type.startswith("application/json"):
+        return Response(content=body, media_type=content_type)
+    result = {key: value[0] for key, value in json.loads(body).items()}
+    return JSONResponse({"filename": file.filename, **result})
+
+
+async def _read(file: UploadFile) -> bytes:
+    """Read an upload, and shrink it to raw pixels on a worker thread when preprocessing."""
+    with metrics.time("api.read"):
+        contents = await file.read()
+    if len(contents) > MAX_UPLOAD_BYTES:  # Uploads that did not declare their length.
+        raise HTTPException(413, f"Uploads are limited to {MAX_UPLOAD_BYTES} bytes.")
+    if preprocessor is None:
+        return contents
+    with metrics.time("api.preprocess"):
+        try:
+            pixels = await run_in_threadpool(preprocessor, contents)
+        except ImageTooLargeError as e:
+            raise HTTPException(413, str(e)) from e
+        except ValueError as e:
+            raise HTTPException(400, str(e)) from e
+    metrics.debug(logger, "Preprocessed %s bytes into %s", len(contents), len(pixels))
+    return pixels
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics() -> str:
+    """Read the stage latency histograms in the Prometheus text format."""
+    return metrics.prometheus()
+
+
+@app.get("/cache")
+def read_cache() -> dict:
+    """Read the prediction cache counters."""
+    return cache.stats()
+
+
+@app.get("/preprocess")
+def read_preprocess() -> dict:
+    """Read the preprocessing counters, empty when preprocessing is disabled."""
+    return preprocessor.stats() if preprocessor else {}
 
 
 handler = Mangum(app)
@@ -0,0 +1,250 @@
+"""Inference backends that the REST API forwards uploads to."""
+from __future__ import annotations
+
+import abc
+import asyncio
+import contextvars
+import functools
+import io
+import json
+import os
+import tarfile
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import boto3
+from botocore.config import Config
+from fastapi import HTTPException
+
+try:  # Shared with the endpoint. The deploy workflow copies them into the Lambda bundle's root.
+    from mnist_sagemaker_ci_cd.lib.raw_format import RAW_CONTENT_TYPE, RAW_SUFFIX
+    from mnist_sagemaker_ci_cd.lib.stage_metrics import StageMetrics, new_request_id, request_id
+except ImportError:
+    from raw_format import RAW_CONTENT_TYPE, RAW_SUFFIX
+    from stage_metrics import StageMetrics, new_request_id, request_id
+
+
+def tar_payloads(
+    payloads: Sequence[bytes], content_type: str = "application/octet-stream"
+) -> bytes:
+    """Pack payloads, in order, into a tar archive that `inference.input_fn` decodes as a batch.
+
+    Payloads of raw pixels, whose content type is `RAW_CONTENT_TYPE`, are named with `RAW_SUFFIX`,
+    so that the endpoint never mistakes them for encoded images.
+    """
+    suffix = RAW_SUFFIX if content_type == RAW_CONTENT_TYPE else ""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for index, payload in enumerate(payloads):
+            info = tarfile.TarInfo(f"{index:06d}{suffix}")
+            info.size = len(payload)
+            archive.addfile(info, io.BytesIO(payload))
+    return buffer.getvalue()
+
+
+def custom_attributes(attributes: Mapping[str, Any] | None = None) -> str:
+    """Format the SageMaker custom attributes of an invocation, starting with the request ID."""
+    return ",".join(
+        f"{key}={value}"
+        for key, value in {"request-id": request_id.get(), **(attributes or {})}.items()
+    )
+
+
+class Backend(abc.ABC):
+    """Base class of the inference backends.
+
+    Subclasses implement `_invoke`, a blocking call that scores one request body. It always runs on
+    the backend's bounded thread pool, so the event loop is never blocked, in the caller's context,
+    so it sees the caller's request ID. Extra SageMaker custom attributes, such as `top-k`, are
+    passed to the inference handlers along with the request ID.
+
+    Attributes:
+        metrics (StageMetrics): Records the latency of every invocation, as the `backend.invoke`
+            stage, when set.
+    """
+
+    _executor: ThreadPoolExecutor
+    metrics: StageMetrics | None = None
+
+    @abc.abstractmethod
+    def _invoke(
+        self,
+        body: bytes,
+        content_type: str,
+        accept: str,
+        attributes: Mapping[str, Any] | None = None,
+    ) -> tuple[bytes, str]:
+        """Score one request body and return the encoded response and its content type."""
+
+    async def invoke(
+        self,
+        body: bytes,
+        content_type: str = "application/octet-stream",
+        accept: str = "application/json",
+        attributes: Mapping[str, Any] | None = None,
+    ) -> tuple[bytes, str]:
+        """Score one request body on the thread pool and return the response and its content type."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(
+            contextvars.copy_context().run, self._invoke, body, content_type, accept, attributes
+        )
+        if self.metrics is None:
+            return await loop.run_in_executor(self._executor, call)
+        with self.metrics.time("backend.invoke"):
+            return await loop.run_in_executor(self._executor, call)
+
+    async def predict(self, payload: bytes, content_type: str = "application/octet-stream") -> Any:
+        """Score a single upload, e.g. raw pixels preprocessed by the API."""
+        body, _ = await self.invoke(payload, content_type)
+        return json.loads(body)["prediction"][0]
+
+    async def predict_batch(
+        self, payloads: Sequence[bytes], content_type: str = "application/octet-stream"
+    ) -> list:
+        """Score several uploads of one content type with a single invocation.
+
+        The uploads may come from different requests, so the invocation carries a request ID of its
+        own rather than that of whichever request it runs on behalf of.
+        """
+        token = request_id.set(new_request_id())
+        try:
+            body, _ = await self.invoke(
+                tar_payloads(payloads, content_type), content_type="application/x-tar"
+            )
+        finally:
+            request_id.reset(token)
+        return json.loads(body)["prediction"]
+
+    def close(self) -> None:
+        """Release the worker threads."""
+        self._executor.shutdown(wait=False)
+
+
+class SageMakerBackend(Backend):
+    """Invoke a SageMaker endpoint without blocking the event loop.
+
+    `boto3` clients are synchronous, so every invocation runs on a bounded thread pool that shares
+    one client, and therefore one pool of kept-alive HTTP connections. The pool size caps the
+    number of in-flight invocations; further requests wait for a free worker. Per-call timeouts and
+    retries with exponential backoff are handled by botocore. The request ID is forwarded to the
+    endpoint as the `request-id` custom attribute.
+
+    Attributes:
+        endpoint_name (str): The name of the SageMaker endpoint.
+        max_concurrency (int): The maximum number of in-flight invocations.
+        client (botocore.client.BaseClient): The shared `sagemaker-runtime` client.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        endpoint_name: str | None,
+        *,
+        max_concurrency: int = 16,
+        connect_timeout: float = 2.0,
+        read_timeout: float = 30.0,
+        max_attempts: int = 3,
+        endpoint_url: str | None = None,
+    ):
+        """Initialize the backend.
+
+        Args:
+            endpoint_name (str): The name of the SageMaker endpoint.
+            max_concurrency (int): The maximum number of in-flight invocations, which is also the
+                size of the HTTP connection pool.
+            connect_timeout (float): Seconds to wait for a connection to the endpoint.
+            read_timeout (float): Seconds to wait for the endpoint to answer one invocation.
+            max_attempts (int): Total attempts per invocation, including retries with backoff.
+            endpoint_url (str): Overrides the SageMaker runtime URL, e.g. to target a local stub.
+        """
+        self.endpoint_name = endpoint_name
+        self.max_concurrency = max_concurrency
+        self.client = boto3.client(
+            "sagemaker-runtime",
+            endpoint_url=endpoint_url,
+            config=Config(
+                max_pool_connections=max_concurrency,
+                connect_timeout=connect_timeout,
+                read_timeout=read_timeout,
+                retries={"max_attempts": max_attempts, "mode": "standard"},
+                tcp_keepalive=True,
+            ),
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="sagemaker-runtime"
+        )
+
+    def _invoke(
+        self,
+        body: bytes,
+        content_type: str,
+        accept: str,
+        attributes: Mapping[str, Any] | None = None,
+    ) -> tuple[bytes, str]:
+        """Invoke the endpoint synchronously and return the raw response body."""
+        response = self.client.invoke_endpoint(
+            EndpointName=self.endpoint_name,
+            ContentType=content_type,
+            Accept=accept,
+            CustomAttributes=custom_attributes(attributes),
+            Body=body,
+        )
+        return response["Body"].read(), response["ContentType"]
+
+    def close(self) -> None:
+        """Release the worker threads and the HTTP connections."""
+        super().close()
+        self.client.close()
+
+
+class LocalBackend(Backend):
+    """Run the SageMaker inference handlers inside the API process.
+
+    The model is loaded once with `inference.load_model`. Every request then goes through
+    `input_fn`, `predict_fn` and `output_fn` on a worker thread, so there is no network hop and no
+    per-invocation billing. PyTorch releases the GIL inside its kernels, so the worker threads
+    score requests in parallel, and each runs its own intra-op threads: the CPUs are split between
+    the workers, so that together they use every CPU once. Client errors of the handlers, such as an
+    upload that does not decode, are raised as `HTTPException`s with the endpoint's status code.
+
+    Attributes:
+        model_dir (str): The directory holding the trained model artifacts.
+        workers (int): The number of worker threads.
+        model (ServingModel): The model loaded, placed and warmed up by `inference.load_model`.
+    """
+
+    def __init__(self, model_dir: str, workers: int | None = None):
+        """Load the model and start the worker threads.
+
+        Args:
+            model_dir (str): The directory holding the trained model artifacts.
+            workers (int): The number of worker threads (default: the number of CPUs).
+        """
+        # Imported here because the Lambda bundle ships neither the package nor PyTorch.
+        from mnist_sagemaker_ci_cd.lib import inference  # noqa: PLC0415
+
+        self._inference = inference
+        self.model_dir = model_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.model = inference.load_model(
+            model_dir, threads=inference.serving_threads(self.workers)
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="inference"
+        )
+
+    def _invoke(
+        self,
+        body: bytes,
+        content_type: str,
+        accept: str,
+        attributes: Mapping[str, Any] | None = None,
+    ) -> tuple[bytes, str]:
+        """Run the inference handlers synchronously and return the encoded response."""
+        context = self._inference.InvocationContext(custom_attributes(attributes))
+        try:
+            data = self._inference.input_fn(body, content_type)
+            prediction = self._inference.predict_fn(data, self.model, context)
+            return self._inference.output_fn(prediction, accept, context)
+        except self._inference.errors.GenericInferenceToolkitError as e:
+            raise HTTPException(e.status_code, e.message) from e
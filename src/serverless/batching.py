@@ -0,0 +1,103 @@
+"""Dynamic micro-batching of concurrent prediction requests."""
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Awaitable, Callable, Sequence
+from http import HTTPStatus
+from typing import Any
+
+PredictBatch = Callable[[Sequence[bytes]], Awaitable[Sequence[Any]]]
+
+
+def rejected_body(error: Exception) -> bool:
+    """Whether an error means the endpoint rejected the request body, rather than failed to serve it.
+
+    That is an `HTTPException` with a 4xx status, as raised by the local backend, or a botocore
+    `ModelError` or other client error with a 4xx status, as raised by the SageMaker runtime.
+    Throttling is a 4xx too, but says nothing about the body.
+    """
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):  # botocore.exceptions.ClientError
+        if response.get("Error", {}).get("Code") == "ModelError":
+            return True
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    else:  # fastapi.HTTPException
+        status = getattr(error, "status_code", None)
+    return (
+        isinstance(status, int)
+        and HTTPStatus.BAD_REQUEST <= status < HTTPStatus.INTERNAL_SERVER_ERROR
+        and status != HTTPStatus.TOO_MANY_REQUESTS
+    )
+
+
+class MicroBatcher:
+    """Collect concurrent payloads and send them to the backend as one batch.
+
+    The first payload to arrive opens a batch window of `window_ms` milliseconds. Every payload
+    submitted while the window is open joins the same batch, which is flushed when the window
+    closes or as soon as it holds `max_batch_size` payloads. Each caller then receives the result
+    at its own position in the batch. When the endpoint rejects a batch, see `rejected_body`, its
+    payloads are retried one by one, so that the rejection only reaches the callers whose payloads
+    cause it. Any other error, such as a timeout or an unavailable endpoint, fails the whole batch.
+
+    Attributes:
+        predict_batch (PredictBatch): Coroutine that scores a sequence of payloads and returns one
+            result per payload, in order.
+        max_batch_size (int): The maximum number of payloads sent in one backend call.
+        window_ms (float): How long the first payload of a batch waits for others to join it.
+    """
+
+    def __init__(
+        self, predict_batch: PredictBatch, max_batch_size: int = 32, window_ms: float = 5.0
+    ):
+        """Initialize the batcher."""
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.window_ms = window_ms
+        self._pending: list[tuple[bytes, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, payload: bytes) -> Any:
+        """Queue a payload for the next batch and wait for its result."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((payload, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        """Hand the pending payloads to the backend as one batch."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # Keep a reference so the task is not garbage collected while in flight.
+            task = asyncio.create_task(self._dispatch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch(self, batch: list[tuple[bytes, asyncio.Future]]) -> None:
+        """Score one batch and fan the results back out to the waiting callers."""
+        try:
+            results = await self.predict_batch([payload for payload, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Expected {len(batch)} predictions, got {len(results)}.")
+        except Exception as e:
+            if len(batch) > 1 and rejected_body(e):
+                # One bad upload fails the whole batch with a 400. Score every upload on its own, so
+                # that only the callers whose uploads fail get an error.
+                await asyncio.gather(*(self._dispatch([item]) for item in batch))
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        # The length is checked above; `strict=True` is unavailable on the Lambda Python 3.9 runtime.
+        for (_, future), result in zip(batch, results):  # noqa: B905
+            if not future.done():
+                future.set_result(result)
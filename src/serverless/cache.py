@@ -0,0 +1,172 @@
+"""Content-addressed prediction cache with in-flight request coalescing."""
+from __future__ import annotations
+
+import asyncio
+import functools
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+import boto3
+
+
+class MemoryStore:
+    """A bounded in-process LRU store whose entries expire after a time-to-live.
+
+    Attributes:
+        max_entries (int): The number of entries kept before the least recently used is evicted.
+        ttl (float): Seconds after which an entry expires.
+        evictions (int): The number of entries evicted, because the store was full or they expired.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 3600.0):
+        """Initialize the store."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    async def get(self, key: str) -> Any:
+        """Return the value stored under `key`, or None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        """Store `value` under `key`, evicting the least recently used entries if full."""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+class DynamoDBStore:
+    """A store shared by every API worker, backed by a DynamoDB table.
+
+    The table must have a string partition key named `key`. Entries carry an `expires_at` epoch
+    timestamp, so enabling DynamoDB TTL on that attribute lets the table evict them. The API's role
+    needs `dynamodb:GetItem` and `dynamodb:PutItem` on the table.
+
+    Attributes:
+        table_name (str): The name of the DynamoDB table.
+        ttl (float): Seconds after which an entry expires.
+        evictions (int): Always 0, DynamoDB evicts entries on its own.
+    """
+
+    def __init__(self, table_name: str, ttl: float = 3600.0, max_concurrency: int = 8):
+        """Initialize the store."""
+        self.table_name = table_name
+        self.ttl = ttl
+        self.evictions = 0
+        self._table = boto3.resource("dynamodb").Table(table_name)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="cache")
+
+    async def _run(self, function: Callable, **kwargs: Any) -> Any:
+        """Run a blocking DynamoDB call on the thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, **kwargs))
+
+    async def get(self, key: str) -> Any:
+        """Return the value stored under `key`, or None."""
+        response = await self._run(self._table.get_item, Key={"key": key})
+        item = response.get("Item")
+        if item is None or int(item["expires_at"]) < time.time():
+            return None
+        return json.loads(item["value"])
+
+    async def set(self, key: str, value: Any) -> None:
+        """Store `value` under `key`."""
+        item = {"key": key, "value": json.dumps(value), "expires_at": int(time.time() + self.ttl)}
+        await self._run(self._table.put_item, Item=item)
+
+
+class PredictionCache:
+    """Serve repeated uploads from a store and collapse concurrent identical uploads.
+
+    Uploads are keyed by the SHA-256 of the model version and the uploaded bytes, so a new
+    deployment never serves predictions of the previous model. While a prediction is being
+    computed, identical uploads wait for it instead of calling the backend again.
+
+    Attributes:
+        store (MemoryStore | DynamoDBStore): Where the predictions are kept.
+        model_version (str): Identifies the deployed model, e.g. the `DEPLOY_SHA`.
+        hits (int): Uploads served from the store.
+        misses (int): Uploads that called the backend.
+        coalesced (int): Uploads that waited on an identical in-flight upload.
+    """
+
+    def __init__(self, store: MemoryStore | DynamoDBStore, model_version: str):
+        """Initialize the cache."""
+        self.store = store
+        self.model_version = model_version
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    def key(self, payload: bytes) -> str:
+        """Return the content address of an upload."""
+        return hashlib.sha256(self.model_version.encode() + b"\0" + payload).hexdigest()
+
+    async def get_or_compute(
+        self, payload: bytes, compute: Callable[[bytes], Awaitable[Any]]
+    ) -> Any:
+        """Return the cached prediction of `payload`, computing it with `compute` on a miss.
+
+        If the upload computing an in-flight prediction is cancelled, e.g. because its client
+        disconnected, the uploads waiting on it compute the prediction themselves.
+        """
+        key = self.key(payload)
+        if key in self._in_flight:
+            self.coalesced += 1
+        while key in self._in_flight:
+            in_flight = self._in_flight[key]
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():  # This upload was cancelled, not the other one.
+                    raise
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await self.store.get(key)
+            if value is None:
+                self.misses += 1
+                value = await compute(payload)
+                await self.store.set(key, value)
+            else:
+                self.hits += 1
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark it retrieved in case nobody was waiting.
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            # Settle the future even when this upload is cancelled, so no one waits on it forever.
+            if not future.done():
+                future.cancel()
+            if self._in_flight.get(key) is future:
+                del self._in_flight[key]
+
+    def stats(self) -> dict:
+        """Return the cache counters."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.store.evictions,
+        }
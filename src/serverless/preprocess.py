@@ -0,0 +1,100 @@
+"""Edge preprocessing of uploads, which shrinks images to the 784 raw bytes the endpoint scores.
+
+`inference.input_fn` decodes an upload, converts it to grayscale and resizes it to 28x28. Without
+preprocessing, every pixel of a multi-megabyte phone photo is uploaded to the endpoint, counted
+against its payload limit and decoded there, only to be thrown away. The API can do that work
+instead. JPEGs are decoded in draft mode, in grayscale and at the smallest DCT scale that is still
+at least 28x28. Every image is then converted and resized like `input_fn` does it, and the endpoint
+receives its `(28, 28)` uint8 pixels as `application/x-mnist-uint8`. Draft decoding is much faster
+than a full decode, and may shift a few pixel values by one or two levels.
+
+Images whose header declares more than `max_image_pixels` pixels are rejected before they are
+decoded. Pillow is only needed when preprocessing is enabled.
+"""
+from __future__ import annotations
+
+import io
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # The Lambda bundle only needs Pillow to preprocess uploads.
+    Image = None  # type: ignore
+
+try:  # Shared with the endpoint. The deploy workflow copies it into the Lambda bundle's root.
+    from mnist_sagemaker_ci_cd.lib.raw_format import IMAGE_SIGNATURES, IMAGE_SIZE, RAW_IMAGE_BYTES
+except ImportError:
+    from raw_format import IMAGE_SIGNATURES, IMAGE_SIZE, RAW_IMAGE_BYTES
+
+
+class ImageTooLargeError(ValueError):
+    """An image with more pixels than the preprocessor accepts."""
+
+
+class Preprocessor:
+    """Shrink uploaded images to raw pixels, counting the bytes it saves.
+
+    Attributes:
+        max_image_pixels (int): The largest width times height of an image that is decoded.
+        images (int): The uploads preprocessed so far.
+        bytes_in (int): Their total size as uploaded.
+        bytes_out (int): Their total size as sent to the endpoint.
+        rejected (int): The images rejected for their size.
+    """
+
+    def __init__(self, max_image_pixels: int = 50_000_000):
+        """Initialize the counters."""
+        if Image is None:
+            raise RuntimeError("Preprocessing uploads requires Pillow.")
+        self.max_image_pixels = max_image_pixels
+        self.images = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, payload: bytes) -> bytes:
+        """Return the raw pixels of an upload, which is decoded unless it already is raw pixels.
+
+        Raises:
+            ImageTooLargeError: If the image has more than `max_image_pixels` pixels.
+            ValueError: If the upload is not an image.
+        """
+        if len(payload) == RAW_IMAGE_BYTES and not payload[:4].startswith(IMAGE_SIGNATURES):
+            pixels = payload
+        else:
+            pixels = self._decode(payload)
+        with self._lock:
+            self.images += 1
+            self.bytes_in += len(payload)
+            self.bytes_out += len(pixels)
+        return pixels
+
+    def _decode(self, payload: bytes) -> bytes:
+        try:
+            image = Image.open(io.BytesIO(payload))  # Only reads the header.
+        except OSError as e:
+            raise ValueError(f"Could not decode the upload as an image: {e}") from e
+        width, height = image.size
+        if width * height > self.max_image_pixels:
+            with self._lock:
+                self.rejected += 1
+            raise ImageTooLargeError(
+                f"The image has {width}x{height} pixels, over the limit of {self.max_image_pixels}."
+            )
+        image.draft("L", IMAGE_SIZE)
+        try:
+            return image.convert("L").resize(IMAGE_SIZE).tobytes()
+        except OSError as e:  # A truncated or corrupt image.
+            raise ValueError(f"Could not decode the upload as an image: {e}") from e
+
+    def stats(self) -> dict:
+        """Return the preprocessing counters."""
+        with self._lock:
+            return {
+                "images": self.images,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "rejected": self.rejected,
+            }